@@ -56,8 +56,13 @@ See COPYING for license information.
 """
 
 from cloudfiles.connection     import Connection, ConnectionPool
+from cloudfiles.authentication import TokenCache
 from cloudfiles.container      import Container
 from cloudfiles.storage_object import Object
+from cloudfiles.utils          import LRUCache, ChunkSize, AdaptiveChunkSize
+from cloudfiles.cache          import DiskCache, ChecksumIndex
+from cloudfiles.asyncclient    import AsyncConnection
+from cloudfiles.instrumentation import RequestHook, HistogramCollector
 from cloudfiles.consts         import __version__
 
 def get_connection(*args, **kwargs):
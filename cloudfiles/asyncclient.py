@@ -0,0 +1,924 @@
+"""
+non-blocking client
+
+AsyncConnection, AsyncContainer and AsyncObject mirror the blocking
+Connection, Container and Object classes, but every operation which talks
+to the remote service returns an L{AsyncRequest} immediately rather than
+waiting for the response. Requests are carried by non-blocking HTTP/1.1
+channels, (kept alive and pooled per host, with a limit on how many are
+open to each host at once), driven by an asyncore event loop.
+
+>>> client = AsyncConnection('jsmith', '1234567890', max_per_host=32)
+>>> container = client.get_container('photos').result()
+>>> requests = [container.create_object(name).read()
+...             for name in ('a.jpg', 'b.jpg', 'c.jpg')]
+>>> client.run()
+>>> [len(request.result()) for request in requests]
+[48211, 10326, 99115]
+
+The session is shared with a blocking L{Connection}, which performs the
+authentication, (and any re-authentication, on a thread of its own so that
+the event loop carries on). Files written are checksummed on threads of
+their own too, and a request
+whose channel sees no progress for timeout seconds fails with
+socket.timeout. TLS channels verify the server's certificate, (against the
+system's CA certificates or those in the ca_certs file), and hostname.
+
+See COPYING for license information.
+"""
+
+import asyncore, asynchat, socket, ssl, sys, md5, mimetypes
+from collections import deque
+from threading   import Thread
+from Queue       import Queue, Empty
+from time        import time
+from connection  import Connection
+from errors      import ResponseError, NoSuchContainer, NoSuchObject, \
+                        InvalidContainerName, InvalidObjectName
+from fjson       import json_loads
+import consts
+
+def _wrap_ssl(sock, host, ca_certs=None):
+    """
+    Wraps a connected socket for a TLS handshake which verifies the
+    server's certificate against ca_certs, (or the system's CA
+    certificates), and its hostname, (where the ssl module has an
+    SSLContext; otherwise the caller checks it after the handshake).
+    """
+    if hasattr(ssl, 'create_default_context'):
+        context = ssl.create_default_context(cafile=ca_certs)
+        return context.wrap_socket(sock, server_hostname=host,
+                                   do_handshake_on_connect=False)
+    return ssl.wrap_socket(sock, cert_reqs=ssl.CERT_REQUIRED,
+                           ca_certs=ca_certs, do_handshake_on_connect=False)
+
+def _match_hostname(cert, host):
+    """
+    Raises ssl.SSLError unless the certificate, (as returned by
+    getpeercert()), names host, (its first label may match a wildcard).
+    """
+    names = [value for (key, value) in cert.get('subjectAltName', ())
+             if key == 'DNS']
+    if not names:
+        names = [value for rdn in cert.get('subject', ())
+                 for (key, value) in rdn if key == 'commonName']
+    host = host.lower()
+    for name in names:
+        name = name.lower()
+        if name == host or (name.startswith('*.') and '.' in host and
+                            host.split('.', 1)[1] == name[2:]):
+            return
+    raise ssl.SSLError('The certificate does not match %s' % host)
+
+class AsyncRequest(object):
+    """
+    A request which is in progress, (in the manner of a future).
+
+    Callbacks added with add_callback() are called with the request once it
+    has completed, successfully or not. Calling result() runs the event loop
+    until the request has completed, then returns its value, (or raises its
+    error).
+
+    @ivar done: whether the request has completed
+    @type done: bool
+    """
+    def __init__(self, client, method, path, hdrs=None, body=None,
+                 transform=None, on_data=None):
+        self.client = client
+        self.method = method
+        self.path = path
+        self.hdrs = hdrs or {}
+        self.body = body
+        self.transform = transform
+        self.on_data = on_data
+        self.done = False
+        self.status = None
+        self.value = self.error = None
+        self.attempts = 0
+        self.token = None
+        self.reauthenticated = False
+        self._callbacks = []
+        self._chunks = []
+
+    def add_callback(self, func):
+        """
+        Calls func with this request once it has completed.
+        """
+        if self.done:
+            func(self)
+        else:
+            self._callbacks.append(func)
+
+    def result(self):
+        """
+        Waits for the request to complete, and returns its value.
+        """
+        self.client.run(until=self)
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def replayable(self):
+        """
+        Returns whether the request can be sent again from the start.
+        """
+        return not hasattr(self.body, 'more')
+
+    def _data(self, data):
+        if self.on_data is not None and 200 <= self.status <= 299:
+            self.on_data(data)
+        else:
+            self._chunks.append(data)
+
+    def _finish(self, value=None, error=None):
+        self.done = True
+        (self.value, self.error) = (value, error)
+        self.client._pending -= 1
+        callbacks, self._callbacks = self._callbacks, []
+        for func in callbacks:
+            func(self)
+
+    def _respond(self, status, reason, headers):
+        body = ''.join(self._chunks)
+        self._chunks = []
+        try:
+            if self.transform is not None:
+                value = self.transform(status, reason, headers, body)
+            elif (status < 200) or (status > 299):
+                raise ResponseError(status, reason)
+            else:
+                value = body
+        except Exception, err:
+            self._finish(error=err)
+        else:
+            self._finish(value)
+
+class _FileProducer(object):
+    """
+    Produces the contents of a file for an asynchat channel.
+    """
+    def __init__(self, fobj, chunksize):
+        self.fobj = fobj
+        self.chunksize = chunksize
+
+    def more(self):
+        return self.fobj.read(self.chunksize)
+
+class _ChunkedProducer(object):
+    """
+    Produces the chunks of an iterable with chunked transfer encoding.
+    """
+    def __init__(self, iterable):
+        self.iterator = iter(iterable)
+        self.finished = False
+
+    def more(self):
+        if self.finished:
+            return ''
+        for chunk in self.iterator:
+            if chunk:
+                return '%X\r\n%s\r\n' % (len(chunk), chunk)
+        self.finished = True
+        return '0\r\n\r\n'
+
+class _HTTPChannel(asynchat.async_chat):
+    """
+    A non-blocking HTTP/1.1 connection, carrying one request at a time.
+    """
+    ac_in_buffer_size = 65536
+    ac_out_buffer_size = 65536
+
+    def __init__(self, pool):
+        asynchat.async_chat.__init__(self, map=pool.client._map)
+        self.pool = pool
+        self.request = None
+        self.used = False
+        self.counted = True
+        self.generation = pool.generation
+        self.deadline = None
+        self._handshaking = False
+        self._want_write = False
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.connect((pool.host, pool.port))
+        self.set_terminator(None)
+
+    # --- tls --------------------------------------------------------------
+
+    def handle_connect(self):
+        if self.pool.is_ssl:
+            self.del_channel()
+            self.set_socket(_wrap_ssl(self.socket, self.pool.host,
+                                      self.pool.client.ca_certs))
+            self._handshaking = True
+            self._handshake()
+
+    def _handshake(self):
+        try:
+            self.socket.do_handshake()
+        except ssl.SSLError, err:
+            if err.args[0] == ssl.SSL_ERROR_WANT_READ:
+                self._want_write = False
+            elif err.args[0] == ssl.SSL_ERROR_WANT_WRITE:
+                self._want_write = True
+            else:
+                raise
+        else:
+            self._handshaking = self._want_write = False
+            if not hasattr(self.socket, 'context'):
+                # Without an SSLContext the hostname is ours to check.
+                _match_hostname(self.socket.getpeercert(), self.pool.host)
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        if self._handshaking:
+            return self._want_write
+        return asynchat.async_chat.writable(self)
+
+    def handle_read(self):
+        self._touch()
+        if self._handshaking:
+            return self._handshake()
+        asynchat.async_chat.handle_read(self)
+        # Decrypted data already read off the socket is invisible to select.
+        while self.pool.is_ssl and self.connected and self.socket.pending():
+            asynchat.async_chat.handle_read(self)
+
+    def handle_write(self):
+        self._touch()
+        if self._handshaking:
+            return self._handshake()
+        asynchat.async_chat.handle_write(self)
+
+    def recv(self, buffer_size):
+        try:
+            return asynchat.async_chat.recv(self, buffer_size)
+        except ssl.SSLError, err:
+            if err.args[0] == ssl.SSL_ERROR_WANT_READ:
+                return ''
+            raise
+
+    def send(self, data):
+        try:
+            return asynchat.async_chat.send(self, data)
+        except ssl.SSLError, err:
+            if err.args[0] in (ssl.SSL_ERROR_WANT_READ,
+                               ssl.SSL_ERROR_WANT_WRITE):
+                return 0
+            raise
+
+    def initiate_send(self):
+        if not self._handshaking:
+            asynchat.async_chat.initiate_send(self)
+
+    # --- requests ---------------------------------------------------------
+
+    def start(self, request):
+        """
+        Sends a request, (its body is produced as the socket allows).
+        """
+        self.request = request
+        request.attempts += 1
+        self._touch()
+        self._state = 'head'
+        self._buffer = []
+        self._received = False
+        self.set_terminator('\r\n\r\n')
+        self.push(self.pool.client._request_head(request))
+        if isinstance(request.body, str):
+            if request.body:
+                self.push(request.body)
+        elif request.body is not None:
+            self.push_with_producer(request.body)
+
+    def collect_incoming_data(self, data):
+        if self.request is None:
+            # Nothing should arrive on an idle connection.
+            self.close()
+            self.pool.discard(self)
+        elif self._state in ('body', 'chunk', 'close'):
+            self._received = True
+            self.request._data(data)
+        else:
+            self._received = True
+            self._buffer.append(data)
+
+    def found_terminator(self):
+        text, self._buffer = ''.join(self._buffer), []
+        state = self._state
+        if state == 'head':
+            self._parse_head(text)
+        elif state == 'body':
+            self._complete()
+        elif state == 'chunk-size':
+            size = int(text.split(';')[0].strip() or '0', 16)
+            if size:
+                (self._state, self._terminator) = ('chunk', size)
+            else:
+                (self._state, self._terminator) = ('trailer', '\r\n')
+            self.set_terminator(self._terminator)
+        elif state == 'chunk':
+            self._state = 'chunk-end'
+            self.set_terminator('\r\n')
+        elif state == 'chunk-end':
+            self._state = 'chunk-size'
+            self.set_terminator('\r\n')
+        elif state == 'trailer':
+            if not text:
+                self._complete()
+
+    def _parse_head(self, text):
+        lines = text.split('\r\n')
+        parts = lines[0].split(None, 2)
+        self._version = parts[0]
+        self._status = int(parts[1])
+        self._reason = len(parts) > 2 and parts[2] or ''
+        if self._status == 100:
+            # Carry on to the real response.
+            return
+        self.request.status = self._status
+        self._headers = []
+        for line in lines[1:]:
+            if ':' in line:
+                (name, value) = line.split(':', 1)
+                self._headers.append((name.strip().lower(), value.strip()))
+        headers = dict(self._headers)
+        connection = headers.get('connection', '').lower()
+        self._will_close = connection == 'close' or \
+                (self._version == 'HTTP/1.0' and connection != 'keep-alive')
+        if self.request.method == 'HEAD' or self._status in (204, 304) or \
+                self._status < 200:
+            self._complete()
+        elif 'chunked' in headers.get('transfer-encoding', '').lower():
+            self._state = 'chunk-size'
+            self.set_terminator('\r\n')
+        elif 'content-length' in headers:
+            length = int(headers['content-length'])
+            if not length:
+                return self._complete()
+            self._state = 'body'
+            self.set_terminator(length)
+        else:
+            self._state = 'close'
+            self._will_close = True
+            self.set_terminator(None)
+
+    def _touch(self):
+        """
+        Extends the deadline of the request in progress, (if any).
+        """
+        if self.request is not None:
+            self.deadline = time() + self.pool.client.timeout
+
+    def _complete(self):
+        request, self.request = self.request, None
+        self.deadline = None
+        self.set_terminator(None)
+        self.used = True
+        if self._will_close:
+            self.close()
+            self.pool.discard(self)
+        else:
+            self.pool.release(self)
+        self.pool.client._respond(request, self._status, self._reason,
+                                  self._headers)
+
+    def handle_close(self):
+        self.close()
+        request, self.request = self.request, None
+        self.pool.discard(self)
+        if request is None:
+            return
+        if self._state == 'close':
+            self.pool.client._respond(request, self._status, self._reason,
+                                      self._headers)
+        elif self.used and not self._received and request.replayable() \
+                and request.attempts < 2:
+            # A kept-alive connection closed by the server while idle.
+            self.pool.submit(request)
+        else:
+            request._finish(error=ResponseError(0, 'Connection closed'))
+
+    def handle_error(self):
+        error = sys.exc_info()[1]
+        self.close()
+        request, self.request = self.request, None
+        self.pool.discard(self)
+        if request is None:
+            # Raised by a callback, (rather than by the request).
+            raise
+        request._finish(error=error)
+
+    def handle_expt(self):
+        self.handle_close()
+
+    def handle_timeout(self):
+        """
+        Fails the request in progress, which has seen no progress before
+        its deadline.
+        """
+        self.close()
+        request, self.request = self.request, None
+        self.pool.discard(self)
+        if request is not None:
+            request._finish(error=socket.timeout('timed out'))
+
+class _HostPool(object):
+    """
+    The channels open to one host, and the requests waiting for one.
+    """
+    def __init__(self, client, host, port, is_ssl, limit):
+        self.client = client
+        (self.host, self.port, self.is_ssl) = (host, port, is_ssl)
+        self.limit = limit
+        self.size = 0
+        self.generation = 0
+        self.idle = []
+        self.queue = deque()
+
+    def submit(self, request):
+        self.queue.append(request)
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.queue:
+            if self.idle:
+                channel = self.idle.pop()
+            elif self.size < self.limit:
+                channel = _HTTPChannel(self)
+                self.size += 1
+            else:
+                return
+            channel.start(self.queue.popleft())
+
+    def release(self, channel):
+        if channel.generation != self.generation:
+            # Busy when the pool was closed.
+            channel.close()
+            self.discard(channel)
+            return
+        self.idle.append(channel)
+        self._dispatch()
+
+    def discard(self, channel):
+        if channel in self.idle:
+            self.idle.remove(channel)
+        if channel.counted:
+            channel.counted = False
+            self.size -= 1
+        self._dispatch()
+
+    def close(self):
+        """
+        Closes the idle channels, and the busy ones once their requests
+        have completed.
+        """
+        self.generation += 1
+        for channel in self.idle:
+            channel.close()
+            channel.counted = False
+            self.size -= 1
+        self.idle = []
+
+class AsyncConnection(object):
+    """
+    A non-blocking counterpart of L{Connection}, and a factory for
+    L{AsyncContainer} instances.
+
+    @ivar conn: the blocking connection which holds the session
+    @type conn: L{Connection}
+    """
+    def __init__(self, username=None, api_key=None, **kwargs):
+        """
+        Accepts the same arguments as L{Connection}, plus the following
+        optional keywords.
+
+        @type connection: L{Connection}
+        @param connection: share the session of this connection rather
+                           than authenticating anew
+        @type max_per_host: int
+        @param max_per_host: the most connections open to a host at once
+        @type map: dict
+        @param map: the asyncore socket map to register channels in, (by
+                    default a private one, run with L{run})
+        @type ca_certs: str
+        @param ca_certs: a file of the CA certificates to verify servers
+                         against, (by default the system's)
+
+        The timeout keyword, (shared with the L{Connection}), gives the
+        seconds a request may go without progress before it fails.
+        """
+        self.conn = kwargs.pop('connection', None)
+        self.max_per_host = kwargs.pop('max_per_host',
+                                       consts.async_max_per_host)
+        self.ca_certs = kwargs.pop('ca_certs', None)
+        self.timeout = kwargs.get('timeout', 5)
+        self._map = kwargs.pop('map', None)
+        if self._map is None:
+            self._map = {}
+        if self.conn is None:
+            self.conn = Connection(username, api_key, **kwargs)
+        self._pools = {}
+        self._pending = 0
+        self._working = 0
+        self._worked = Queue()
+        self._reauthenticating = None
+
+    def _pool(self):
+        (host, port, uri, is_ssl) = self.conn.connection_args
+        key = (host, port, is_ssl)
+        if key not in self._pools:
+            self._pools[key] = _HostPool(self, host, port, is_ssl,
+                                         self.max_per_host)
+        return self._pools[key]
+
+    def _request_head(self, request):
+        (host, port, uri, is_ssl) = self.conn.connection_args
+        request.token = self.conn.token
+        headers = {'Host': '%s:%d' % (host, port),
+                   'User-Agent': consts.user_agent,
+                   'X-Auth-Token': request.token}
+        if request.body is None and request.method not in ('GET', 'HEAD'):
+            headers['Content-Length'] = 0
+        headers.update(request.hdrs)
+        lines = ['%s %s HTTP/1.1' % (request.method, request.path)]
+        lines.extend(['%s: %s' % item for item in headers.iteritems()])
+        return '\r\n'.join(lines) + '\r\n\r\n'
+
+    def request(self, method, path=[], hdrs=None, parms=None, body=None,
+                transform=None, on_data=None):
+        """
+        Starts a request, returning an L{AsyncRequest} for it.
+
+        Given a transform, the value of the request is the result of calling
+        it with the response's status, reason, headers and body, (otherwise
+        it is the body, and a non-2xx status is raised as a ResponseError).
+        Given an on_data callback, it is called with each piece of the body
+        as it arrives instead.
+        """
+        request = self._new_request(method, path, hdrs, parms, body,
+                                    transform, on_data)
+        self._pool().submit(request)
+        return request
+
+    def _new_request(self, method, path=[], hdrs=None, parms=None, body=None,
+                     transform=None, on_data=None):
+        """
+        Returns a pending L{AsyncRequest} which has yet to be submitted.
+        """
+        self._pending += 1
+        return AsyncRequest(self, method, self.conn._path(path, parms),
+                            hdrs, body, transform, on_data)
+
+    def _in_thread(self, func, callback):
+        """
+        Calls func on a thread of its own, then callback with its result
+        and error, (one of them None), on the thread running the loop.
+        """
+        def work():
+            try:
+                result = (func(), None)
+            except Exception, err:
+                result = (None, err)
+            self._worked.put((callback,) + result)
+        self._working += 1
+        thread = Thread(target=work)
+        thread.setDaemon(True)
+        thread.start()
+
+    def _run_worked(self, timeout):
+        """
+        Calls back for the work finished on other threads, waiting up to
+        timeout seconds for some if no channel is open.
+        """
+        block = not self._map
+        while self._working:
+            try:
+                (callback, result, error) = self._worked.get(block, timeout)
+            except Empty:
+                return
+            self._working -= 1
+            block = False
+            callback(result, error)
+
+    def _expire(self, timeout):
+        """
+        Times out the channels whose requests have passed their deadline,
+        and returns how long the next poll may wait, (at most timeout
+        seconds, and no longer than the next deadline).
+        """
+        now = time()
+        if self._working:
+            # Work finished on another thread cannot wake the poll.
+            timeout = min(timeout, 0.05)
+        for channel in self._map.values():
+            deadline = getattr(channel, 'deadline', None)
+            if deadline is None:
+                continue
+            if deadline <= now:
+                channel.handle_timeout()
+            else:
+                timeout = min(timeout, deadline - now)
+        return timeout
+
+    def _respond(self, request, status, reason, headers):
+        if status == 401 and not request.reauthenticated and \
+                request.replayable():
+            request.reauthenticated = True
+            request._chunks = []
+            self._reauthenticate(request)
+            return
+        request._respond(status, reason, headers)
+
+    def _reauthenticate(self, request):
+        """
+        Renews the session token on a thread of its own, then submits
+        request again, (along with any others refused in the meantime).
+        """
+        if self._reauthenticating is not None:
+            self._reauthenticating.append(request)
+            return
+        if request.token != self.conn.token:
+            # Sent before the token was last renewed.
+            self._pool().submit(request)
+            return
+        self._reauthenticating = [request]
+        def reauthenticate():
+            self.conn.auth.invalidate(request.token)
+            self.conn._authenticate()
+        def resubmit(result, error):
+            requests, self._reauthenticating = self._reauthenticating, None
+            for request in requests:
+                if error is not None:
+                    request._finish(error=error)
+                else:
+                    self._pool().submit(request)
+        self._in_thread(reauthenticate, resubmit)
+
+    def run(self, until=None, timeout=1.0):
+        """
+        Runs the event loop until every request, (or the request until),
+        has completed.
+
+        @param until: a request to wait for
+        @type until: L{AsyncRequest}
+        @param timeout: the most seconds each poll of the sockets may wait
+        @type timeout: float
+        """
+        while self._pending and (until is None or not until.done):
+            self._run_worked(timeout)
+            if self._map:
+                asyncore.loop(timeout=self._expire(timeout), map=self._map,
+                              count=1)
+            elif not self._working:
+                raise RuntimeError('Requests are pending with no channel open')
+
+    def close(self):
+        """
+        Closes every idle channel, (and every busy one once its request has
+        completed).
+        """
+        for pool in self._pools.values():
+            pool.close()
+
+    def get_container(self, container_name):
+        """
+        Starts retrieving a container, (see L{Connection.get_container}).
+
+        @rtype: L{AsyncRequest}
+        @return: a request whose value is an L{AsyncContainer}
+        """
+        self.conn._check_container_name(container_name)
+        def transform(status, reason, headers, body):
+            if status == 404:
+                raise NoSuchContainer(container_name)
+            if (status < 200) or (status > 299):
+                raise ResponseError(status, reason)
+            headers = dict(headers)
+            return AsyncContainer(self, container_name,
+                int(headers.get('x-container-object-count', 0) or 0),
+                int(headers.get('x-container-bytes-used', 0) or 0))
+        return self.request('HEAD', [container_name], transform=transform)
+
+    def create_container(self, container_name):
+        """
+        Starts creating a container, (see L{Connection.create_container}).
+
+        @rtype: L{AsyncRequest}
+        @return: a request whose value is an L{AsyncContainer}
+        """
+        self.conn._check_container_name(container_name)
+        def transform(status, reason, headers, body):
+            if (status < 200) or (status > 299):
+                raise ResponseError(status, reason)
+            return AsyncContainer(self, container_name)
+        return self.request('PUT', [container_name], transform=transform)
+
+class AsyncContainer(object):
+    """
+    A non-blocking counterpart of L{Container}, and a factory for
+    L{AsyncObject} instances.
+    """
+    def __init__(self, client, name, object_count=None, size_used=None):
+        if not name or '/' in name:
+            raise InvalidContainerName(name)
+        self.client = client
+        self.name = name
+        self.object_count = object_count
+        self.size_used = size_used
+
+    def list_objects_info(self, prefix=None, limit=None, marker=None,
+                          path=None, **parms):
+        """
+        Starts listing the container's objects, (see
+        L{Container.list_objects_info}).
+
+        @rtype: L{AsyncRequest}
+        @return: a request whose value is a list of dictionaries
+        """
+        for (name, value) in (('prefix', prefix), ('limit', limit),
+                              ('marker', marker), ('path', path)):
+            if value is not None:
+                parms[name] = value
+        parms['format'] = 'json'
+        def transform(status, reason, headers, body):
+            if status == 204:
+                return []
+            if status == 404:
+                raise NoSuchContainer(self.name)
+            if (status < 200) or (status > 299):
+                raise ResponseError(status, reason)
+            return json_loads(body)
+        return self.client.request('GET', [self.name], parms=parms,
+                                   transform=transform)
+
+    def create_object(self, object_name):
+        """
+        Returns an L{AsyncObject} for a new object, (without any request).
+        """
+        return AsyncObject(self, object_name)
+
+    def get_object(self, object_name):
+        """
+        Starts retrieving an existing object, (see L{Container.get_object}).
+
+        @rtype: L{AsyncRequest}
+        @return: a request whose value is an L{AsyncObject}
+        """
+        def transform(status, reason, headers, body):
+            if status == 404:
+                raise NoSuchObject(object_name)
+            if (status < 200) or (status > 299):
+                raise ResponseError(status, reason)
+            return AsyncObject(self, object_name, headers)
+        return self.client.request('HEAD', [self.name, object_name],
+                                   transform=transform)
+
+    def delete_object(self, object_name):
+        """
+        Starts deleting an object, (see L{Container.delete_object}).
+
+        @rtype: L{AsyncRequest}
+        """
+        if isinstance(object_name, AsyncObject):
+            object_name = object_name.name
+        if not object_name:
+            raise InvalidObjectName(object_name)
+        def transform(status, reason, headers, body):
+            # Once deleted, (so that no HEAD in between caches it again).
+            self.client.conn._invalidate(self.name, object_name)
+            if (status < 200) or (status > 299):
+                raise ResponseError(status, reason)
+        return self.client.request('DELETE', [self.name, object_name],
+                                   transform=transform)
+
+class AsyncObject(object):
+    """
+    A non-blocking counterpart of L{Object}.
+    """
+    def __init__(self, container, name, headers=()):
+        if not name or len(name) > consts.object_name_limit:
+            raise InvalidObjectName(name)
+        self.container = container
+        self.name = name
+        self.content_type = self.etag = self.size = self.last_modified = None
+        self.metadata = {}
+        for (name, value) in headers:
+            name = name.lower()
+            if name == 'content-type':
+                self.content_type = value
+            elif name == 'etag':
+                self.etag = value
+            elif name == 'content-length':
+                self.size = int(value)
+            elif name == 'last-modified':
+                self.last_modified = value
+            elif name.startswith('x-object-meta-'):
+                self.metadata[name[14:]] = value
+
+    def _path(self):
+        return [self.container.name, self.name]
+
+    def read(self, size=-1, offset=0, hdrs=None):
+        """
+        Starts reading the object's content, (see L{Object.read}).
+
+        @rtype: L{AsyncRequest}
+        @return: a request whose value is the content as a string
+        """
+        hdrs = dict(hdrs or {})
+        if size > 0:
+            hdrs['Range'] = 'bytes=%d-%d' % (offset, offset + size - 1)
+        return self.container.client.request('GET', self._path(), hdrs=hdrs)
+
+    def stream(self, callback, hdrs=None):
+        """
+        Starts streaming the object's content, calling callback with each
+        piece as it arrives, (see L{Object.stream}).
+
+        @param callback: called with each piece of the content
+        @type callback: callable(str)
+        @rtype: L{AsyncRequest}
+        """
+        def transform(status, reason, headers, body):
+            if (status < 200) or (status > 299):
+                raise ResponseError(status, reason)
+        return self.container.client.request('GET', self._path(),
+                hdrs=dict(hdrs or {}), transform=transform, on_data=callback)
+
+    def _headers(self):
+        content_type = self.content_type or \
+                mimetypes.guess_type(self.name)[0] or \
+                'application/octet-stream'
+        headers = {'Content-Type': content_type}
+        for (key, value) in self.metadata.items():
+            headers['X-Object-Meta-%s' % key] = value
+        return headers
+
+    def _written(self, status, reason, headers, body):
+        self.container.client.conn._invalidate(self.container.name,
+                                               self.name)
+        if (status < 200) or (status > 299):
+            raise ResponseError(status, reason)
+        for (name, value) in headers:
+            if name == 'etag':
+                self.etag = value
+
+    def write(self, data=''):
+        """
+        Starts writing the object's content from a string or file, (see
+        L{Object.write}). The checksum is computed up front and sent for
+        the server to verify, (that of a file on a thread of its own, before
+        the request is sent).
+
+        @type data: str or file
+        @rtype: L{AsyncRequest}
+        """
+        client = self.container.client
+        headers = self._headers()
+        if not hasattr(data, 'read'):
+            self.size = len(data)
+            headers['ETag'] = md5.new(data).hexdigest()
+            headers['Content-Length'] = self.size
+            return client.request('PUT', self._path(), headers, body=data,
+                                  transform=self._written)
+
+        request = client._new_request('PUT', self._path(), headers,
+                                      transform=self._written)
+        def checksum():
+            checksum = md5.new()
+            start = data.tell()
+            buff = data.read(65536)
+            while buff:
+                checksum.update(buff)
+                buff = data.read(65536)
+            size = data.tell() - start
+            data.seek(start)
+            return (checksum.hexdigest(), size)
+        def checksummed(result, error):
+            if error is not None:
+                return request._finish(error=error)
+            (headers['ETag'], self.size) = result
+            headers['Content-Length'] = self.size
+            request.body = _FileProducer(data, client.conn.chunking.size)
+            client._pool().submit(request)
+        client._in_thread(checksum, checksummed)
+        return request
+
+    def send(self, iterable):
+        """
+        Starts writing the object's content from an iterable of strings,
+        (or a file), with chunked transfer encoding, (see L{Object.send}).
+
+        @rtype: L{AsyncRequest}
+        """
+        if hasattr(iterable, 'read'):
+            chunksize = self.container.client.conn.chunking.size
+            iterable = iter(lambda: iterable.read(chunksize), '')
+        headers = self._headers()
+        headers['Transfer-Encoding'] = 'chunked'
+        return self.container.client.request('PUT', self._path(), headers,
+                body=_ChunkedProducer(iterable), transform=self._written)
+
+# vim:set ai sw=4 ts=4 tw=0 expandtab:
@@ -8,11 +8,14 @@ and session tokens.
 See COPYING for license information.
 """
 
-import urllib
+import os, tempfile, urllib
+from threading import Lock, Thread, Event
+from time     import time
 from httplib  import HTTPSConnection, HTTPConnection, HTTPException
 from utils    import parse_url
 from errors   import ResponseError, AuthenticationError, AuthenticationFailed
-from consts   import user_agent, default_authurl
+from consts   import user_agent, default_authurl, default_token_ttl, \
+                     default_token_refresh
 
 class BaseAuthentication(object):
     """
@@ -37,6 +40,16 @@ class BaseAuthentication(object):
         """
         return (None, None, None)
 
+    def invalidate(self, token):
+        """
+        Notifies the authentication instance that a session token has
+        been rejected by the storage system.
+
+        Note: This is a no-op in the base class, sub-classes which cache
+        tokens should override it.
+        """
+        pass
+
 class MockAuthentication(BaseAuthentication):
     """
     Mock authentication class for testing
@@ -85,5 +98,241 @@ class Authentication(BaseAuthentication):
                     "authentication service.")
         
         return (storage_url, cdn_url, auth_token)
-    
+
+class TokenCache(object):
+    """
+    A thread-safe cache of session tokens keyed by authentication URL and
+    username.
+
+    Tokens are considered valid for ttl seconds after they were issued,
+    (None meaning until the storage system rejects them). If a filename
+    is given, the cache is loaded from and saved to it so that short-lived
+    processes can reuse a token issued to an earlier one.
+
+    >>> cache = TokenCache('/var/tmp/cloudfiles-tokens')
+    >>> cache.start_refresher()
+    >>> conn = cloudfiles.get_connection('jsmith', '1234567890',
+    ...                                  token_cache=cache)
+    """
+    def __init__(self, filename=None, ttl=default_token_ttl,
+                 refresh_margin=default_token_refresh):
+        self.filename = filename
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self._lock = Lock()
+        self._key_locks = {}
+        self._entries = {}
+        self._stop = None
+        if filename:
+            self.load()
+
+    def _key(self, auth):
+        return (auth.authurl, auth.headers['x-auth-user'])
+
+    def _key_lock(self, key):
+        self._lock.acquire()
+        try:
+            return self._key_locks.setdefault(key, Lock())
+        finally:
+            self._lock.release()
+
+    def _fetch(self, key, auth):
+        """
+        Authenticate against the remote service and store the result.
+        """
+        authinfo = tuple(auth.authenticate())
+        expires = self.ttl is not None and time() + self.ttl or None
+        self._lock.acquire()
+        try:
+            self._entries[key] = [authinfo, expires, auth]
+        finally:
+            self._lock.release()
+        if self.filename:
+            self.save()
+        return authinfo
+
+    def _valid(self, entry):
+        return entry is not None and (entry[1] is None or entry[1] > time())
+
+    def get(self, auth):
+        """
+        Returns the storage URL, CDN URL and session token for the given
+        authentication instance, authenticating only if no valid token is
+        cached.
+        """
+        key = self._key(auth)
+        entry = self._entries.get(key)
+        if not self._valid(entry):
+            lock = self._key_lock(key)
+            lock.acquire()
+            try:
+                # Another thread may have authenticated while we waited.
+                entry = self._entries.get(key)
+                if not self._valid(entry):
+                    return self._fetch(key, auth)
+            finally:
+                lock.release()
+        # Tokens loaded from disk can only be refreshed once we know how.
+        if entry[2] is None:
+            entry[2] = auth
+        return entry[0]
+
+    def invalidate(self, auth, token):
+        """
+        Discards the cached token for an authentication instance, (if it
+        is the one that was rejected).
+        """
+        key = self._key(auth)
+        lock = self._key_lock(key)
+        lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry and entry[0][2] == token:
+                self._lock.acquire()
+                try:
+                    del self._entries[key]
+                finally:
+                    self._lock.release()
+                if self.filename:
+                    self.save()
+        finally:
+            lock.release()
+
+    def refresh(self):
+        """
+        Re-authenticates any cached token due to expire within
+        refresh_margin seconds.
+        """
+        for (key, entry) in self._entries.items():
+            if entry[1] is None or entry[2] is None or \
+                    entry[1] - time() > self.refresh_margin:
+                continue
+            lock = self._key_lock(key)
+            lock.acquire()
+            try:
+                try:
+                    self._fetch(key, entry[2])
+                except (ResponseError, AuthenticationError,
+                        AuthenticationFailed, HTTPException, IOError):
+                    pass # get() will retry once the token has expired
+            finally:
+                lock.release()
+
+    def start_refresher(self, interval=60):
+        """
+        Starts a daemon thread calling refresh() every interval seconds.
+        """
+        if self._stop:
+            return
+        self._stop = stop = Event()
+        def refresher():
+            while not stop.isSet():
+                stop.wait(interval)
+                if not stop.isSet():
+                    self.refresh()
+        thread = Thread(target=refresher, name='cloudfiles-token-refresher')
+        thread.setDaemon(True)
+        thread.start()
+
+    def stop_refresher(self):
+        """
+        Stops the thread started by start_refresher().
+        """
+        if self._stop:
+            self._stop.set()
+            self._stop = None
+
+    def load(self):
+        """
+        Loads unexpired tokens from the cache file, (if it exists).
+        """
+        try:
+            fobj = open(self.filename, 'r')
+        except IOError:
+            return
+        try:
+            for line in fobj:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) != 6:
+                    continue
+                (authurl, username, url, cdn_url, token, expires) = fields
+                expires = expires and float(expires) or None
+                if expires is not None and expires <= time():
+                    continue
+                self._entries[(authurl, username)] = \
+                        [(url, cdn_url or None, token), expires, None]
+        finally:
+            fobj.close()
+
+    def save(self):
+        """
+        Atomically writes the cached tokens to the cache file, readable
+        only by the current user, (through a uniquely named temporary file
+        in the same directory, so that concurrent saves by other threads
+        and processes never interleave).
+        """
+        self._lock.acquire()
+        try:
+            entries = [(key, entry[0], entry[1])
+                       for (key, entry) in self._entries.items()]
+            (fd, tmpname) = tempfile.mkstemp(
+                    dir=os.path.dirname(self.filename) or os.curdir,
+                    prefix=os.path.basename(self.filename) + '.')
+            try:
+                fobj = os.fdopen(fd, 'w')
+                try:
+                    for ((authurl, username), authinfo, expires) in entries:
+                        (url, cdn_url, token) = authinfo
+                        expires = expires is not None and repr(expires) or ''
+                        fobj.write('\t'.join((authurl, username, url,
+                                              cdn_url or '', token,
+                                              expires)) + '\n')
+                finally:
+                    fobj.close()
+                os.rename(tmpname, self.filename)
+            except:
+                os.path.exists(tmpname) and os.unlink(tmpname)
+                raise
+        finally:
+            self._lock.release()
+
+# A process-wide cache, used by connections created with token_cache=True.
+default_token_cache = TokenCache()
+
+class SharedAuthentication(BaseAuthentication):
+    """
+    Wraps another authentication instance so that a single session token
+    can be shared by any number of connections (and threads).
+
+    The wrapped instance is only consulted when the token cache holds no
+    valid token for it, or after that token has been invalidated. Unless a
+    L{TokenCache} is supplied, tokens are cached privately and only expire
+    when rejected.
+    """
+    def __init__(self, auth, cache=None):
+        self.auth = auth
+        self.authurl = auth.authurl
+        self.headers = auth.headers
+        (self.host, self.port, self.uri, self.is_ssl) = \
+                (auth.host, auth.port, auth.uri, auth.is_ssl)
+        self.conn_class = auth.conn_class
+        if cache is None:
+            cache = TokenCache(ttl=None)
+        self.cache = cache
+
+    def authenticate(self):
+        """
+        Returns the shared storage URL, CDN URL and session token,
+        authenticating against the remote service only when necessary.
+        """
+        return self.cache.get(self.auth)
+
+    def invalidate(self, token):
+        """
+        Discards the shared token, (if it is the one that was rejected),
+        so that the next call to authenticate() will fetch a new one.
+        """
+        self.cache.invalidate(self.auth, token)
+        self.auth.invalidate(token)
+
 # vim:set ai ts=4 sw=4 tw=0 expandtab:
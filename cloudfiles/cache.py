@@ -0,0 +1,364 @@
+"""
+object and checksum caches
+
+A DiskCache keeps copies of downloaded objects in a local directory so that
+repeated reads of an unchanged object cost a conditional GET, (answered
+with 304 Not Modified), and a read of the local copy. A ChecksumIndex
+remembers the MD5 checksums of local files, so that unchanged files are
+not read again to compare them with objects, or to upload them.
+
+See COPYING for license information.
+"""
+
+import md5, mmap, os, tempfile
+from threading import Lock
+from time      import time
+from utils     import LRUCache
+import consts
+
+class DiskCache(object):
+    """
+    A size-bounded, least recently used cache of object content on disk.
+
+    Each cached object is stored as a data file named for its container and
+    object name, with a sidecar .meta file recording its ETag, (and the
+    codec it is compressed with, if any). Once the
+    total size of the cached data exceeds max_size, the least recently used
+    entries are removed.
+
+    >>> cache = DiskCache('/var/cache/cloudfiles', max_size=2**30)
+    >>> conn = cloudfiles.get_connection('jsmith', '1234567890',
+    ...                                  object_cache=cache)
+
+    The index is kept in memory, (and rebuilt from the directory when the
+    cache is created), so a cache directory should only be used by one
+    process at a time.
+
+    @ivar hits: the number of reads answered from the cache
+    @type hits: int
+    @ivar misses: the number of reads which downloaded the object
+    @type misses: int
+    """
+    def __init__(self, directory, max_size=consts.object_cache_size):
+        """
+        @param directory: the directory to store cached objects in, (created
+                          if it does not exist)
+        @type directory: str
+        @param max_size: the maximum total size in bytes of cached data
+        @type max_size: int
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = self.misses = 0
+        self._lock = Lock()
+        # key -> [etag, size, last_used, encoding]
+        self._entries = {}
+        self._size = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._scan()
+
+    def _key(self, container_name, object_name):
+        return md5.new('%s\0%s' % (container_name, object_name)).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _scan(self):
+        """
+        Rebuild the index from the entries already in the cache directory.
+        """
+        for fname in os.listdir(self.directory):
+            if fname.endswith('.tmp'):
+                # An interrupted download.
+                self.abort(self._path(fname))
+            if not fname.endswith('.meta'):
+                continue
+            key = fname[:-5]
+            try:
+                fobj = open(self._path(fname))
+                try:
+                    (etag, encoding) = (fobj.read().split() + [None])[:2]
+                finally:
+                    fobj.close()
+                stat = os.stat(self._path(key))
+            except (IOError, OSError, ValueError):
+                self._remove(key)
+                continue
+            self._entries[key] = [etag, stat.st_size, stat.st_mtime,
+                                  encoding]
+            self._size += stat.st_size
+        self._evict()
+
+    def _remove(self, key):
+        """
+        Remove an entry's files, (the caller must hold the lock).
+        """
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._size -= entry[1]
+        for path in (self._path(key), self._path(key) + '.meta'):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def _evict(self):
+        """
+        Remove least recently used entries until the cache fits in
+        max_size, (the caller must hold the lock).
+        """
+        while self._size > self.max_size and self._entries:
+            oldest = min(self._entries, key=lambda k: self._entries[k][2])
+            self._remove(oldest)
+
+    def etag(self, container_name, object_name):
+        """
+        Returns the ETag of the cached copy of an object, (or None if it
+        is not cached).
+        """
+        entry = self._entries.get(self._key(container_name, object_name))
+        return entry and entry[0] or None
+
+    def encoding(self, container_name, object_name):
+        """
+        Returns the codec the cached copy of an object is compressed with,
+        (or None if it is not compressed, or not cached).
+        """
+        entry = self._entries.get(self._key(container_name, object_name))
+        return entry and entry[3] or None
+
+    def open(self, container_name, object_name, etag):
+        """
+        Returns a read-only mmap of the cached copy of an object, (or None
+        if the cached copy is missing or its ETag does not match).
+        """
+        key = self._key(container_name, object_name)
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if not entry or entry[0] != etag:
+                return None
+            try:
+                data = _map(self._path(key))
+            except (IOError, OSError, EnvironmentError):
+                self._remove(key)
+                return None
+            entry[2] = time()
+            self.hits += 1
+            return data
+        finally:
+            self._lock.release()
+
+    def begin(self):
+        """
+        Returns a file object, (and its name), for downloading a new entry
+        into, which must then be passed to commit() or abort().
+        """
+        (fd, tmpname) = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        return (os.fdopen(fd, 'wb'), tmpname)
+
+    def abort(self, tmpname):
+        """
+        Discards a download started with begin().
+        """
+        try:
+            os.unlink(tmpname)
+        except OSError:
+            pass
+
+    def commit(self, container_name, object_name, etag, tmpname,
+               encoding=None):
+        """
+        Stores a completed download, (compressed with the encoding codec,
+        if given), as the cached copy of an object, and returns a read-only
+        mmap of it. Downloads without an ETag, or too large to fit in the
+        cache, are mapped and then discarded.
+        """
+        key = self._key(container_name, object_name)
+        data = _map(tmpname)
+        size = os.path.getsize(tmpname)
+        self._lock.acquire()
+        try:
+            self.misses += 1
+            self._remove(key)
+            if not etag or size > self.max_size:
+                os.unlink(tmpname)
+                return data
+            fobj = open(self._path(key) + '.meta', 'w')
+            try:
+                fobj.write('%s\n' % etag)
+                if encoding:
+                    fobj.write('%s\n' % encoding)
+            finally:
+                fobj.close()
+            os.rename(tmpname, self._path(key))
+            self._entries[key] = [etag, size, time(), encoding]
+            self._size += size
+            self._evict()
+            return data
+        finally:
+            self._lock.release()
+
+    def invalidate(self, container_name, object_name):
+        """
+        Discards the cached copy of an object, (if any).
+        """
+        self._lock.acquire()
+        try:
+            self._remove(self._key(container_name, object_name))
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """
+        Discards every cached object.
+        """
+        self._lock.acquire()
+        try:
+            for key in self._entries.keys():
+                self._remove(key)
+        finally:
+            self._lock.release()
+
+class ChecksumIndex(object):
+    """
+    A thread-safe, bounded index of the MD5 checksums of local files.
+
+    Checksums are keyed by device and inode, and trusted for as long as a
+    file's size and modification time are unchanged, (so renamed and
+    hard-linked files are not read again either). Once max_entries files
+    are indexed, the least recently used entry is evicted.
+
+    If a filename is given, the index is loaded from it, and written back
+    by L{save}, so that checksums survive from one run to the next.
+
+    >>> index = ChecksumIndex('/var/tmp/cloudfiles-checksums')
+    >>> index.checksum('./backup.tar')
+    'db8b55400b91ce34d800e126e37886f8'
+    >>> index.save()
+    >>> conn = cloudfiles.get_connection('jsmith', '1234567890',
+    ...                                  checksum_index=index)
+    """
+    def __init__(self, filename=None,
+                 max_entries=consts.checksum_index_size):
+        self.filename = filename
+        # (device, inode) -> (size, mtime, checksum)
+        self._entries = LRUCache(max_entries)
+        self._lock = Lock()
+        if filename:
+            self.load()
+
+    def get(self, stat):
+        """
+        Returns the indexed checksum of a file, given its os.stat() result,
+        (or None if it is not indexed or has changed since).
+        """
+        entry = self._entries.get((stat.st_dev, stat.st_ino))
+        if entry and entry[:2] == (stat.st_size, stat.st_mtime):
+            return entry[2]
+        return None
+
+    def put(self, stat, checksum):
+        """
+        Records the checksum of a file, as of the given os.stat() result.
+        """
+        self._entries.put((stat.st_dev, stat.st_ino),
+                          (stat.st_size, stat.st_mtime, checksum))
+
+    def checksum(self, fobj):
+        """
+        Returns the checksum of a file, (given its path or an open file
+        object), reading it only if the index has no checksum for its
+        current size and modification time.
+        """
+        if isinstance(fobj, basestring):
+            fobj = open(fobj, 'rb')
+            try:
+                return self.checksum(fobj)
+            finally:
+                fobj.close()
+        stat = os.fstat(fobj.fileno())
+        checksum = self.get(stat)
+        if checksum is None:
+            position = fobj.tell()
+            fobj.seek(0)
+            checksum = md5.new()
+            buff = fobj.read(consts.mapped_chunk_size)
+            while buff:
+                checksum.update(buff)
+                buff = fobj.read(consts.mapped_chunk_size)
+            fobj.seek(position)
+            checksum = checksum.hexdigest()
+            self.put(stat, checksum)
+        return checksum
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self):
+        """
+        Loads the index from its file, (if it exists).
+        """
+        try:
+            fobj = open(self.filename, 'r')
+        except IOError:
+            return
+        try:
+            for line in fobj:
+                fields = line.split()
+                if len(fields) != 5:
+                    continue
+                (checksum, size, mtime, device, inode) = fields
+                try:
+                    entry = ((int(device), int(inode)),
+                             (int(size), float(mtime), checksum))
+                except ValueError:
+                    # A malformed line, (skipped rather than failing).
+                    continue
+                self._entries.put(*entry)
+        finally:
+            fobj.close()
+
+    def save(self):
+        """
+        Atomically writes the index to its file, (through a uniquely named
+        temporary file in the same directory, so that concurrent saves by
+        other threads and processes never interleave).
+        """
+        self._lock.acquire()
+        try:
+            # Least recently used first, so that loading preserves the order.
+            entries = self._entries.items()
+            (fd, tmpname) = tempfile.mkstemp(
+                    dir=os.path.dirname(self.filename) or os.curdir,
+                    prefix=os.path.basename(self.filename) + '.')
+            try:
+                fobj = os.fdopen(fd, 'w')
+                try:
+                    for ((device, inode), (size, mtime, checksum)) in entries:
+                        fobj.write('%s\t%d\t%r\t%d\t%d\n' %
+                                   (checksum, size, mtime, device, inode))
+                finally:
+                    fobj.close()
+                os.rename(tmpname, self.filename)
+            except:
+                os.path.exists(tmpname) and os.unlink(tmpname)
+                raise
+        finally:
+            self._lock.release()
+
+def _map(path):
+    """
+    Returns a read-only mmap of a file's content, (or an empty string for
+    an empty file, which cannot be mapped).
+    """
+    fobj = open(path, 'rb')
+    try:
+        if not os.fstat(fobj.fileno()).st_size:
+            return ''
+        return mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        fobj.close()
+
+# vim:set ai sw=4 ts=4 tw=0 expandtab:
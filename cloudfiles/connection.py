@@ -8,18 +8,24 @@ Container instances.
 See COPYING for license information.
 """
 
-import  socket
+import  socket, sys
+from    copy      import copy
+from    contextlib import contextmanager
+from    select    import select
+from    threading import Condition
 from    urllib    import quote
-from    httplib   import HTTPSConnection, HTTPConnection, HTTPException
+from    httplib   import HTTPSConnection, HTTPConnection, HTTPException, \
+                         HTTPResponse
 from    container import Container, ContainerResults
-from    utils     import parse_url
+from    utils     import parse_url, iter_pages, LRUCache, chunk_policy
 from    errors    import ResponseError, NoSuchContainer, ContainerNotEmpty, \
-                         InvalidContainerName, CDNNotEnabled
-from    Queue     import Queue, Empty, Full
+                         InvalidContainerName, CDNNotEnabled, PoolExhausted
 from    time      import time
 import  consts
-from    authentication import Authentication
-from    fjson     import json_loads
+from    authentication import Authentication, SharedAuthentication, \
+                                default_token_cache
+from    fjson     import json_iter_loads
+from    instrumentation import RequestEvent
 
 # Because HTTPResponse objects *have* to have read() called on them 
 # before they can be used again ...
@@ -35,6 +41,19 @@ class Connection(object):
     @undocumented: cdn_request
     @undocumented: make_request
     @undocumented: _check_container_name
+    @undocumented: _list_containers_response
+    @undocumented: _head
+    @undocumented: _invalidate, _cache_key
+    @undocumented: _path
+    @undocumented: _drain
+    @undocumented: _prepare_connection
+    @undocumented: _begin_request, _get_response
+    @undocumented: _request_head
+    @ivar connect_count: the number of requests which opened a new socket
+    @type connect_count: int
+    @ivar reuse_count: the number of requests sent on an already open,
+                       (kept-alive), socket
+    @type reuse_count: int
     """
     def __init__(self, username=None, api_key=None, **kwargs):
         """
@@ -46,6 +65,26 @@ class Connection(object):
         @param username: a Mosso username
         @type api_key: str
         @param api_key: a Mosso API key
+        @type token_cache: L{TokenCache} or bool
+        @param token_cache: share session tokens through this cache, (or
+                            the process-wide cache if True)
+        @type metadata_cache: L{LRUCache} or bool
+        @param metadata_cache: answer account, container and object HEAD
+                               requests from this cache, (or a new cache
+                               with the default size and ttl if True)
+        @type object_cache: L{DiskCache}
+        @param object_cache: keep local copies of downloaded objects in this
+                             cache, revalidating them on each read
+        @type chunk_size: int, str or L{ChunkSize}
+        @param chunk_size: the number of bytes object transfers read and
+                           write at once, (or "adaptive" to size chunks by
+                           the observed throughput)
+        @type checksum_index: L{ChecksumIndex}
+        @param checksum_index: take the checksums of unchanged local files
+                               from this index rather than reading them
+        @type hooks: list of L{RequestHook}
+        @param hooks: hooks called before and after every request, (see
+                      L{make_request})
         """
         self.cdn_enabled = False
         self.cdn_args = None
@@ -53,6 +92,8 @@ class Connection(object):
         self.cdn_connection = None
         self.connection = None
         self.token = None
+        self.connect_count = self.reuse_count = 0
+        self._response = None
         self.debuglevel = int(kwargs.get('debuglevel', 0))
         socket.setdefaulttimeout = int(kwargs.get('timeout', 5))
         self.auth = kwargs.has_key('auth') and kwargs['auth'] or None
@@ -63,6 +104,18 @@ class Connection(object):
                 self.auth = Authentication(username, api_key, authurl)
             else:
                 raise TypeError("Incorrect or invalid arguments supplied")
+
+        token_cache = kwargs.get('token_cache', None)
+        if token_cache and not isinstance(self.auth, SharedAuthentication):
+            if token_cache is True:
+                token_cache = default_token_cache
+            self.auth = SharedAuthentication(self.auth, token_cache)
+
+        self.metadata_cache = _metadata_cache(kwargs.get('metadata_cache'))
+        self.object_cache = kwargs.get('object_cache', None)
+        self.checksum_index = kwargs.get('checksum_index', None)
+        self.hooks = list(kwargs.get('hooks', None) or ())
+        self.chunking = chunk_policy(kwargs.get('chunk_size', None))
         
         self._authenticate()
         
@@ -95,78 +148,442 @@ class Connection(object):
         self.connection = self.conn_class(host, port=port)
         self.connection.set_debuglevel(self.debuglevel)
 
-    def cdn_request(self, method, path=[], data='', hdrs=None):
+    def clone(self):
+        """
+        Return a new connection to the same account, reusing this
+        connection's session token rather than authenticating again.
+
+        @rtype: L{Connection}
+        @return: a new connection object
+        """
+        connobj = copy(self)
+        connobj.connection = connobj.cdn_connection = None
+        connobj.connect_count = connobj.reuse_count = 0
+        connobj._response = None
+        connobj.http_connect()
+        if connobj.cdn_url:
+            connobj.cdn_connect()
+        return connobj
+
+    def close(self):
+        """
+        Close the underlying storage and CDN http connections.
+        """
+        for conn in (self.connection, self.cdn_connection):
+            if conn:
+                conn.close()
+
+    def cdn_request(self, method, path=[], data='', hdrs=None, parms=None):
         """
         Given a method (i.e. GET, PUT, POST, etc), a path, data, header and
-        metadata dicts, performs an http request against the CDN service.
+        metadata dicts, and an optional dictionary of query parameters,
+        performs an http request against the CDN service.
         """
         if not self.cdn_enabled:
             raise CDNNotEnabled()
 
+        event = RequestEvent('cdn', method, path, len(data))
         path = '/%s/%s' % \
-                 (self.uri.rstrip('/'), '/'.join([quote(i) for i in path]))
+                 (self.uri.rstrip('/'), '/'.join([_quote(i) for i in path]))
+
+        if isinstance(parms, dict) and parms:
+            query_args = \
+                ['%s=%s' % (_quote(x),_quote(y)) for (x,y) in parms.items()]
+            path = '%s?%s' % (path, '&'.join(query_args))
         headers = {'Content-Length': len(data), 'User-Agent': consts.user_agent, 
                    'X-Auth-Token': self.token}
         if isinstance(hdrs, dict):
             headers.update(hdrs)
-        
-        # Send the request
-        self.cdn_connection.request(method, path, data, headers)
+        event.path = path
+        self._notify('before_request', event)
 
         def retry_request():
             '''Re-connect and re-try a failed request once'''
+            event.retries += 1
             self.cdn_connect()
-            self.cdn_connection.request(method, path, data, headers)
-            return self.cdn_connection.getresponse()
+            return self._send_request(self.cdn_connection, method, path,
+                                      data, headers, event)
 
         try:
-            response = self.cdn_connection.getresponse()
-        except HTTPException:
-            response = retry_request()
+            try:
+                response = self._send_request(self.cdn_connection, method,
+                                              path, data, headers, event)
+            except HTTPException:
+                response = retry_request()
 
-        if response.status == 401:
-            self._authenticate()
-            response = retry_request()
+            if response.status == 401:
+                self._reauthenticate(event)
+                response = retry_request()
+        except:
+            error = sys.exc_info()
+            self._failed(event, error[1])
+            raise error[0], error[1], error[2]
 
+        self._completed(event, response)
         return response
 
 
-    def make_request(self, method, path=[], data='', hdrs=None, parms=None):
+    def _path(self, path=[], parms=None):
         """
-        Given a method (i.e. GET, PUT, POST, etc), a path, data, header and
-        metadata dicts, and an optional dictionary of query parameters, 
-        performs an http request.
+        Returns the request URI for a path and query parameters.
         """
         path = '/%s/%s' % \
-                 (self.uri.rstrip('/'), '/'.join([quote(i) for i in path]))
+                 (self.uri.rstrip('/'), '/'.join([_quote(i) for i in path]))
         
         if isinstance(parms, dict) and parms:
             query_args = \
-                ['%s=%s' % (quote(x),quote(str(y))) for (x,y) in parms.items()]
+                ['%s=%s' % (_quote(x),_quote(y)) for (x,y) in parms.items()]
             path = '%s?%s' % (path, '&'.join(query_args))
+        return path
+
+    def _drain(self):
+        """
+        Readies the socket of the previous response for reuse, and discards
+        an idle socket which the server has closed.
+
+        A response with nothing left to read is closed, but one whose body
+        is still being read is left to its caller, (the connection moves on
+        to a new socket, and the old one closes with the response).
+        """
+        response, self._response = self._response, None
+        if response is not None and not response.isclosed():
+            if response.length != 0:
+                self.http_connect()
+                return
+            response.close()
+        if _is_stale(self.connection.sock):
+            self.connection.close()
+
+    def _prepare_connection(self):
+        """
+        Readies the http connection for a new request, and returns whether
+        the request will reuse an open socket.
+        """
+        self._drain()
+        if self.connection.sock is None:
+            self.connect_count += 1
+            return False
+        self.reuse_count += 1
+        return True
+
+    def make_request(self, method, path=[], data='', hdrs=None, parms=None):
+        """
+        Given a method (i.e. GET, PUT, POST, etc), a path, data, header and
+        metadata dicts, and an optional dictionary of query parameters, 
+        performs an http request.
+
+        The request is described by a L{RequestEvent}, passed to the
+        before_request and after_request methods of each of the
+        connection's hooks, (see L{RequestHook}).
+        """
+        event = RequestEvent('storage', method, path, len(data))
+        path = self._path(path, parms)
             
         headers = {'Content-Length': len(data), 'User-Agent': consts.user_agent, 
                    'X-Auth-Token': self.token}
         isinstance(hdrs, dict) and headers.update(hdrs)
+        event.path = path
+        self._notify('before_request', event)
         
         def retry_request():
             '''Re-connect and re-try a failed request once'''
+            event.retries += 1
             self.http_connect()
-            self.connection.request(method, path, data, headers)
-            return self.connection.getresponse()
+            return self._send_request(self.connection, method, path, data,
+                                      headers, event)
 
         try:
-            self.connection.request(method, path, data, headers)
-            response = self.connection.getresponse()
-        except HTTPException:
-            response = retry_request()
-            
-        if response.status == 401:
-            self._authenticate()
-            response = retry_request()
+            reused = self._prepare_connection()
+            try:
+                response = self._send_request(self.connection, method, path,
+                                              data, headers, event)
+            except HTTPException:
+                response = retry_request()
+            except socket.error:
+                # A kept-alive socket can be closed by the server at any time.
+                if not reused:
+                    raise
+                response = retry_request()
+
+            if response.status == 401:
+                self._reauthenticate(event)
+                response = retry_request()
+        except:
+            error = sys.exc_info()
+            self._failed(event, error[1])
+            raise error[0], error[1], error[2]
+
+        self._response = response
+        self._completed(event, response)
+        return response
 
+    def _send_request(self, connection, method, path, data, headers, event):
+        """
+        Sends a request on an http connection and returns its response,
+        timing the connection, (if one is opened), and the first byte.
+        """
+        if connection.sock is None:
+            start = time()
+            connection.connect()
+            event.connect_time += time() - start
+        connection.request(method, path, data, headers)
+        start = time()
+        response = connection.getresponse()
+        event.ttfb = time() - start
         return response
 
+    def _reauthenticate(self, event):
+        """
+        Renews a session token rejected during a request.
+        """
+        event.reauthenticated = True
+        start = time()
+        self.auth.invalidate(self.token)
+        self._authenticate()
+        event.auth_time += time() - start
+
+    def _notify(self, name, event):
+        """
+        Passes an event to a method of each hook, ignoring any exception a
+        hook raises, (which must neither fail the request nor hide the
+        error it failed with).
+        """
+        for hook in self.hooks:
+            try:
+                getattr(hook, name)(event)
+            except Exception:
+                pass
+
+    def _completed(self, event, response, length=None):
+        event.status = response.status
+        event.reason = response.reason
+        event.bytes_received = response.length
+        if length is not None:
+            event.bytes_received = length
+        event.latency = time() - event.start
+        self._notify('after_request', event)
+
+    def _failed(self, event, error):
+        event.error = error
+        event.latency = time() - event.start
+        self._notify('after_request', event)
+
+    def _begin_request(self, method, path, headers):
+        """
+        Sends the request line and headers of a request whose body will be
+        sent by the caller, and returns the http connection to send it on
+        along with the L{RequestEvent} describing the request, (which the
+        caller passes to L{_get_response}, or to L{_failed}).
+        """
+        event = RequestEvent('storage', method, path,
+                             int(headers.get('Content-Length') or 0))
+        path = event.path = self._path(path)
+        self._notify('before_request', event)
+
+        def send_headers():
+            if self.connection.sock is None:
+                start = time()
+                self.connection.connect()
+                event.connect_time += time() - start
+            self.connection.putrequest(method, path)
+            for (key, value) in headers.iteritems():
+                self.connection.putheader(key, value)
+            self.connection.endheaders()
+
+        try:
+            reused = self._prepare_connection()
+            try:
+                send_headers()
+            except (socket.error, HTTPException):
+                if not reused:
+                    raise
+                event.retries += 1
+                self.http_connect()
+                send_headers()
+        except:
+            error = sys.exc_info()
+            self._failed(event, error[1])
+            raise error[0], error[1], error[2]
+        return (self.connection, event)
+
+    def _get_response(self, connection, event):
+        """
+        Returns the response to a request begun with L{_begin_request},
+        once its body has been sent, and passes the completed event to the
+        hooks.
+        """
+        start = time()
+        response = connection.getresponse()
+        event.ttfb = time() - start
+        self._response = response
+        self._completed(event, response)
+        return response
+
+    def _request_head(self, method, path, hdrs=None):
+        """
+        Returns the request line and headers of a body-less request.
+        """
+        headers = {'Host': '%s:%d' % (self.connection.host,
+                                      self.connection.port),
+                   'Content-Length': 0, 'User-Agent': consts.user_agent,
+                   'X-Auth-Token': self.token}
+        isinstance(hdrs, dict) and headers.update(hdrs)
+        lines = ['%s %s HTTP/1.1' % (method, path)]
+        lines.extend(['%s: %s' % item for item in headers.iteritems()])
+        return '\r\n'.join(lines) + '\r\n\r\n'
+
+    def batch_request(self, requests, depth=consts.pipeline_depth):
+        """
+        Performs many small GET, HEAD or DELETE requests back-to-back over
+        a single kept-alive socket, returning a list of (status, reason,
+        headers, body) tuples in the same order as requests.
+
+        Up to depth requests are pipelined, (sent before their responses
+        are read). Cached metadata and content of whatever is deleted are
+        invalidated. Should the server close the connection part way, the
+        unanswered requests are sent again on a new socket.
+
+        >>> connection.batch_request([('HEAD', ['container1', 'obj1']),
+        ...                           ('DELETE', ['container1', 'obj2'])])
+        [(204, 'No Content', [...], ''), (204, 'No Content', [...], '')]
+
+        @param requests: (method, path) or (method, path, hdrs) tuples,
+                         where path is a list as given to make_request
+        @type requests: iterable
+        @param depth: the most requests to have in flight at once, (1
+                      disables pipelining)
+        @type depth: int
+        @rtype: list
+        @return: a (status, reason, headers, body) tuple for each request
+        """
+        events = [RequestEvent('storage', req[0], req[1], 0)
+                  for req in requests]
+        paths = [req[1] for req in requests]
+        requests = [(req[0], self._path(req[1]), len(req) > 2 and req[2]
+                     or None) for req in requests]
+        for req in requests:
+            if req[0] not in ('GET', 'HEAD', 'DELETE'):
+                raise ValueError('Only GET, HEAD and DELETE requests may be '
+                                 'batched, not %s' % req[0])
+        results = []
+        sent = announced = 0
+        sent_at = [None] * len(requests)
+        retried = reauthenticated = False
+        reader = None
+
+        def resend():
+            for event in events[len(results):sent]:
+                event.retries += 1
+            return (None, len(results))
+
+        self._drain()
+        try:
+            while len(results) < len(requests):
+                if reader is None:
+                    fresh = self.connection.sock is None
+                    if fresh:
+                        start = time()
+                        self.connection.connect()
+                        events[len(results)].connect_time += time() - start
+                    reader = _PipelineReader(self.connection.sock)
+                sock = self.connection.sock
+                while sent < len(requests) and sent - len(results) < depth:
+                    (method, path, hdrs) = requests[sent]
+                    if sent == announced:
+                        events[sent].path = path
+                        self._notify('before_request', events[sent])
+                        announced += 1
+                    sent_at[sent] = time()
+                    sock.sendall(self._request_head(method, path, hdrs))
+                    sent += 1
+                    if fresh:
+                        self.connect_count += 1
+                        fresh = False
+                    else:
+                        self.reuse_count += 1
+                event = events[len(results)]
+                response = HTTPResponse(reader, method=event.method)
+                try:
+                    response.begin()
+                    event.ttfb = time() - sent_at[len(results)]
+                    body = response.read()
+                except (socket.error, HTTPException):
+                    # Resend whatever is unanswered on a new socket, (once).
+                    if retried:
+                        raise
+                    retried = True
+                    self.connection.close()
+                    (reader, sent) = resend()
+                    continue
+                if response.status == 401 and not reauthenticated:
+                    reauthenticated = True
+                    self._reauthenticate(event)
+                    # The requests pipelined behind it were refused too.
+                    self.connection.close()
+                    (reader, sent) = resend()
+                    continue
+                self._completed(event, response, len(body))
+                if event.method == 'DELETE' and (response.status == 404 or
+                        200 <= response.status <= 299):
+                    self._invalidate(*paths[len(results)][:2])
+                results.append((response.status, response.reason,
+                                response.getheaders(), body))
+                if response.will_close:
+                    self.connection.close()
+                    (reader, sent) = resend()
+        except:
+            error = sys.exc_info()
+            self.connection.close()
+            for event in events[len(results):announced]:
+                self._failed(event, error[1])
+            raise error[0], error[1], error[2]
+        return results
+
+    def _head(self, path=[]):
+        """
+        Performs a HEAD request against path, returning a tuple of the
+        response status, reason and headers. Successful and 404 responses
+        are answered from the metadata cache when one is configured.
+        """
+        cache = self.metadata_cache
+        key = self._cache_key(path)
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+        response = self.make_request('HEAD', path)
+        buff = response.read()
+        result = (response.status, response.reason, response.getheaders())
+        if cache is not None and \
+                (200 <= response.status <= 299 or response.status == 404):
+            cache.put(key, result)
+        return result
+
+    def _invalidate(self, container_name=None, object_name=None):
+        """
+        Discards cached metadata made stale by a change to an object or
+        container, (including the counts of its container and account).
+        """
+        if self.object_cache is not None and object_name is not None:
+            self.object_cache.invalidate(container_name, object_name)
+        cache = self.metadata_cache
+        if cache is None:
+            return
+        cache.invalidate(self._cache_key([]))
+        if container_name is not None:
+            cache.invalidate(self._cache_key([container_name]))
+            if object_name is not None:
+                cache.invalidate(self._cache_key([container_name,
+                                                  object_name]))
+
+    def _cache_key(self, path):
+        """
+        Returns the metadata cache key of path, (qualified by the storage
+        host, port and account uri, as a cache may be shared by connections
+        to different accounts).
+        """
+        return tuple(self.connection_args[:3]) + tuple(path)
+
     def get_info(self):
         """
         Return tuple for number of containers and total bytes in the account
@@ -178,9 +595,9 @@ class Connection(object):
         @return: a tuple containing the number of containers and total bytes
                  used by the account
         """
-        response = self.make_request('HEAD')
+        (status, reason, headers) = self._head()
         count = size = None
-        for hdr in response.getheaders():
+        for hdr in headers:
             if hdr[0].lower() == 'x-account-container-count':
                 try:
                     count = int(hdr[1])
@@ -191,9 +608,8 @@ class Connection(object):
                     size = int(hdr[1])
                 except ValueError:
                     size = 0
-        buff = response.read()
-        if (response.status < 200) or (response.status > 299):
-            raise ResponseError(response.status, response.reason)
+        if (status < 200) or (status > 299):
+            raise ResponseError(status, reason)
         return (count, size)
 
     def _check_container_name(self, container_name):
@@ -219,6 +635,7 @@ class Connection(object):
         
         response = self.make_request('PUT', [container_name])
         buff = response.read()
+        self._invalidate(container_name)
         if (response.status < 200) or (response.status > 299):
             raise ResponseError(response.status, response.reason)
         return Container(self, container_name)
@@ -238,6 +655,7 @@ class Connection(object):
         
         response = self.make_request('DELETE', [container_name])
         buff = response.read()
+        self._invalidate(container_name)
         
         if (response.status == 409):
             raise ContainerNotEmpty(container_name)
@@ -248,15 +666,25 @@ class Connection(object):
             response = self.cdn_request('POST', [container_name],
                                 hdrs={'X-CDN-Enabled': 'False'})
 
-    def get_all_containers(self, limit=None, marker=None, **parms):
+    def get_all_containers(self, limit=None, marker=None, preload_cdn=False,
+                           **parms):
         """
         Returns a Container item result set.
 
+        A Container's CDN attributes are normally requested from the CDN
+        service when they are first accessed, one container at a time.
+        With preload_cdn set, the CDN listing is instead fetched once, up
+        front, and used to fill in every Container in the result set.
+
         >>> connection.get_all_containers()
         ContainerResults: 4 containers
         >>> print ', '.join([container.name for container in
                              connection.get_all_containers()])
         new_container, old_container, pictures, music
+        >>> print ', '.join([container.name for container in
+                             connection.get_all_containers(preload_cdn=True)
+                             if container.is_public()])
+        pictures, music
 
         @rtype: L{ContainerResults}
         @return: an iterable set of objects representing all containers on the
@@ -265,12 +693,16 @@ class Connection(object):
         @type limit: int
         @param marker: return only results whose name is greater than "marker"
         @type marker: str
+        @param preload_cdn: fetch the CDN data of all containers at once
+        @type preload_cdn: bool
         """
-        if limit:
-            parms['limit'] = limit
-        if marker:
-            parms['marker'] = marker
-        return ContainerResults(self, self.list_containers_info(**parms))
+        cdn_info = None
+        if preload_cdn and self.cdn_enabled:
+            cdn_info = dict([(info['name'], info)
+                             for info in self.list_cdn_containers_info()])
+        return ContainerResults(self, json_iter_loads(
+                self._list_containers_response(limit, marker, **parms)),
+                cdn_info)
 
     def get_container(self, container_name):
         """
@@ -289,9 +721,9 @@ class Connection(object):
         """
         self._check_container_name(container_name)
         
-        response = self.make_request('HEAD', [container_name])
+        (status, reason, headers) = self._head([container_name])
         count = size = None
-        for hdr in response.getheaders():
+        for hdr in headers:
             if hdr[0].lower() == 'x-container-object-count':
                 try:    
                     count = int(hdr[1])
@@ -302,11 +734,10 @@ class Connection(object):
                     size = int(hdr[1])
                 except ValueError:
                     size = 0
-        buff = response.read()
-        if response.status == 404:
+        if status == 404:
             raise NoSuchContainer(container_name)
-        if (response.status < 200) or (response.status > 299):
-            raise ResponseError(response.status, response.reason)
+        if (status < 200) or (status > 299):
+            raise ResponseError(status, reason)
         return Container(self, container_name, count, size)
 
     def list_public_containers(self):
@@ -325,6 +756,35 @@ class Connection(object):
             raise ResponseError(response.status, response.reason)
         return response.read().splitlines()
 
+    def list_cdn_containers_info(self, page_size=consts.listing_limit):
+        """
+        Returns a list of the CDN data of every container that has ever
+        been published to the CDN, following the CDN listing across as many
+        pages as necessary.
+
+        >>> connection.list_cdn_containers_info()
+        [{u'name': u'pictures', u'cdn_enabled': True, u'ttl': 86400,
+          u'cdn_uri': u'http://cdn.cloudfiles.mosso.com/c1234'},
+         {u'name': u'music', u'cdn_enabled': False, u'ttl': 604800,
+          u'cdn_uri': u'http://cdn.cloudfiles.mosso.com/c5678'}]
+
+        @rtype: list({"name":"...", "cdn_enabled":..., "ttl":...,
+                      "cdn_uri":"..."})
+        @return: a list of CDN container info as dictionaries
+        @param page_size: the number of records requested at a time
+        @type page_size: int
+        """
+        def fetch(marker):
+            parms = {'format': 'json', 'limit': page_size}
+            if marker:
+                parms['marker'] = marker
+            response = self.cdn_request('GET', [''], parms=parms)
+            if (response.status < 200) or (response.status > 299):
+                buff = response.read()
+                raise ResponseError(response.status, response.reason)
+            return json_iter_loads(response)
+        return list(iter_pages(fetch, page_size))
+
     def list_containers_info(self, limit=None, marker=None, **parms):
         """
         Returns a list of Containers, including object count and size.
@@ -345,6 +805,13 @@ class Connection(object):
         @param marker: return only results whose name is greater than "marker"
         @type marker: str
         """
+        return list(json_iter_loads(self._list_containers_response(
+                limit, marker, **parms)))
+
+    def _list_containers_response(self, limit=None, marker=None, **parms):
+        """
+        Returns the (unread) response to a JSON container listing request.
+        """
         if limit:
             parms['limit'] = limit
         if marker:
@@ -354,7 +821,45 @@ class Connection(object):
         if (response.status < 200) or (response.status > 299):
             buff = response.read()
             raise ResponseError(response.status, response.reason)
-        return json_loads(response.read())
+        return response
+
+    def iter_containers_info(self, marker=None,
+                             page_size=consts.listing_limit, prefetch=True,
+                             **parms):
+        """
+        Returns a generator of Container information, including object
+        count and size, following the listing across as many pages as
+        necessary.
+
+        Pages are requested over a dedicated connection. Unless prefetch is
+        disabled, each page is requested and parsed on a background thread
+        while the previous one is consumed. Otherwise, records are parsed
+        and yielded as they are read off the network, and only one is held
+        in memory at a time.
+
+        >>> for info in connection.iter_containers_info():
+        ...     print info['name'], info['count']
+        new_container 510
+        old_container 12
+
+        @rtype: generator({"name":"...", "count":..., "bytes":...})
+        @return: a generator of container info dictionaries
+        @param marker: return only results whose name is greater than "marker"
+        @type marker: str
+        @param page_size: the number of records requested at a time
+        @type page_size: int
+        @param prefetch: request the next page in the background
+        @type prefetch: bool
+        """
+        conn = self.clone()
+        def fetch(marker):
+            return json_iter_loads(conn._list_containers_response(
+                    page_size, marker, **parms))
+        try:
+            for record in iter_pages(fetch, page_size, marker, prefetch):
+                yield record
+        finally:
+            conn.close()
 
     def list_containers(self, limit=None, marker=None, **parms):
         """
@@ -399,32 +904,236 @@ class Connection(object):
         """
         return self.get_container(key)
 
-class ConnectionPool(Queue):
+def _metadata_cache(cache):
+    """
+    Returns the metadata cache for a metadata_cache argument, (a new cache
+    if it is True, and None if it is None or False). An empty cache is
+    false too, so the argument cannot simply be tested for truth.
+    """
+    if cache is True:
+        return LRUCache(consts.metadata_cache_size, consts.metadata_cache_ttl)
+    if cache is None or cache is False:
+        return None
+    return cache
+
+def _quote(value):
+    """
+    Returns a path element or query value quoted for a request URI,
+    (encoding unicode, such as names read from a JSON listing, as UTF-8).
+    """
+    if isinstance(value, unicode):
+        return quote(value.encode('utf-8'))
+    return quote(str(value))
+
+def _is_stale(sock):
+    """
+    Returns whether an idle keep-alive socket can no longer be used.
+    """
+    # An idle keep-alive socket should never be readable; if it is, the
+    # server has closed it (or sent garbage) and it can't be reused.
+    if sock is None or not hasattr(sock, 'fileno'):
+        return False
+    try:
+        return bool(select([sock], [], [], 0)[0])
+    except (socket.error, ValueError):
+        return True
+
+class _PipelineReader(object):
+    """
+    Stands in for a socket when reading pipelined responses, so that every
+    response is parsed from one buffered file, (which closing a response
+    leaves open for the next).
+    """
+    def __init__(self, sock):
+        self.fp = sock.makefile('rb')
+
+    def makefile(self, *args):
+        return self
+
+    def read(self, *args):
+        return self.fp.read(*args)
+
+    def readline(self, *args):
+        return self.fp.readline(*args)
+
+    def close(self):
+        pass
+
+class ConnectionPool(object):
     """
-    A thread-safe connection pool object.
+    A thread-safe, bounded connection pool object.
+
+    At most poolsize connections are ever open at once, all of them
+    sharing a single session token. Connections which have sat idle for
+    longer than max_idle seconds, or whose socket was closed by the remote
+    end, are discarded rather than handed out.
+
+    >>> pool = ConnectionPool('jsmith', '1234567890', poolsize=4)
+    >>> with pool.connection() as conn:
+    ...     conn.get_info()
+    (5, 2309749)
 
     This component isn't required when using the cloudfiles library, but it may
     be useful when building threaded applications.
     """
     def __init__(self, username=None, api_key=None, **kwargs):
+        """
+        Accepts the same arguments as L{Connection}, plus the following
+        optional keywords.
+
+        @type poolsize: int
+        @param poolsize: the maximum number of open connections
+        @type max_idle: number
+        @param max_idle: seconds a connection may sit idle before being
+                         evicted, (None disables eviction)
+        @type acquire_timeout: number
+        @param acquire_timeout: default number of seconds get() will wait
+                                for a connection, (None waits forever)
+        @type health_check: callable(connection)
+        @param health_check: an optional predicate applied to idle
+                             connections before they are handed out
+        @type token_cache: L{TokenCache} or bool
+        @param token_cache: share the session token through this cache, (or
+                            the process-wide cache if True)
+        @type metadata_cache: L{LRUCache} or bool
+        @param metadata_cache: a HEAD metadata cache shared by every pooled
+                               connection, (or a new one if True)
+        @type object_cache: L{DiskCache}
+        @param object_cache: an object cache shared by every pooled connection
+        @type chunk_size: int, str or L{ChunkSize}
+        @param chunk_size: the chunk size policy shared by every pooled
+                           connection
+        @type checksum_index: L{ChecksumIndex}
+        @param checksum_index: a checksum index shared by every pooled
+                               connection
+        @type hooks: list of L{RequestHook}
+        @param hooks: request hooks shared by every pooled connection
+        """
         auth = kwargs.get('auth', None)
+        if not auth:
+            authurl = kwargs.get('authurl', consts.default_authurl)
+            if username and api_key and authurl:
+                auth = Authentication(username, api_key, authurl)
+            else:
+                raise TypeError("Incorrect or invalid arguments supplied")
+        if not isinstance(auth, SharedAuthentication):
+            token_cache = kwargs.get('token_cache', None)
+            if token_cache is True:
+                token_cache = default_token_cache
+            auth = SharedAuthentication(auth, token_cache or None)
+        self.auth = auth
         self.timeout = kwargs.get('timeout', 5)
-        self.connargs = {'username': username, 'api_key': api_key}
-        poolsize = kwargs.get('poolsize', 10)
-        Queue.__init__(self, poolsize)
+        metadata_cache = _metadata_cache(kwargs.get('metadata_cache'))
+        self.connargs = {'auth': self.auth, 'timeout': self.timeout,
+                         'debuglevel': kwargs.get('debuglevel', 0),
+                         'metadata_cache': metadata_cache,
+                         'object_cache': kwargs.get('object_cache', None),
+                         'checksum_index': kwargs.get('checksum_index', None),
+                         'hooks': kwargs.get('hooks', None),
+                         'chunk_size': chunk_policy(kwargs.get('chunk_size'))}
+        self.poolsize = int(kwargs.get('poolsize', 10))
+        self.max_idle = kwargs.get('max_idle', consts.default_pool_max_idle)
+        self.acquire_timeout = kwargs.get('acquire_timeout', None)
+        self.health_check = kwargs.get('health_check', None)
+        self._template = None
+        self._idle = []
+        self._size = 0
+        self._cond = Condition()
+
+    @classmethod
+    def from_connection(cls, connobj, **kwargs):
+        """
+        Return a pool whose connections are clones of an existing
+        connection, (and so share its session token).
 
-    def get(self):
+        >>> pool = ConnectionPool.from_connection(conn, poolsize=4)
+
+        @param connobj: a cloudfiles connection object
+        @type connobj: L{Connection}
+        @rtype: L{ConnectionPool}
+        @return: a connection pool for the same account
+        """
+        kwargs['auth'] = connobj.auth
+        pool = cls(**kwargs)
+        pool._template = connobj
+        return pool
+
+    def _create_connection(self):
+        """
+        Return a new connection object for the pool.
+        """
+        if self._template:
+            return self._template.clone()
+        return Connection(**self.connargs)
+
+    def _is_usable(self, stamp, connobj):
+        """
+        Return whether an idle connection may be handed out again, (called
+        without the lock held, as the health check may make a request).
+        """
+        if self.max_idle is not None and (time() - stamp) > self.max_idle:
+            return False
+        if _is_stale(getattr(connobj.connection, 'sock', None)):
+            return False
+        if callable(self.health_check):
+            return bool(self.health_check(connobj))
+        return True
+
+    def get(self, block=True, timeout=None):
         """
         Return a cloudfiles connection object.
 
+        When all poolsize connections are checked out, this method waits
+        for one to be returned, (up to timeout seconds if given, otherwise
+        acquire_timeout), before raising L{PoolExhausted}.
+
+        @param block: wait for a connection if none is available
+        @type block: bool
+        @param timeout: the maximum number of seconds to wait
+        @type timeout: number
         @rtype: L{Connection}
         @return: a cloudfiles connection object
         """
-        try:
-            (create, connobj) = Queue.get(self, block=0)
-        except Empty:
-            connobj = Connection(**self.connargs)
-        return connobj
+        if timeout is None:
+            timeout = self.acquire_timeout
+        deadline = timeout is not None and time() + timeout or None
+        while True:
+            self._cond.acquire()
+            try:
+                while True:
+                    if self._idle:
+                        (stamp, connobj) = self._idle.pop()
+                        break
+                    if self._size < self.poolsize:
+                        self._size += 1
+                        (stamp, connobj) = (None, None)
+                        break
+                    if not block:
+                        raise PoolExhausted()
+                    if deadline is None:
+                        self._cond.wait()
+                    else:
+                        remaining = deadline - time()
+                        if remaining <= 0:
+                            raise PoolExhausted()
+                        self._cond.wait(remaining)
+            finally:
+                self._cond.release()
+
+            # Idle connections are checked, and new ones created, outside
+            # of the lock, (holding their slot); the first one made
+            # authenticates and the rest reuse the shared token.
+            try:
+                if connobj is None:
+                    return self._create_connection()
+                if self._is_usable(stamp, connobj):
+                    return connobj
+            except:
+                connobj is not None and connobj.close()
+                self._release_slot()
+                raise
+            connobj.close()
+            self._release_slot()
 
     def put(self, connobj):
         """
@@ -433,9 +1142,101 @@ class ConnectionPool(Queue):
         @param connobj: a cloudfiles connection object
         @type connobj: L{Connection}
         """
+        self._cond.acquire()
+        try:
+            if len(self._idle) < self._size:
+                self._idle.append((time(), connobj))
+                self._cond.notify()
+                return
+        finally:
+            self._cond.release()
+        connobj.close()
+
+    def discard(self, connobj):
+        """
+        Close a checked out connection object rather than returning it to
+        the pool, freeing its slot for a new connection.
+
+        @param connobj: a cloudfiles connection object
+        @type connobj: L{Connection}
+        """
+        connobj.close()
+        self._release_slot()
+
+    def _release_slot(self):
+        self._cond.acquire()
+        try:
+            self._size -= 1
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def evict_idle(self):
+        """
+        Close all idle connections which are no longer usable.
+        """
+        # The idle connections keep their slots while they are checked.
+        self._cond.acquire()
+        try:
+            (checked, self._idle) = (self._idle, [])
+        finally:
+            self._cond.release()
+        (idle, evicted) = ([], [])
+        for (stamp, connobj) in checked:
+            if self._is_usable(stamp, connobj):
+                idle.append((stamp, connobj))
+            else:
+                evicted.append(connobj)
+        self._cond.acquire()
+        try:
+            self._idle.extend(idle)
+            self._idle.sort(key=lambda item: item[0])
+            self._size -= len(evicted)
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+        for connobj in evicted:
+            connobj.close()
+
+    def close(self):
+        """
+        Close all idle connections held by the pool.
+        """
+        self._cond.acquire()
+        try:
+            idle = self._idle
+            self._idle = []
+            self._size -= len(idle)
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+        for (stamp, connobj) in idle:
+            connobj.close()
+
+    @contextmanager
+    def connection(self, block=True, timeout=None):
+        """
+        Check out a connection for the duration of a with block, returning
+        it to the pool afterward, (or discarding it if the block was
+        interrupted by a network error).
+
+        >>> with pool.connection() as conn:
+        ...     conn.create_container('pictures')
+
+        @param block: wait for a connection if none is available
+        @type block: bool
+        @param timeout: the maximum number of seconds to wait
+        @type timeout: number
+        """
+        connobj = self.get(block, timeout)
         try:
-            Queue.put(self, (time(), connobj), block=0)
-        except Full:
-            del connobj
+            yield connobj
+        except (socket.error, HTTPException):
+            self.discard(connobj)
+            raise
+        except:
+            self.put(connobj)
+            raise
+        self.put(connobj)
 
 # vim:set ai sw=4 ts=4 tw=0 expandtab:
@@ -4,6 +4,28 @@ __version__ = "1.3.1"
 user_agent = "python-cloudfiles/%s" % __version__
 default_authurl = 'https://api.mosso.com/auth'
 default_cdn_ttl = 86400
+default_pool_max_idle = 300
+default_token_ttl = 82800
+default_token_refresh = 600
+default_range_size = 8388608
+listing_limit = 10000
+metadata_cache_size = 1024
+metadata_cache_ttl = 30
+object_cache_size = 1073741824
+mapped_chunk_size = 1048576
+default_chunk_size = 65536
+min_chunk_size = 4096
+max_chunk_size = 4194304
+adaptive_calls_per_second = 200
+pipeline_depth = 16
+async_max_per_host = 8
+bulk_threads = 8
+bulk_retries = 3
+checksum_index_size = 262144
+pipelined_write_size = 4194304
+write_pipeline_depth = 8
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
 
 meta_name_limit = 128
 meta_value_limit = 256
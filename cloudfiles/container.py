@@ -9,12 +9,18 @@ containers inside of containers.
 See COPYING for license information.
 """
 
+import os, mimetypes
+from copy   import copy
+from time   import time
+from threading import Lock
 from storage_object import Object, ObjectResults
+from httplib import HTTPException
+from socket import error as socket_error
 from errors import ResponseError, InvalidContainerName, InvalidObjectName, \
                    ContainerNotPublic, CDNNotEnabled
-from utils  import requires_name
+from utils  import requires_name, iter_pages, NameIndex, parallel_map
 import consts
-from fjson  import json_loads
+from fjson  import json_iter_loads
 
 # Because HTTPResponse objects *have* to have read() called on them 
 # before they can be used again ...
@@ -34,12 +40,18 @@ class Container(object):
     @ivar size_used: the sum of the sizes of all objects in this container
             (cached)
     @type size_used: number
+    @ivar cdn_uri: the container's public URI, if it is published to the CDN
+            (fetched on first access, use make_public to alter)
+    @type cdn_uri: str
     @ivar cdn_ttl: the time-to-live of the CDN's public cache of this container
-            (cached, use make_public to alter)
+            (fetched on first access, use make_public to alter)
     @type cdn_ttl: number
 
     @undocumented: _fetch_cdn_data
+    @undocumented: _load_cdn_data
+    @undocumented: _set_cdn_info
     @undocumented: _list_objects_raw
+    @undocumented: _list_objects_response
     """
     def __set_name(self, name):
         # slashes make for invalid names
@@ -51,6 +63,28 @@ class Container(object):
     name = property(fget=lambda self: self._name, fset=__set_name,
         doc="the name of the container (read-only)")
 
+    # CDN attributes are only requested from the CDN service when first
+    # read, (unless they were assigned or preloaded beforehand).
+    def __get_cdn_uri(self):
+        self._load_cdn_data()
+        return self._cdn_uri
+
+    def __set_cdn_uri(self, value):
+        self._load_cdn_data(False)
+        self._cdn_uri = value
+
+    cdn_uri = property(fget=__get_cdn_uri, fset=__set_cdn_uri)
+
+    def __get_cdn_ttl(self):
+        self._load_cdn_data()
+        return self._cdn_ttl
+
+    def __set_cdn_ttl(self, value):
+        self._load_cdn_data(False)
+        self._cdn_ttl = value
+
+    cdn_ttl = property(fget=__get_cdn_ttl, fset=__set_cdn_ttl)
+
     def __init__(self, connection=None, name=None, count=None, size=None):
         """
         Containers will rarely if ever need to be instantiated directly by the
@@ -66,9 +100,18 @@ class Container(object):
         self.conn = connection
         self.object_count = count
         self.size_used = size
-        self.cdn_uri = None
-        self.cdn_ttl = None
-        if connection.cdn_enabled:
+        self._cdn_uri = None
+        self._cdn_ttl = None
+        self._cdn_loaded = False
+
+    def _load_cdn_data(self, fetch=True):
+        """
+        Fetch the container's CDN data, (once), if CDN is enabled.
+        """
+        if self._cdn_loaded:
+            return
+        self._cdn_loaded = True
+        if fetch and self.conn and self.conn.cdn_enabled and self.name:
             self._fetch_cdn_data()
 
     @requires_name(InvalidContainerName)
@@ -77,12 +120,30 @@ class Container(object):
         Fetch the object's CDN data from the CDN service
         """
         response = self.conn.cdn_request('HEAD', [self.name])
+        buff = response.read()
         if (response.status >= 200) and (response.status < 300):
+            enabled = True
             for hdr in response.getheaders():
                 if hdr[0].lower() == 'x-cdn-uri':
-                    self.cdn_uri = hdr[1]
+                    self._cdn_uri = hdr[1]
                 if hdr[0].lower() == 'x-ttl':
-                    self.cdn_ttl = int(hdr[1])
+                    self._cdn_ttl = int(hdr[1])
+                if hdr[0].lower() == 'x-cdn-enabled':
+                    enabled = hdr[1].lower() == 'true'
+            if not enabled:
+                self._cdn_uri = None
+
+    def _set_cdn_info(self, info):
+        """
+        Set the container's CDN data from a CDN listing record, (or None if
+        the container does not appear in the listing).
+        """
+        self._cdn_loaded = True
+        if info and info.get('cdn_enabled', True):
+            self._cdn_uri = info.get('cdn_uri')
+            self._cdn_ttl = info.get('ttl')
+        else:
+            self._cdn_uri = self._cdn_ttl = None
 
     @requires_name(InvalidContainerName)
     def make_public(self, ttl=consts.default_cdn_ttl):
@@ -161,26 +222,32 @@ class Container(object):
         return self.cdn_uri
 
     @requires_name(InvalidContainerName)
-    def create_object(self, object_name):
+    def create_object(self, object_name, check=True):
         """
         Return an L{Object} instance, creating it if necessary.
         
         When passed the name of an existing object, this method will 
         return an instance of that object, otherwise it will create a
-        new one.
+        new one. The existing object's attributes are requested when one
+        of them is first used; with check disabled they never are, and the
+        instance always starts out as a new, empty object, (saving a
+        request when the object is about to be overwritten anyway).
 
         >>> container.create_object('new_object')
         <cloudfiles.storage_object.Object object at 0xb778366c>
         >>> obj = container.create_object('new_object')
         >>> obj.name
         'new_object'
+        >>> container.create_object('new_object', check=False).write('data')
 
         @type object_name: str
         @param object_name: the name of the object to create
+        @type check: bool
+        @param check: initialize the instance from any existing object
         @rtype: L{Object}
         @return: an object representing the newly created storage object
         """
-        return Object(self, object_name)
+        return Object(self, object_name, check=check)
 
     @requires_name(InvalidContainerName)
     def get_objects(self, prefix=None, limit=None, marker=None, 
@@ -210,8 +277,9 @@ class Container(object):
         @rtype: L{ObjectResults}
         @return: an iterable collection of all storage objects in the container
         """
-        return ObjectResults(self, self.list_objects_info(
-                prefix, limit, marker, path, **parms))
+        parms['format'] = 'json'
+        return ObjectResults(self, json_iter_loads(self._list_objects_response(
+                prefix, limit, marker, path, **parms)))
 
     @requires_name(InvalidContainerName)
     def get_object(self, object_name):
@@ -267,9 +335,76 @@ class Container(object):
                  keys "name", "hash", "size", and "type"
         """
         parms['format'] = 'json'
-        resp = self._list_objects_raw(
+        response = self._list_objects_response(
             prefix, limit, marker, path, **parms)
-        return json_loads(resp)
+        return list(json_iter_loads(response))
+
+    @requires_name(InvalidContainerName)
+    def iter_objects_info(self, prefix=None, marker=None, path=None,
+                          page_size=consts.listing_limit, prefetch=True,
+                          **parms):
+        """
+        Return a generator of information about all objects in the
+        Container.
+
+        Unlike L{list_objects_info}, results are not limited to a single
+        page; the listing is requested page_size records at a time, over a
+        dedicated connection. Unless prefetch is disabled, each page is
+        requested and parsed on a background thread while the previous one
+        is consumed. Otherwise, records are parsed and yielded as they are
+        read off the network, and only one is held in memory at a time.
+
+        >>> for info in container.iter_objects_info(prefix='logs/'):
+        ...     print info['name'], info['bytes']
+        logs/2008-11-04 4820
+        logs/2008-11-05 1896
+
+        @param prefix: filter the results using this prefix
+        @type prefix: str
+        @param marker: return objects with names greater than "marker"
+        @type marker: str
+        @param path: return all objects in "path"
+        @type path: str
+        @param page_size: the number of records requested at a time
+        @type page_size: int
+        @param prefetch: request the next page in the background
+        @type prefetch: bool
+
+        @rtype: generator({"name":"...", "hash":..., "size":..., "type":...})
+        @return: a generator of object info dictionaries
+        """
+        container = copy(self)
+        container.conn = self.conn.clone()
+        parms['format'] = 'json'
+        def fetch(marker):
+            return json_iter_loads(container._list_objects_response(
+                    prefix, page_size, marker, path, **parms))
+        try:
+            for record in iter_pages(fetch, page_size, marker, prefetch):
+                yield record
+        finally:
+            container.conn.close()
+
+    @requires_name(InvalidContainerName)
+    def iter_objects(self, prefix=None, marker=None, path=None,
+                     page_size=consts.listing_limit, prefetch=True, **parms):
+        """
+        Return a generator of all L{Object}s in the Container, following
+        the listing across as many pages as necessary.
+
+        See L{iter_objects_info} for a description of the arguments.
+
+        >>> for obj in container.iter_objects(prefix='logs/'):
+        ...     print obj.name
+        logs/2008-11-04
+        logs/2008-11-05
+
+        @rtype: generator(L{Object})
+        @return: a generator of storage objects in the container
+        """
+        for record in self.iter_objects_info(prefix, marker, path, page_size,
+                                             prefetch, **parms):
+            yield Object(self, object_record=record)
 
     @requires_name(InvalidContainerName)
     def list_objects(self, prefix=None, limit=None, marker=None, 
@@ -305,6 +440,15 @@ class Container(object):
         """
         Returns a chunk list of storage object info.
         """
+        return self._list_objects_response(prefix, limit, marker, path,
+                                           **parms).read()
+
+    @requires_name(InvalidContainerName)
+    def _list_objects_response(self, prefix=None, limit=None, marker=None,
+                               path=None, **parms):
+        """
+        Returns the (unread) response to a storage object listing request.
+        """
         if prefix: parms['prefix'] = prefix
         if limit: parms['limit'] = limit
         if marker: parms['marker'] = marker
@@ -313,7 +457,7 @@ class Container(object):
         if (response.status < 200) or (response.status > 299):
             buff = response.read()
             raise ResponseError(response.status, response.reason)
-        return response.read()
+        return response
 
     def __getitem__(self, key):
         return self.get_object(key)
@@ -340,33 +484,447 @@ class Container(object):
         if not object_name:
             raise InvalidObjectName(object_name)
         response = self.conn.make_request('DELETE', [self.name, object_name])
+        self.conn._invalidate(self.name, object_name)
         if (response.status < 200) or (response.status > 299):
             buff = response.read()
             raise ResponseError(response.status, response.reason)
         buff = response.read()
 
+    @requires_name(InvalidContainerName)
+    def delete_objects(self, names=None, prefix=None,
+                       threads=consts.bulk_threads,
+                       retries=consts.bulk_retries, pool=None,
+                       delete_container=False):
+        """
+        Permanently remove many storage objects at once.
+
+        Without names, every object in the container, (or every object
+        whose name begins with prefix), is deleted as its listing is
+        streamed. Names are deleted in pipelined batches, (see
+        L{batch_request<Connection.batch_request>}), run concurrently over
+        pooled connections. Objects which are already gone count as
+        deleted; a batch interrupted by a network error, or a 5xx status,
+        is retried up to retries times.
+
+        >>> failures = container.delete_objects(prefix='logs/2008-')
+        >>> failures = container.delete_objects(delete_container=True)
+
+        @param names: the names, (or Objects), to delete
+        @type names: iterable
+        @param prefix: only delete objects whose names begin with prefix
+        @type prefix: str
+        @param threads: the number of batches to delete concurrently
+        @type threads: int
+        @param retries: the number of times to retry each batch
+        @type retries: int
+        @param pool: connections to delete with, (by default a pool of
+                     clones of the container's connection)
+        @type pool: L{ConnectionPool}
+        @param delete_container: delete the container itself once every
+                                 object has been deleted
+        @type delete_container: bool
+        @rtype: list
+        @return: an (object name, exception) two-tuple for each object
+                 which could not be deleted
+        """
+        # Names are compared and reported as UTF-8, (as listed by _walk).
+        if names is None:
+            names = (_utf8(info['name']) for info in
+                     self.iter_objects_info(prefix=prefix))
+        else:
+            names = (_utf8(isinstance(name, Object) and name.name or name)
+                     for name in names)
+            if prefix:
+                prefix = _utf8(prefix)
+                names = (name for name in names if name.startswith(prefix))
+
+        if pool is None:
+            from connection import ConnectionPool
+            own_pool = pool = ConnectionPool.from_connection(self.conn,
+                                                             poolsize=threads)
+        else:
+            own_pool = None
+
+        failures = []
+        def delete(batch):
+            attempts = 0
+            while batch:
+                try:
+                    with pool.connection() as conn:
+                        results = conn.batch_request(
+                            [('DELETE', [self.name, name]) for name in batch])
+                except (socket_error, HTTPException), err:
+                    results = [err] * len(batch)
+                retry = []
+                for (name, result) in zip(batch, results):
+                    if isinstance(result, Exception):
+                        error = result
+                    else:
+                        (status, reason) = result[:2]
+                        if (200 <= status <= 299) or status == 404:
+                            self.conn._invalidate(self.name, name)
+                            continue
+                        error = ResponseError(status, reason)
+                        if status < 500:
+                            failures.append((name, error))
+                            continue
+                    if attempts < retries:
+                        retry.append(name)
+                    else:
+                        failures.append((name, error))
+                attempts += 1
+                batch = retry
+
+        try:
+            interrupted = parallel_map(delete, _batches(names,
+                                       consts.pipeline_depth), threads)
+        finally:
+            if own_pool:
+                own_pool.close()
+        for (batch, err) in interrupted:
+            failures.extend([(name, err) for name in batch])
+        if delete_container and not failures:
+            self.conn.delete_container(self.name)
+        return failures
+
+    @requires_name(InvalidContainerName)
+    def upload_directory(self, directory, prefix='', markers=False,
+                         threads=consts.bulk_threads,
+                         retries=consts.bulk_retries, pool=None,
+                         verify=True):
+        """
+        Upload every file beneath a local directory, concurrently over
+        pooled connections.
+
+        Each file is stored as an object named for its path relative to
+        directory, (with "/" separators), after prefix. Content types are
+        guessed from file names. With markers set, each subdirectory is
+        also stored as a zero-length "application/directory" object, so
+        that the tree can be browsed with the path query parameter. An
+        upload interrupted by a network error, or a failed response, is
+        retried up to retries times.
+
+        >>> results = container.upload_directory('./build', prefix='static/')
+        >>> results.count, results.throughput
+        (2048, 5242880.0)
+        >>> results.failures
+        []
+
+        @param directory: the directory to upload
+        @type directory: str
+        @param prefix: prepended to the name of every object
+        @type prefix: str
+        @param markers: also create a marker object for each subdirectory
+        @type markers: bool
+        @param threads: the number of files to upload concurrently
+        @type threads: int
+        @param retries: the number of times to retry each file
+        @type retries: int
+        @param pool: connections to upload with, (by default a pool of
+                     clones of the container's connection)
+        @type pool: L{ConnectionPool}
+        @param verify: enable/disable server-side checksum verification
+        @type verify: boolean
+        @rtype: L{UploadResults}
+        @return: the number of objects and bytes uploaded, the time taken
+                 and the files which could not be uploaded
+        """
+        return self._upload(_walk(directory, prefix, markers), UploadResults(),
+                            threads, retries, pool, verify)
+
+    def _upload(self, items, results, threads, retries, pool, verify,
+                index=None, unchanged=None):
+        """
+        Upload (path, object name) items concurrently, (see
+        L{upload_directory}), tallying them in results. Given a
+        L{ChecksumIndex}, the checksum of each uploaded file is recorded.
+        Given an unchanged predicate, it is called with each item on the
+        worker thread, and the items it holds true are counted as skipped
+        rather than uploaded.
+        """
+        if pool is None:
+            from connection import ConnectionPool
+            own_pool = pool = ConnectionPool.from_connection(self.conn,
+                                                             poolsize=threads)
+        else:
+            own_pool = None
+
+        lock = Lock()
+        def upload(item):
+            (path, name) = item[:2]
+            if unchanged is not None and unchanged(item):
+                lock.acquire()
+                try:
+                    results.skipped += 1
+                finally:
+                    lock.release()
+                return
+            if path is None:
+                content_type = 'application/directory'
+            else:
+                content_type = mimetypes.guess_type(path)[0] or \
+                               'application/octet-stream'
+            attempts = 0
+            while True:
+                fobj = path and open(path, 'rb') or ''
+                try:
+                    stat = path and os.fstat(fobj.fileno())
+                    with pool.connection() as conn:
+                        container = copy(self)
+                        container.conn = conn
+                        obj = Object(container, name, check=False)
+                        obj.content_type = content_type
+                        obj.write(fobj, verify=verify)
+                    break
+                except (socket_error, HTTPException, ResponseError):
+                    attempts += 1
+                    if attempts > retries:
+                        raise
+                finally:
+                    if path:
+                        fobj.close()
+            if index is not None and path and obj.etag:
+                index.put(stat, obj.etag)
+            lock.acquire()
+            try:
+                results.count += 1
+                results.bytes += obj.size
+            finally:
+                lock.release()
+
+        start = time()
+        try:
+            failures = parallel_map(upload, items, threads)
+        finally:
+            if own_pool:
+                own_pool.close()
+        results.seconds = time() - start
+        results.failures.extend([(item[0] or item[1], err)
+                                 for (item, err) in failures])
+        return results
+
+    @requires_name(InvalidContainerName)
+    def sync_directory(self, directory, prefix='', markers=False,
+                       delete=False, index=None, threads=consts.bulk_threads,
+                       retries=consts.bulk_retries, pool=None, verify=True):
+        """
+        Bring the objects under prefix up to date with a local directory,
+        uploading only the files which are missing or differ.
+
+        Files are named as by L{upload_directory}. The container listing is
+        streamed and merged with the sorted local file names, and a file is
+        considered unchanged when its size and MD5 checksum match its
+        object's. Checksums are looked up in index, (and recorded there for
+        every file hashed or uploaded), so that an unchanged file is only
+        read once for as long as the index is kept. With delete set,
+        objects under prefix with no local file are deleted afterward.
+
+        >>> index = ChecksumIndex('/var/tmp/site-checksums')
+        >>> results = container.sync_directory('./build', prefix='static/',
+        ...                                    delete=True, index=index)
+        >>> results.count, results.skipped, results.deleted
+        (12, 2036, 3)
+
+        @param directory: the directory to synchronize from
+        @type directory: str
+        @param prefix: prepended to the name of every object
+        @type prefix: str
+        @param markers: also create a marker object for each subdirectory
+        @type markers: bool
+        @param delete: delete objects which have no local file
+        @type delete: bool
+        @param index: the checksums of local files, (by default the
+                      connection's checksum index, saved afterward if it
+                      has a filename)
+        @type index: L{ChecksumIndex}
+        @param threads: the number of files to upload, (or batches to
+                        delete), concurrently
+        @type threads: int
+        @param retries: the number of times to retry each upload or delete
+        @type retries: int
+        @param pool: connections to synchronize with, (by default a pool of
+                     clones of the container's connection)
+        @type pool: L{ConnectionPool}
+        @param verify: enable/disable server-side checksum verification
+        @type verify: boolean
+        @rtype: L{SyncResults}
+        @return: the counts of objects uploaded, skipped and deleted, and
+                 the files and objects which could not be synchronized
+        """
+        if index is None:
+            index = self.conn.checksum_index
+        if index is None:
+            from cache import ChecksumIndex
+            index = ChecksumIndex()
+        results = SyncResults()
+        local = sorted(_walk(directory, prefix, markers),
+                       key=lambda item: item[1])
+        stale = []
+
+        def unchanged(item):
+            (path, name, info) = item
+            if info is None:
+                return False
+            if path is None:
+                return True
+            try:
+                stat = os.stat(path)
+                if stat.st_size != info['bytes']:
+                    return False
+                return index.checksum(path) == info['hash']
+            except (IOError, OSError):
+                # Left for the upload to report.
+                return False
+
+        def merged():
+            """
+            Merge the local items with the listing, yielding each with its
+            object's listing information, (or None if it has no object),
+            and noting the names of objects with no local file. Whether an
+            item is unchanged is left to the upload threads, which hash it.
+            """
+            listing = self.iter_objects_info(prefix=prefix or None)
+            remote = None
+            for (path, name) in local:
+                while True:
+                    if remote is None:
+                        info = next(listing, None)
+                        remote = info and _utf8(info['name'])
+                    if remote is None or remote >= name:
+                        break
+                    stale.append(remote)
+                    remote = None
+                if remote == name:
+                    remote = None
+                    yield (path, name, info)
+                else:
+                    yield (path, name, None)
+            if remote is not None:
+                stale.append(remote)
+            stale.extend([_utf8(info['name']) for info in listing])
+
+        try:
+            self._upload(merged(), results, threads, retries, pool, verify,
+                         index, unchanged)
+            if delete and stale:
+                failures = self.delete_objects(stale, threads=threads,
+                                               retries=retries, pool=pool)
+                results.deleted = len(stale) - len(failures)
+                results.failures.extend(failures)
+        finally:
+            if index.filename:
+                index.save()
+        return results
+
+class UploadResults(object):
+    """
+    The outcome of a L{Container.upload_directory} call.
+
+    @ivar count: the number of objects uploaded
+    @type count: int
+    @ivar bytes: the number of bytes uploaded
+    @type bytes: int
+    @ivar seconds: the time the upload took
+    @type seconds: float
+    @ivar failures: a (path, exception) two-tuple for each file, (or
+                    object name for each marker), which was not uploaded
+    @type failures: list
+    """
+    def __init__(self):
+        self.count = self.bytes = 0
+        self.seconds = 0.0
+        self.failures = []
+
+    throughput = property(
+        fget=lambda self: self.seconds and self.bytes / self.seconds or 0.0,
+        doc="the average upload rate in bytes per second")
+
+    def __repr__(self):
+        return '<UploadResults: %d objects, %d bytes, %d failures>' % \
+               (self.count, self.bytes, len(self.failures))
+
+class SyncResults(UploadResults):
+    """
+    The outcome of a L{Container.sync_directory} call.
+
+    @ivar skipped: the number of files which were already up to date
+    @type skipped: int
+    @ivar deleted: the number of objects deleted
+    @type deleted: int
+    """
+    def __init__(self):
+        UploadResults.__init__(self)
+        self.skipped = self.deleted = 0
+
+    def __repr__(self):
+        return '<SyncResults: %d uploaded, %d skipped, %d deleted, ' \
+               '%d failures>' % (self.count, self.skipped, self.deleted,
+                                 len(self.failures))
+
+class ContainerRecord(object):
+    """
+    A compact record of a container's listing information.
+
+    Records can also be read like the dictionaries returned by
+    L{list_containers_info<Connection.list_containers_info>}.
+    """
+    __slots__ = ('name', 'count', 'bytes')
+
+    def __init__(self, info):
+        self.name = info['name']
+        self.count = info['count']
+        self.bytes = info['bytes']
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __repr__(self):
+        return 'ContainerRecord(%r)' % self.name
+
 class ContainerResults(object):
     """
     An iterable results set object for Containers. 
 
+    Listing information is held in compact L{ContainerRecord}s, L{Container}
+    instances are only created as items are accessed. Lookups by name are
+    served from an index built on first use.
+
+    If a CDN listing is supplied, (a dictionary of CDN container records
+    keyed by name), Containers are created with their CDN data already
+    filled in rather than fetching it individually.
+
     This class implements dictionary- and list-like interfaces.
     """
-    def __init__(self, conn, containers=list()):
-        self._containers = containers
-        self._names = [k['name'] for k in containers]
+    def __init__(self, conn, containers=(), cdn_info=None):
+        self._containers = [ContainerRecord(k) for k in containers]
+        self._index = None
+        self._cdn_info = cdn_info
         self.conn = conn
 
+    def _container(self, record):
+        container = Container(self.conn, record.name, record.count,
+                              record.bytes)
+        if self._cdn_info is not None:
+            container._set_cdn_info(self._cdn_info.get(record.name))
+        return container
+
+    def _name_index(self):
+        if self._index is None:
+            self._index = NameIndex([k.name for k in self._containers])
+        return self._index
+
     def __getitem__(self, key):
-        return Container(self.conn,
-                         self._containers[key]['name'], 
-                         self._containers[key]['count'], 
-                         self._containers[key]['bytes'])
+        return self._container(self._containers[key])
 
     def __getslice__(self, i, j):
-        return [Container(self.conn, k['name'], k['count'], k['size']) for k in self._containers[i:j] ]
+        return [self._container(k) for k in self._containers[i:j]]
 
     def __contains__(self, item):
-        return item in self._names
+        if isinstance(item, Container):
+            item = item.name
+        return item in self._name_index()
 
     def __repr__(self):
         return 'ContainerResults: %s containers' % len(self._containers)
@@ -379,12 +937,63 @@ class ContainerResults(object):
         """
         returns an integer for the first index of value
         """
-        return self._names.index(value, *args)
+        if args:
+            return [k.name for k in self._containers].index(value, *args)
+        return self._name_index().index(value)
 
     def count(self, value):
         """
         returns the number of occurrences of value
         """
-        return self._names.count(value)
+        return self._name_index().count(value)
+
+    def names_with_prefix(self, prefix):
+        """
+        returns a sorted list of the container names beginning with prefix
+        """
+        return self._name_index().with_prefix(prefix)
+
+    def names_between(self, start, end=None):
+        """
+        returns a sorted list of the container names from start up to, (but
+        not including), end
+        """
+        return self._name_index().between(start, end)
+
+def _batches(items, size):
+    """
+    Generator which yields the items as lists of up to size items.
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _utf8(name):
+    if isinstance(name, unicode):
+        return name.encode('utf-8')
+    return name
+
+def _walk(directory, prefix, markers):
+    """
+    Generator which yields a (path, object name) two-tuple for each file
+    beneath directory, (and a (None, object name) two-tuple for each
+    subdirectory if markers is set).
+    """
+    for (dirpath, dirnames, filenames) in os.walk(directory):
+        dirnames.sort()
+        relative = os.path.relpath(dirpath, directory)
+        if relative == os.curdir:
+            base = prefix
+        else:
+            base = '%s%s/' % (prefix, '/'.join(relative.split(os.sep)))
+            if markers:
+                yield (None, base[:-1])
+        for filename in sorted(filenames):
+            yield (os.path.join(dirpath, filename), base + filename)
 
 # vim:set ai sw=4 ts=4 tw=0 expandtab:
@@ -110,3 +110,9 @@ class AuthenticationError(Exception):
     """
     pass
 
+
+class PoolExhausted(Exception):
+    """
+    Raised when no pooled connection becomes available before a timeout.
+    """
+    pass
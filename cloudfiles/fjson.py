@@ -39,5 +39,79 @@ except ImportError:
     except ImportError:
         json_loads = _loads
 
-__all__ = ['json_loads']
+# Characters json_iter_loads acts on outside of, and inside of, strings
+structure = compile(r'["{}\[\]]')
+string_end = compile(r'["\\]')
+
+def json_iter_loads(fobj, chunksize=8192):
+    '''
+    Incrementally parse a JSON array read from the file-like fobj, (such as
+    an HTTPResponse), yielding each of its object or array elements as soon
+    as its closing bracket has been read.
+
+    Only the element being parsed is ever held in memory, so memory use
+    does not depend on the length of the array.
+
+    An empty document yields nothing, while one which ends before its
+    array is closed, (or holds no array), raises ValueError.
+
+    json_iter_loads(file_like) -> generator
+    '''
+    buff = ''
+    pos = depth = 0
+    start = None
+    in_string = opened = False
+    empty = True
+    while True:
+        chunk = fobj.read(chunksize)
+        if not chunk:
+            if depth or in_string or not (opened or empty):
+                raise ValueError('incomplete JSON document')
+            return
+        empty = empty and not chunk.strip()
+        buff += chunk
+        while True:
+            if in_string:
+                match = string_end.search(buff, pos)
+                if not match:
+                    pos = len(buff)
+                    break
+                if match.group() == '\\':
+                    # Skip the escaped character, (which may not be here yet)
+                    if match.end() >= len(buff):
+                        pos = match.start()
+                        break
+                    pos = match.end() + 1
+                    continue
+                in_string = False
+                pos = match.end()
+                continue
+            match = structure.search(buff, pos)
+            if not match:
+                pos = len(buff)
+                break
+            char = match.group()
+            pos = match.end()
+            if char == '"':
+                in_string = True
+            elif char in '{[':
+                opened = True
+                depth += 1
+                if depth == 2:
+                    start = match.start()
+            else:
+                if depth == 2:
+                    yield json_loads(buff[start:pos])
+                    start = None
+                depth -= 1
+        # Throw away everything which has already been parsed.
+        if start is None:
+            buff = ''
+            pos = 0
+        else:
+            buff = buff[start:]
+            pos -= start
+            start = 0
+
+__all__ = ['json_loads', 'json_iter_loads']
 
@@ -0,0 +1,254 @@
+"""
+request instrumentation
+
+Every request a connection makes, (object writes and batched requests
+included), is described by a RequestEvent, which is passed to the
+connection's hooks before the request is sent and again once its response
+has arrived, (or it has failed). Exceptions raised by hooks are ignored. A
+HistogramCollector is a hook which keeps latency histograms and counters
+in memory.
+
+>>> collector = HistogramCollector()
+>>> conn = cloudfiles.get_connection('jsmith', '1234567890',
+...                                  hooks=[collector])
+>>> conn['container1'].list_objects()
+>>> print collector.report()
+
+See COPYING for license information.
+"""
+
+from bisect    import bisect_left
+from threading import Lock
+from time      import time
+import consts
+
+class RequestEvent(object):
+    """
+    A description of one request, (including any retries of it).
+
+    Times are in seconds. The time to first byte runs from the request
+    being sent to its response headers being read, while the latency
+    covers the whole call, (connecting, authenticating and retrying
+    included).
+
+    @ivar service: "storage" or "cdn"
+    @type service: str
+    @ivar method: the request method
+    @type method: str
+    @ivar template: the request path with its names replaced by
+                    placeholders, i.e. "/{container}/{object}"
+    @type template: str
+    @ivar path: the request path, (including any query string)
+    @type path: str
+    @ivar status: the response status, (None if the request failed)
+    @type status: int
+    @ivar reason: the response reason phrase
+    @type reason: str
+    @ivar bytes_sent: the size of the request body
+    @type bytes_sent: int
+    @ivar bytes_received: the size of the response body given by its
+                          Content-Length, (None if it was not given)
+    @type bytes_received: int
+    @ivar connect_time: the time spent opening connections
+    @type connect_time: float
+    @ivar auth_time: the time spent authenticating again, (after a 401)
+    @type auth_time: float
+    @ivar ttfb: the time to first byte of the final attempt
+    @type ttfb: float
+    @ivar latency: the time the whole call took
+    @type latency: float
+    @ivar retries: the number of times the request was sent again
+    @type retries: int
+    @ivar reauthenticated: whether the session token was rejected and
+                           renewed
+    @type reauthenticated: bool
+    @ivar error: the exception the request failed with, (if any)
+    @type error: Exception
+    """
+    __slots__ = ('service', 'method', 'template', 'path', 'status', 'reason',
+                 'bytes_sent', 'bytes_received', 'connect_time', 'auth_time',
+                 'ttfb', 'latency', 'retries', 'reauthenticated', 'error',
+                 'start')
+
+    def __init__(self, service, method, path, bytes_sent):
+        self.service = service
+        self.method = method
+        self.template = _templates[min(len(path), len(_templates) - 1)]
+        self.path = None
+        self.status = self.reason = self.bytes_received = None
+        self.bytes_sent = bytes_sent
+        self.connect_time = self.auth_time = 0.0
+        self.ttfb = self.latency = None
+        self.retries = 0
+        self.reauthenticated = False
+        self.error = None
+        self.start = time()
+
+    def __repr__(self):
+        return '<RequestEvent: %s %s %s %s>' % (self.service, self.method,
+                                                self.template, self.status)
+
+# Request path templates by the number of path elements.
+_templates = ('/', '/{container}', '/{container}/{object}')
+
+class RequestHook(object):
+    """
+    The base class of request hooks, which are passed to a connection
+    using its hooks keyword, (and are shared by its clones and pools).
+    Subclasses override either method, (or both), which are called on the
+    thread making the request.
+    """
+    def before_request(self, event):
+        """
+        Called with a new L{RequestEvent} before a request is sent.
+        """
+        pass
+
+    def after_request(self, event):
+        """
+        Called with a completed L{RequestEvent} once the response headers
+        have been read, (or the request has failed).
+        """
+        pass
+
+class Histogram(object):
+    """
+    A histogram of values counted into buckets with fixed upper bounds,
+    (and an overflow bucket).
+    """
+    def __init__(self, bounds=consts.latency_buckets):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+
+    def add(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def mean(self):
+        return self.count and self.total / self.count or None
+
+    def percentile(self, percent):
+        """
+        Returns an upper bound on the given percentile of the values, (the
+        bound of the bucket it falls in, or the largest value seen if it
+        falls in the overflow bucket).
+        """
+        if not self.count:
+            return None
+        rank = percent / 100.0 * self.count
+        seen = 0
+        for (index, count) in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                if index < len(self.bounds):
+                    return min(self.bounds[index], self.max)
+                break
+        return self.max
+
+class RequestStats(object):
+    """
+    Counters and histograms of the requests of one kind, (service, method
+    and path template).
+
+    @ivar latency: the latencies of the requests
+    @type latency: L{Histogram}
+    @ivar ttfb: the times to first byte of the requests
+    @type ttfb: L{Histogram}
+    """
+    def __init__(self, bounds=consts.latency_buckets):
+        self.count = self.errors = self.retries = self.reauthentications = 0
+        self.bytes_sent = self.bytes_received = 0
+        self.connect_time = self.auth_time = 0.0
+        self.latency = Histogram(bounds)
+        self.ttfb = Histogram(bounds)
+
+    def add(self, event):
+        self.count += 1
+        if event.error is not None or event.status >= 400:
+            self.errors += 1
+        self.retries += event.retries
+        self.reauthentications += event.reauthenticated and 1 or 0
+        self.bytes_sent += event.bytes_sent
+        self.bytes_received += event.bytes_received or 0
+        self.connect_time += event.connect_time
+        self.auth_time += event.auth_time
+        self.latency.add(event.latency)
+        if event.ttfb is not None:
+            self.ttfb.add(event.ttfb)
+
+class HistogramCollector(RequestHook):
+    """
+    A thread-safe request hook which keeps L{RequestStats} in memory for
+    each kind of request, (by service, method and path template).
+
+    >>> collector.stats('GET', '/{container}/{object}').latency.percentile(99)
+    0.25
+    """
+    def __init__(self, bounds=consts.latency_buckets):
+        self.bounds = tuple(bounds)
+        self._lock = Lock()
+        self._stats = {}
+
+    def after_request(self, event):
+        key = (event.service, event.method, event.template)
+        self._lock.acquire()
+        try:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = RequestStats(self.bounds)
+            stats.add(event)
+        finally:
+            self._lock.release()
+
+    def stats(self, method, template, service='storage'):
+        """
+        Returns the L{RequestStats} of one kind of request, (or None if
+        there have been none).
+        """
+        return self._stats.get((service, method, template))
+
+    def keys(self):
+        """
+        Returns the (service, method, template) of each kind of request
+        seen, in order.
+        """
+        return sorted(self._stats.keys())
+
+    def reset(self):
+        """
+        Discards everything collected so far.
+        """
+        self._lock.acquire()
+        try:
+            self._stats = {}
+        finally:
+            self._lock.release()
+
+    def report(self):
+        """
+        Returns a table of the requests seen, with their error and retry
+        counts, latency percentiles and mean time to first byte, (in
+        milliseconds).
+        """
+        def ms(value):
+            return value is not None and '%.1f' % (value * 1000) or '-'
+        lines = ['%-7s %-6s %-22s %7s %6s %6s %8s %8s %8s %8s' %
+                 ('service', 'method', 'template', 'count', 'errors',
+                  'retry', 'p50', 'p90', 'p99', 'ttfb')]
+        for key in self.keys():
+            stats = self._stats[key]
+            lines.append('%-7s %-6s %-22s %7d %6d %6d %8s %8s %8s %8s' %
+                         (key + (stats.count, stats.errors, stats.retries,
+                          ms(stats.latency.percentile(50)),
+                          ms(stats.latency.percentile(90)),
+                          ms(stats.latency.percentile(99)),
+                          ms(stats.ttfb.mean()))))
+        return '\n'.join(lines)
+
+# vim:set ai sw=4 ts=4 tw=0 expandtab:
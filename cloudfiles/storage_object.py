@@ -8,20 +8,40 @@ arbitrary metadata with them.
 See COPYING for license information.
 """
 
-import md5, StringIO, mimetypes, os, tempfile
+import md5, StringIO, mimetypes, os, sys, tempfile, mmap, stat, zlib
+from copy    import copy
 from urllib  import quote
+from httplib import HTTPException, IncompleteRead
+from threading import Lock, Thread, Event
+from Queue   import Queue, Empty
 from errors  import ResponseError, NoSuchObject, \
                     InvalidObjectName, InvalidObjectSize, \
                     InvalidMetaName, InvalidMetaValue, \
                     IncompleteSend
-from socket  import timeout
+from socket  import timeout, error as socket_error
+from time    import time
 import consts
-from utils   import requires_name
+from utils   import requires_name, parallel_map, NameIndex, ChunkSize
 
 # Because HTTPResponse objects *have* to have read() called on them 
 # before they can be used again ...
 # pylint: disable-msg=W0612
 
+def _lazy(attr):
+    """
+    Returns a property for an attribute which is only initialized from the
+    remote service, (if at all), the first time it is read. A value
+    assigned before then is kept when the rest are initialized.
+    """
+    def fget(self):
+        self._load()
+        return getattr(self, attr)
+    def fset(self, value):
+        if not self._loaded:
+            self._assigned[attr] = value
+        setattr(self, attr, value)
+    return property(fget, fset)
+
 class Object(object):
     """
     Storage data representing an object, (metadata and data).
@@ -29,8 +49,13 @@ class Object(object):
     @undocumented: _make_headers
     @undocumented: _name_check
     @undocumented: _initialize
+    @undocumented: _load
+    @undocumented: _cached_content
+    @undocumented: _chunking
     @undocumented: compute_md5sum
     @undocumented: __get_conn_for_write
+    @undocumented: _send_mapped
+    @undocumented: _mapped_save
     @ivar name: the object's name (generally treat as read-only)
     @type name: str
     @ivar content_type: the object's content-type (set or read)
@@ -41,19 +66,41 @@ class Object(object):
     @type size: number
     @ivar last_modified: date and time of last file modification (cached)
     @type last_modified: str
+
+    The content_type, metadata, size, last_modified, etag and manifest
+    attributes of an Object created by name are requested from the remote
+    service when one of them is first read, (assigning them, or writing
+    the object, makes no request).
     @ivar container: the object's container (generally treat as read-only)
     @type container: L{Container}
+    @ivar manifest: the container/prefix of the segments this object is
+            assembled from, if any (read; cleared by write and send)
+    @type manifest: str
     """
-    # R/O support of the legacy objsum attr.
-    objsum = property(lambda self: self._etag)
+    content_type = _lazy('_content_type')
+    metadata = _lazy('_metadata')
+    size = _lazy('_size')
+    last_modified = _lazy('_last_modified')
+    manifest = _lazy('_manifest')
+
+    def __get_etag(self):
+        self._load()
+        return self._etag
 
     def __set_etag(self, value):
+        if not self._loaded:
+            self._assigned['_etag'] = value
+            self._assigned['_etag_override'] = True
         self._etag = value
         self._etag_override = True
 
-    etag = property(lambda self: self._etag, __set_etag)
+    etag = property(__get_etag, __set_etag)
+
+    # R/O support of the legacy objsum attr.
+    objsum = property(__get_etag)
 
-    def __init__(self, container, name=None, force_exists=False, object_record=None):
+    def __init__(self, container, name=None, force_exists=False,
+                 object_record=None, check=True):
         """
         Storage objects rarely if ever need to be instantiated directly by the
         user.
@@ -64,26 +111,44 @@ class Object(object):
         methods on its parent L{Container} object.
         """
         self.container = container
-        self.last_modified = None
-        self.metadata = {}
+        self._last_modified = None
+        self._metadata = {}
+        self._manifest = None
+        self._etag_override = False
+        self._loaded = True
+        self._assigned = {}
         if object_record:
             self.name = object_record['name']
-            self.content_type = object_record['content_type']
-            self.size = object_record['bytes']
-            self.last_modified = object_record['last_modified']
+            self._content_type = object_record['content_type']
+            self._size = object_record['bytes']
+            self._last_modified = object_record['last_modified']
             self._etag = object_record['hash']
-            self._etag_override = False
         else:
             self.name = name
-            self.content_type = None
-            self.size = None
+            self._content_type = None
+            self._size = None
             self._etag = None
-            self._etag_override = False
-            if not self._initialize() and force_exists:
-                raise NoSuchObject(self.name)
+            if force_exists:
+                if not self._initialize():
+                    raise NoSuchObject(self.name)
+            elif check:
+                self._loaded = False
+
+    def _load(self):
+        """
+        Initialize the Object from the remote service, (once), if that
+        hasn't been done already.
+        """
+        if not self._loaded:
+            self._loaded = True
+            self._initialize()
+            for (attr, value) in self._assigned.items():
+                setattr(self, attr, value)
+            self._assigned = {}
 
     @requires_name(InvalidObjectName)
-    def read(self, size=-1, offset=0, hdrs=None, buffer=None, callback=None):
+    def read(self, size=-1, offset=0, hdrs=None, buffer=None, callback=None,
+             chunksize=None):
         """
         Read the content from the remote storage object.
 
@@ -98,6 +163,14 @@ class Object(object):
         the total size of the transfer. Note: This option is only
         applicable when used in conjunction with the buffer option.
 
+        If the connection has an object cache, whole-object reads are
+        answered from a local copy which is revalidated against the
+        object's ETag, (and downloaded again only if it has changed).
+
+        Objects written compressed, (see L{write}), are decompressed as
+        they are read, except for byte ranges, which address the stored
+        data and are returned as is.
+
         >>> test_object.write('hello')
         >>> test_object.read()
         'hello'
@@ -112,10 +185,38 @@ class Object(object):
         @type buffer: file-like object
         @param callback: function to be used as a progress callback
         @type callback: callable(transferred, size)
+        @param chunksize: size in bytes of each write to the buffer, (by
+                          default the connection's chunk size)
+        @type chunksize: number
         @rtype: str or None
         @return: a string of all data in the object, or None if a buffer is used
         """
         self._name_check()
+        chunking = self._chunking(chunksize)
+        if size <= 0:
+            (data, codec) = self._cached_content(hdrs)
+            if data is not None:
+                try:
+                    decoder = _decoder(codec)
+                    if not hasattr(buffer, 'write'):
+                        if decoder:
+                            return decoder.decompress(data[:]) + \
+                                   decoder.flush()
+                        return data[:]
+                    chunksize = chunking.size
+                    for offset in xrange(0, len(data), chunksize):
+                        buff = data[offset:offset + chunksize]
+                        if decoder:
+                            buff = decoder.decompress(buff)
+                        buffer.write(buff)
+                        if callable(callback):
+                            callback(min(offset + chunksize, len(data)),
+                                     len(data))
+                    if decoder:
+                        buffer.write(decoder.flush())
+                    return None
+                finally:
+                    data and data.close()
         if size > 0:
             range = 'bytes=%d-%d' % (offset, (offset + size) - 1)
             if hdrs:
@@ -127,42 +228,299 @@ class Object(object):
         if (response.status < 200) or (response.status > 299):
             buff = response.read()
             raise ResponseError(response.status, response.reason)
+        decoder = not (hdrs and 'Range' in hdrs) and _decoder(
+                response.getheader('x-object-meta-%s' % _compression_meta)) \
+                or None
 
         if hasattr(buffer, 'write'):
-            scratch = response.read(8192)
+            # The size of the transfer, (without requesting the object's).
+            total = response.getheader('content-length')
+            if total is not None:
+                total = int(total)
+            scratch = _timed_read(response, chunking)
             transferred = 0
 
             while len(scratch) > 0:
-                buffer.write(scratch)
+                if decoder:
+                    buffer.write(decoder.decompress(scratch))
+                else:
+                    buffer.write(scratch)
                 transferred += len(scratch)
                 if callable(callback):
-                    callback(transferred, self.size)
-                scratch = response.read(8192)
+                    callback(transferred, total)
+                scratch = _timed_read(response, chunking)
+            if decoder:
+                buffer.write(decoder.flush())
             return None
+        elif decoder:
+            return decoder.decompress(response.read()) + decoder.flush()
         else:
             return response.read()
 
-    def save_to_filename(self, filename, callback=None):
+    @requires_name(InvalidObjectName)
+    def readinto(self, target, offset=0, hdrs=None, callback=None,
+                 chunksize=None):
+        """
+        Read the content of the remote storage object, starting at offset,
+        directly into a writable buffer, (a bytearray, a writable mmap, or
+        anything else supporting slice assignment), and return the number
+        of bytes read. At most len(target) bytes are read, in reads of up
+        to chunksize bytes, without building the content up as a string.
+
+        >>> data = bytearray(test_object.size)
+        >>> test_object.readinto(data)
+        31
+
+        @param target: the buffer to read the content into
+        @type target: bytearray, mmap or memoryview
+        @param offset: the location in the object to start reading from
+        @type offset: number
+        @param hdrs: an optional dict of headers to send with the request
+        @type hdrs: dictionary
+        @param callback: function to be used as a progress callback
+        @type callback: callable(transferred, size)
+        @param chunksize: the largest number of bytes to read at once, (by
+                          default the connection's chunk size)
+        @type chunksize: number
+        @rtype: int
+        @return: the number of bytes read into target
+        """
+        self._name_check()
+        if not len(target):
+            return 0
+        hdrs = dict(hdrs or {})
+        hdrs['Range'] = 'bytes=%d-%d' % (offset, offset + len(target) - 1)
+        response = self.container.conn.make_request('GET',
+                path = [self.container.name, self.name], hdrs = hdrs)
+        if response.status == 416:
+            # The offset is at or beyond the end of the object.
+            buff = response.read()
+            return 0
+        if (response.status != 206) and \
+                not (response.status == 200 and offset == 0):
+            if response.status == 200:
+                # The Range was ignored; don't download the whole object.
+                response.close()
+                self.container.conn.connection.close()
+            else:
+                buff = response.read()
+            raise ResponseError(response.status, response.reason)
+        progress = [0]
+        def report(count):
+            progress[0] += count
+            if callable(callback):
+                callback(progress[0], len(target))
+        count = _read_into(response, target, 0, len(target),
+                           self._chunking(chunksize), report)
+        if not response.isclosed():
+            # A server which ignored the Range is sending the rest of the
+            # object, which is cheaper to hang up on than to read.
+            response.close()
+            self.container.conn.connection.close()
+        return count
+
+    def save_to_filename(self, filename, callback=None, threads=1,
+                         range_size=consts.default_range_size, retries=0,
+                         pool=None, chunksize=None):
         """
         Save the contents of the object to filename.
 
+        When threads is greater than one, (or a pool is given), the object
+        is split into byte ranges of range_size which are downloaded
+        concurrently over pooled connections, and written straight into
+        their offsets of the output file. A range interrupted by a network
+        error is resumed up to retries times. Every range is requested with
+        If-Match for the object's ETag, so should the object be replaced
+        part way, the download fails with a ResponseError, (412), rather
+        than mixing the two versions. Otherwise the object is read
+        through the connection's object cache, (if any). Either way, the
+        content is read straight into a memory map of the preallocated
+        output file, in reads of up to chunksize bytes.
+
+        Objects written compressed, (see L{write}), are saved decompressed,
+        as by L{read}; their content is downloaded in one piece, (whatever
+        threads is), and written to the file as it is decompressed.
+
         >>> container = connection['container1']
         >>> obj = container.get_object('backup_file')
         >>> obj.save_to_filename('./backup_file')
+        >>> obj.save_to_filename('./backup_file', threads=8, retries=3)
 
         @param filename: name of the file
         @type filename: str
         @param callback: function to be used as a progress callback
         @type callback: callable(transferred, size)
+        @param threads: number of ranges to download concurrently
+        @type threads: int
+        @param range_size: size in bytes of each range
+        @type range_size: int
+        @param retries: number of times to retry each range
+        @type retries: int
+        @param pool: connections to download with, (by default a pool of
+                     clones of the container's connection)
+        @type pool: L{ConnectionPool}
+        @param chunksize: the largest number of bytes to read at once, (by
+                          default the connection's chunk size)
+        @type chunksize: int
         """
-        try:
+        if (threads > 1 or pool) and \
+                not self.metadata.get(_compression_meta):
+            # The ranges of compressed content can't be decompressed apart.
+            return self._parallel_save(filename, callback, threads,
+                                       range_size, retries, pool,
+                                       self._chunking(chunksize))
+        if self.container.conn.object_cache is not None:
             fobj = open(filename, 'wb')
-            self.read(buffer=fobj, callback=callback)
+            try:
+                self.read(buffer=fobj, callback=callback, chunksize=chunksize)
+            finally:
+                fobj.close()
+            return
+        self._mapped_save(filename, callback, self._chunking(chunksize))
+
+    @requires_name(InvalidObjectName)
+    def _mapped_save(self, filename, callback, chunking):
+        """
+        Download the object into a memory map of filename.
+        """
+        self._name_check()
+        response = self.container.conn.make_request('GET',
+                path = [self.container.name, self.name])
+        if (response.status < 200) or (response.status > 299):
+            buff = response.read()
+            raise ResponseError(response.status, response.reason)
+        size = response.getheader('content-length')
+        decoder = _decoder(
+                response.getheader('x-object-meta-%s' % _compression_meta))
+        fobj = open(filename, 'w+b')
+        try:
+            if size is None or decoder:
+                # A chunked or compressed response, which can't be
+                # preallocated.
+                if size is not None:
+                    size = int(size)
+                (buff, transferred) = (_timed_read(response, chunking), 0)
+                while len(buff) > 0:
+                    transferred += len(buff)
+                    if decoder:
+                        buff = decoder.decompress(buff)
+                    fobj.write(buff)
+                    if callable(callback):
+                        callback(transferred, size)
+                    buff = _timed_read(response, chunking)
+                if decoder:
+                    fobj.write(decoder.flush())
+                return
+            size = int(size)
+            fobj.truncate(size)
+            if not size:
+                return
+            target = mmap.mmap(fobj.fileno(), size)
+            try:
+                progress = [0]
+                def report(count):
+                    progress[0] += count
+                    if callable(callback):
+                        callback(progress[0], size)
+                count = _read_into(response, target, 0, size, chunking,
+                                   report)
+                target.flush()
+            finally:
+                target.close()
+            if count < size:
+                raise IncompleteRead('', size - count)
         finally:
             fobj.close()
 
     @requires_name(InvalidObjectName)
-    def stream(self, chunksize=8192, hdrs=None):
+    def _parallel_save(self, filename, callback, threads, range_size,
+                       retries, pool, chunking):
+        """
+        Download the object as concurrent byte ranges into filename.
+        """
+        self._name_check()
+        size = self.size
+        if size is None:
+            raise NoSuchObject(self.name)
+        etag = self.etag
+
+        fobj = open(filename, 'w+b')
+        try:
+            fobj.truncate(size)
+            if not size:
+                return
+            target = mmap.mmap(fobj.fileno(), size)
+        finally:
+            fobj.close()
+
+        if pool is None:
+            from connection import ConnectionPool
+            own_pool = pool = ConnectionPool.from_connection(
+                    self.container.conn, poolsize=threads)
+        else:
+            own_pool = None
+
+        lock = Lock()
+        progress = [0]
+        def report(count):
+            lock.acquire()
+            try:
+                progress[0] += count
+                if callable(callback):
+                    callback(progress[0], size)
+            finally:
+                lock.release()
+
+        path = [self.container.name, self.name]
+        changed = Event()
+        def fetch(offset):
+            end = min(offset + range_size, size)
+            done = [offset]
+            def advance(count):
+                done[0] += count
+                report(count)
+            attempts = 0
+            while done[0] < end and not changed.isSet():
+                hdrs = {'Range': 'bytes=%d-%d' % (done[0], end - 1)}
+                if etag:
+                    # Every range must come from the same version.
+                    hdrs['If-Match'] = etag
+                try:
+                    with pool.connection() as conn:
+                        response = conn.make_request('GET', path, hdrs=hdrs)
+                        if response.status == 412:
+                            changed.set()
+                        if response.status != 206 and not \
+                                (response.status == 200 and
+                                 done[0] == 0 and end == size):
+                            buff = response.read()
+                            raise ResponseError(response.status,
+                                                response.reason)
+                        _read_into(response, target, done[0], end,
+                                   chunking, advance)
+                        if done[0] < end:
+                            raise IncompleteRead('', end - done[0])
+                except (socket_error, HTTPException):
+                    # Resume the range from wherever it was interrupted.
+                    attempts += 1
+                    if attempts > retries:
+                        raise
+
+        try:
+            failures = parallel_map(fetch, xrange(0, size, range_size),
+                                    threads)
+            target.flush()
+        finally:
+            target.close()
+            if own_pool:
+                own_pool.close()
+        if changed.isSet():
+            raise ResponseError(412, 'Precondition Failed')
+        if failures:
+            raise failures[0][1]
+
+    @requires_name(InvalidObjectName)
+    def stream(self, chunksize=None, hdrs=None):
         """
         Return a generator of the remote storage object's data.
 
@@ -176,7 +534,11 @@ class Object(object):
         >>> '-'.join(test_object.stream(chunksize=1))
         'h-e-l-l-o'
 
-        @param chunksize: size in bytes yielded by the generator
+        Objects written compressed, (see L{write}), are decompressed as
+        they are streamed, so the pieces yielded may be of any size.
+
+        @param chunksize: size in bytes yielded by the generator, (by default
+                          the connection's chunk size)
         @type chunksize: number
         @param hdrs: an optional dict of headers to send in the request
         @type hdrs: dict
@@ -184,18 +546,98 @@ class Object(object):
         @return: a generator which yields strings as the object is downloaded
         """
         self._name_check()
+        chunking = self._chunking(chunksize)
+        (data, codec) = self._cached_content(hdrs)
+        if data is not None:
+            try:
+                chunksize = chunking.size
+                chunks = (data[offset:offset + chunksize]
+                          for offset in xrange(0, len(data), chunksize))
+                if codec:
+                    chunks = _decompressed(chunks, codec)
+                for chunk in chunks:
+                    yield chunk
+            finally:
+                data and data.close()
+            return
         response = self.container.conn.make_request('GET',
                 path = [self.container.name, self.name], hdrs = hdrs)
         if response.status < 200 or response.status > 299:
             buff = response.read()
             raise ResponseError(response.status, response.reason)
-        buff = response.read(chunksize)
-        while len(buff) > 0:
-            yield buff
-            buff = response.read(chunksize)
+        codec = not (hdrs and 'Range' in hdrs) and response.getheader(
+                'x-object-meta-%s' % _compression_meta)
+        if codec:
+            chunks = iter(lambda: _timed_read(response, chunking), '')
+            for chunk in _decompressed(chunks, codec):
+                yield chunk
+        else:
+            buff = _timed_read(response, chunking)
+            while len(buff) > 0:
+                yield buff
+                buff = _timed_read(response, chunking)
         # I hate you httplib
         buff = response.read()
 
+    def _chunking(self, chunksize=None):
+        """
+        Returns the chunk size policy for a transfer, (a fixed chunksize if
+        one is given, or else the connection's).
+        """
+        if chunksize:
+            return ChunkSize(chunksize)
+        return self.container.conn.chunking
+
+    def _cached_content(self, hdrs=None):
+        """
+        Returns the object's content as a read-only mmap of its copy in the
+        connection's object cache, downloading it first if the cached copy
+        is missing or stale, along with the codec it was compressed with,
+        (or None and None if there is no object cache, or the request is
+        for a byte range).
+        """
+        cache = self.container.conn.object_cache
+        if cache is None or (hdrs and 'Range' in hdrs):
+            return (None, None)
+        path = [self.container.name, self.name]
+        hdrs = dict(hdrs or {})
+        etag = cache.etag(*path)
+        if etag:
+            hdrs['If-None-Match'] = etag
+        response = self.container.conn.make_request('GET', path, hdrs=hdrs)
+        if response.status == 304:
+            buff = response.read()
+            codec = cache.encoding(*path)
+            data = cache.open(path[0], path[1], etag)
+            if data is not None:
+                return (data, codec)
+            # The cached copy was evicted in the meantime.
+            del hdrs['If-None-Match']
+            response = self.container.conn.make_request('GET', path,
+                                                        hdrs=hdrs)
+        if (response.status < 200) or (response.status > 299):
+            buff = response.read()
+            if response.status == 404:
+                cache.invalidate(*path)
+            raise ResponseError(response.status, response.reason)
+
+        (fobj, tmpname) = cache.begin()
+        try:
+            try:
+                chunking = self._chunking()
+                buff = _timed_read(response, chunking)
+                while len(buff) > 0:
+                    fobj.write(buff)
+                    buff = _timed_read(response, chunking)
+            finally:
+                fobj.close()
+        except:
+            cache.abort(tmpname)
+            raise
+        codec = response.getheader('x-object-meta-%s' % _compression_meta)
+        return (cache.commit(path[0], path[1], response.getheader('etag'),
+                             tmpname, codec), codec)
+
     @requires_name(InvalidObjectName)
     def sync_metadata(self):
         """
@@ -209,13 +651,14 @@ class Object(object):
         .metadata attribute.
         """
         self._name_check()
-        if self.metadata:
+        if self._metadata:
             headers = self._make_headers()
             headers['Content-Length'] = 0
             response = self.container.conn.make_request(
                 'POST', [self.container.name, self.name], hdrs=headers, data=''
             )
             buff = response.read()
+            self.container.conn._invalidate(self.container.name, self.name)
             if response.status != 202:
                 raise ResponseError(response.status, response.reason)
 
@@ -223,24 +666,15 @@ class Object(object):
         headers = self._make_headers()
 
         headers['X-Auth-Token'] = self.container.conn.token
-
-        path = "/%s/%s/%s" % (self.container.conn.uri.rstrip('/'), \
-                quote(self.container.name), quote(self.name))
+        headers['User-Agent'] = consts.user_agent
 
         # Requests are handled a little differently for writes ...
-        http = self.container.conn.connection
-
-        # TODO: more/better exception handling please
-        http.putrequest('PUT', path)
-        for hdr in headers:
-            http.putheader(hdr, headers[hdr])
-        http.putheader('User-Agent', consts.user_agent)
-        http.endheaders()
-        return http
+        return self.container.conn._begin_request('PUT',
+                [self.container.name, self.name], headers)
 
     # pylint: disable-msg=W0622
     @requires_name(InvalidObjectName)
-    def write(self, data='', verify=True, callback=None):
+    def write(self, data='', verify=True, callback=None, compress=None):
         """
         Write data to the remote storage system.
 
@@ -257,29 +691,56 @@ class Object(object):
         will be for the amount of data written so far, the second for
         the total size of the transfer.
 
+        Regular files are not copied through Python strings; they are
+        memory mapped, checksummed in a single pass before the upload, (so
+        that the server verifies the ETag as it is received), and sent in
+        slices of the mapping of the connection's chunk size, from the
+        file's current position. The
+        checksum of a whole file unchanged since it was last uploaded is
+        taken from the connection's checksum index, (if it has one),
+        instead. Other data of pipelined_write_size bytes
+        or more is read ahead, and checksummed, on threads of their own
+        while it is being sent.
+
+        Given a compression codec, (only "gzip" is supported), the data is
+        compressed as it is sent, (see L{send}), and the codec is recorded
+        in the object's metadata so that L{read} and L{stream} decompress
+        it again. The etag and size attributes are then those of the
+        compressed data, as stored, (which with verify set is checksummed
+        as it is sent and compared with the ETag the server returns).
+
         >>> test_object = container.create_object('file.txt')
         >>> test_object.content_type = 'text/plain'
         >>> fp = open('./file.txt')
         >>> test_object.write(fp)
+        >>> test_object.write(open('./access.log'), compress='gzip')
 
         @param data: the data to be written
-        @type data: str or file
+        @type data: str, file or StringIO
         @param verify: enable/disable server-side checksum verification
         @type verify: boolean
         @param callback: function to be used as a progress callback
         @type callback: callable(transferred, size)
+        @param compress: the codec to compress the data with
+        @type compress: str
         """
         self._name_check()
+        self._manifest = None
+        if compress:
+            return self._write_compressed(data, verify, callback, compress)
+        self._metadata.pop(_compression_meta, None)
         if isinstance(data, file):
             # pylint: disable-msg=E1101
             try:
                 data.flush()
             except IOError:
                 pass # If the file descriptor is read-only this will fail
-            self.size = int(os.fstat(data.fileno())[6])
+            self._size = int(os.fstat(data.fileno())[6])
+        elif hasattr(data, 'read') and hasattr(data, 'len'):
+            self._size = data.len
         else:
             data = StringIO.StringIO(data)
-            self.size = data.len
+            self._size = data.len
 
         # If override is set (and _etag is not None), then the etag has
         # been manually assigned and we will not calculate our own.
@@ -287,42 +748,82 @@ class Object(object):
         if not self._etag_override:
             self._etag = None
 
-        if not self.content_type:
+        if not self._content_type:
             # pylint: disable-msg=E1101
             type = None
             if hasattr(data, 'name'):
                 type = mimetypes.guess_type(data.name)[0]
-            self.content_type = type and type or 'application/octet-stream'
+            self._content_type = type and type or 'application/octet-stream'
+
+        mapped = isinstance(data, file) and _map_file(data) or None
+        if mapped is not None:
+            start = min(data.tell(), len(mapped))
+            self._size = len(mapped) - start
+        if mapped is not None and verify and not self._etag_override:
+            index = self.container.conn.checksum_index
+            if start:
+                # The index only holds checksums of whole files.
+                index = None
+            fstat = index is not None and os.fstat(data.fileno())
+            self._etag = fstat and index.get(fstat)
+            if not self._etag:
+                checksum = md5.md5()
+                chunksize = self._chunking().size
+                for offset in xrange(start, len(mapped), chunksize):
+                    checksum.update(buffer(mapped, offset, chunksize))
+                self._etag = checksum.hexdigest()
+                if fstat:
+                    index.put(fstat, self._etag)
 
-        http = self.__get_conn_for_write()
+        try:
+            (http, event) = self.__get_conn_for_write()
 
-        response = None
-        transfered = 0
-        running_checksum = md5.md5()
+            response = None
+            transfered = 0
+            running_checksum = md5.md5()
 
-        buff = data.read(4096)
-        try:
-            while len(buff) > 0:
-                http.send(buff)
-                if verify and not self._etag_override:
-                    running_checksum.update(buff)
-                buff = data.read(4096)
-                transfered += len(buff)
-                if callable(callback):
-                    callback(transfered, self.size)
-            response = http.getresponse()
-            buff = response.read()
-        except timeout, err:
-            if response:
-                # pylint: disable-msg=E1101
+            try:
+                if mapped is not None:
+                    self._send_mapped(http, mapped, start, callback,
+                                      self._chunking())
+                elif self._size >= consts.pipelined_write_size:
+                    self._send_pipelined(http, data, callback,
+                            self._chunking(), verify and
+                            not self._etag_override and running_checksum
+                            or None)
+                else:
+                    chunking = self._chunking()
+                    buff = data.read(chunking.size)
+                    while len(buff) > 0:
+                        start = time()
+                        http.send(buff)
+                        chunking.observe(len(buff), time() - start)
+                        if verify and not self._etag_override:
+                            running_checksum.update(buff)
+                        buff = data.read(chunking.size)
+                        transfered += len(buff)
+                        if callable(callback):
+                            callback(transfered, self._size)
+                response = self.container.conn._get_response(http, event)
                 buff = response.read()
-            raise err
-        else:
-            if verify and not self._etag_override:
-                self._etag = running_checksum.hexdigest()
+            except:
+                error = sys.exc_info()
+                if response is None:
+                    self.container.conn._failed(event, error[1])
+                elif isinstance(error[1], timeout):
+                    # pylint: disable-msg=E1101
+                    buff = response.read()
+                raise error[0], error[1], error[2]
+            else:
+                if verify and not self._etag_override and mapped is None:
+                    self._etag = running_checksum.hexdigest()
+        finally:
+            if mapped is not None:
+                mapped.close()
 
         # ----------------------------------------------------------------
 
+        self.container.conn._invalidate(self.container.name, self.name)
         if (response.status < 200) or (response.status > 299):
             raise ResponseError(response.status, response.reason)
 
@@ -333,8 +834,119 @@ class Object(object):
                 if hdr[0].lower() == 'etag':
                     self._etag = hdr[1]
 
+    def _write_compressed(self, data, verify, callback, compress):
+        """
+        Write data compressed with a codec, (see L{write}).
+        """
+        _wbits(compress)
+        if isinstance(data, file):
+            size = int(os.fstat(data.fileno())[6])
+        elif hasattr(data, 'read'):
+            size = getattr(data, 'len', None)
+        else:
+            (size, data) = (len(data), StringIO.StringIO(data))
+        chunking = self._chunking()
+        def chunks():
+            transfered = 0
+            buff = data.read(chunking.size)
+            while buff:
+                yield buff
+                transfered += len(buff)
+                if callable(callback):
+                    callback(transfered, size)
+                buff = data.read(chunking.size)
+        self._etag = None
+        self._etag_override = False
+        self._send(chunks(), compress, verify and md5.md5() or None)
+
+    def _send_mapped(self, http, mapped, start, callback, chunking):
+        """
+        Sends a memory mapped file from offset start to its end as the body
+        of a write, in slices of the chunk size policy's size.
+        """
+        size = len(mapped) - start
+        sent = 0
+        while sent < size:
+            chunk = buffer(mapped, start + sent, chunking.size)
+            begin = time()
+            http.send(chunk)
+            chunking.observe(len(chunk), time() - begin)
+            sent += len(chunk)
+            if callable(callback):
+                callback(sent, size)
+
+    def _send_pipelined(self, http, data, callback, chunking, checksum=None):
+        """
+        Sends the remainder of a file-like object as the body of a write,
+        with the reads, (and updates of checksum, if given), on threads of
+        their own so that they overlap with sending. Read chunks are handed
+        over through bounded queues, holding at most write_pipeline_depth
+        chunks each. Should a read fail, the http connection is closed, (so
+        that the truncated body is never completed), and the error raised.
+        """
+        chunks = Queue(consts.write_pipeline_depth)
+        hashes = Queue(consts.write_pipeline_depth)
+        aborted = Event()
+
+        def read():
+            # The end of the data, (or the error the reads failed with).
+            end = None
+            try:
+                try:
+                    buff = data.read(chunking.size)
+                    while buff and not aborted.isSet():
+                        if checksum is not None:
+                            hashes.put(buff)
+                        chunks.put(buff)
+                        buff = data.read(chunking.size)
+                except Exception, err:
+                    end = err
+            finally:
+                hashes.put(None)
+                chunks.put(end)
+
+        def digest():
+            buff = hashes.get()
+            while buff is not None:
+                checksum.update(buff)
+                buff = hashes.get()
+
+        threads = [Thread(target=read)]
+        if checksum is not None:
+            threads.append(Thread(target=digest))
+        for thread in threads:
+            thread.setDaemon(True)
+            thread.start()
+        transfered = 0
+        try:
+            buff = chunks.get()
+            while isinstance(buff, str):
+                start = time()
+                http.send(buff)
+                chunking.observe(len(buff), time() - start)
+                transfered += len(buff)
+                if callable(callback):
+                    callback(transfered, self._size)
+                buff = chunks.get()
+            if buff is not None:
+                raise buff
+        except:
+            error = sys.exc_info()
+            http.close()
+            # Unblock the reader so that both threads finish.
+            aborted.set()
+            while threads[0].isAlive():
+                try:
+                    chunks.get(timeout=0.1)
+                except Empty:
+                    pass
+            raise error[0], error[1], error[2]
+        finally:
+            for thread in threads:
+                thread.join()
+
     @requires_name(InvalidObjectName)
-    def send(self, iterable):
+    def send(self, iterable, compress=None):
         """
         Write potentially transient data to the remote storage system using a
         generator or stream.
@@ -355,83 +967,135 @@ class Object(object):
         can be performed afterward though by using the etag attribute
         which is set to the value returned by the server).
 
+        Given a compression codec, (only "gzip" is supported), the content
+        is compressed as it is sent, always with chunked transfer encoding,
+        and the codec is recorded in the object's metadata, (see L{write}).
+
         >>> test_object = container.create_object('backup.tar.gz')
         >>> pfd = os.popen('tar -czvf - ./data/', 'r')
         >>> test_object.send(pfd)
+        >>> test_object = container.create_object('backup.tar')
+        >>> test_object.send(os.popen('tar -cvf - ./data/'), compress='gzip')
 
         @param iterable: stream or generator which yields the content to upload
         @type iterable: generator or stream
+        @param compress: the codec to compress the content with
+        @type compress: str
         """
         self._name_check()
+        self._send(iterable, compress)
 
+    def _send(self, iterable, compress=None, checksum=None):
+        """
+        Write the content of an iterable, (see L{send}). Given an md5
+        checksum object, what is sent is checksummed and compared with the
+        ETag the server returns.
+        """
+        chunking = self._chunking()
         if hasattr(iterable, 'read'):
             def file_iterator(file):
-                chunk = file.read(4095)
+                chunk = file.read(chunking.size)
                 while chunk:
                     yield chunk
-                    chunk = file.read(4095)
+                    chunk = file.read(chunking.size)
                 raise StopIteration()
             iterable = file_iterator(iterable)
 
+        self._manifest = None
+        if compress:
+            iterable = _compressed(iterable, _wbits(compress))
+            self._metadata[_compression_meta] = compress
+            self._size = None
+        else:
+            self._metadata.pop(_compression_meta, None)
+        if checksum is not None:
+            iterable = _checksummed(iterable, checksum)
         # This method implicitly diables verification
         if not self._etag_override:
             self._etag = None
 
-        if not self.content_type:
-            self.content_type = 'application/octet-stream'
+        if not self._content_type:
+            self._content_type = 'application/octet-stream'
 
-        path = "/%s/%s/%s" % (self.container.conn.uri.rstrip('/'), \
-                quote(self.container.name), quote(self.name))
         headers = self._make_headers()
-        if self.size is None:
+        if self._size is None:
             del headers['Content-Length']
             headers['Transfer-Encoding'] = 'chunked'
         headers['X-Auth-Token'] = self.container.conn.token
         headers['User-Agent'] = consts.user_agent
-        http = self.container.conn.connection
-        http.putrequest('PUT', path)
-        for key, value in headers.iteritems():
-            http.putheader(key, value)
-        http.endheaders()
+        (http, event) = self.container.conn._begin_request('PUT',
+                [self.container.name, self.name], headers)
 
         response = None
         transferred = 0
         try:
             for chunk in iterable:
-                if self.size is None:
+                start = time()
+                if self._size is None:
                     http.send("%X\r\n" % len(chunk))
                     http.send(chunk)
                     http.send("\r\n")
                 else:
                     http.send(chunk)
+                chunking.observe(len(chunk), time() - start)
                 transferred += len(chunk)
-            if self.size is None:
+            if self._size is None:
                 http.send("0\r\n\r\n")
             # If the generator didn't yield enough data, stop, drop, and roll.
-            elif transferred < self.size:
+            elif transferred < self._size:
                 raise IncompleteSend()
-            response = http.getresponse()
+            event.bytes_sent = transferred
+            response = self.container.conn._get_response(http, event)
             buff = response.read()
-        except timeout, err:
-            if response:
+        except:
+            error = sys.exc_info()
+            if response is None:
+                self.container.conn._failed(event, error[1])
+            elif isinstance(error[1], timeout):
                 # pylint: disable-msg=E1101
                 buff = response.read()
-            raise err
+            raise error[0], error[1], error[2]
 
+        self.container.conn._invalidate(self.container.name, self.name)
         if (response.status < 200) or (response.status > 299):
             raise ResponseError(response.status, response.reason)
 
         for hdr in response.getheaders():
             if hdr[0].lower() == 'etag':
                 self._etag = hdr[1]
-
-    def load_from_filename(self, filename, verify=True, callback=None):
+        if compress:
+            self._size = transferred
+        if checksum is not None and self._etag != checksum.hexdigest():
+            raise ResponseError(422, 'Unprocessable Entity')
+
+    def load_from_filename(self, filename, verify=True, callback=None,
+                           segment_size=None, threads=1, retries=0, pool=None,
+                           journal=None, check_segments=False):
         """
         Put the contents of the named file into remote storage.
 
+        If segment_size is given and the file is larger, it is uploaded as
+        a series of segment objects, (threads of them at a time, each
+        verified against its own md5 checksum and retried up to retries
+        times), followed by a manifest object that joins them together.
+        Segments are named after the object and the file's modification
+        time, size and the segment size, i.e.
+        "<name>/1285713402.52/52428800/10485760/00000000", so that the
+        manifest never joins in segments left over from other uploads.
+
+        Segmented uploads can be made resumable by naming a journal file,
+        in which each committed segment is recorded along with its etag.
+        Re-running an interrupted upload with the same journal skips the
+        segments recorded there, (after confirming their etags with a HEAD
+        request if check_segments is set). The journal is removed once the
+        manifest has been written.
+
         >>> test_object = container.create_object('file.txt')
         >>> test_object.content_type = 'text/plain'
         >>> test_object.load_from_filename('./my_file.txt')
+        >>> test_object.load_from_filename('./my_dvd.iso',
+        ...                                segment_size=104857600, threads=4,
+        ...                                journal='./my_dvd.iso.journal')
 
         @param filename: path to the file
         @type filename: str
@@ -439,11 +1103,149 @@ class Object(object):
         @type verify: boolean
         @param callback: function to be used as a progress callback
         @type callback: callable(transferred, size)
+        @param segment_size: the maximum size in bytes of each segment
+        @type segment_size: int
+        @param threads: number of segments to upload concurrently
+        @type threads: int
+        @param retries: number of times to retry each segment
+        @type retries: int
+        @param pool: connections to upload with, (by default a pool of
+                     clones of the container's connection)
+        @type pool: L{ConnectionPool}
+        @param journal: path of a file recording committed segments
+        @type journal: str
+        @param check_segments: confirm journaled segments with the server
+        @type check_segments: boolean
         """
+        if segment_size and os.path.getsize(filename) > segment_size:
+            return self._segmented_load(filename, verify, callback,
+                                        segment_size, threads, retries, pool,
+                                        journal, check_segments)
         fobj = open(filename, 'rb')
         self.write(fobj, verify=verify, callback=callback)
         fobj.close()
 
+    def _segment_prefix(self, stat, segment_size):
+        return '%s/%r/%d/%d/' % (self.name, stat.st_mtime, stat.st_size,
+                                 segment_size)
+
+    @requires_name(InvalidObjectName)
+    def _segmented_load(self, filename, verify, callback, segment_size,
+                        threads, retries, pool, journal=None,
+                        check_segments=False):
+        """
+        Upload a file as concurrent segment objects plus a manifest.
+        """
+        self._name_check()
+        stat = os.stat(filename)
+        size = stat.st_size
+        prefix = self._segment_prefix(stat, segment_size)
+        offsets = range(0, size, segment_size)
+        etags = [None] * len(offsets)
+        if journal:
+            journal = _UploadJournal(journal, '%s/%s' % (self.container.name,
+                    self.name), size, stat.st_mtime, segment_size)
+
+        if pool is None:
+            from connection import ConnectionPool
+            own_pool = pool = ConnectionPool.from_connection(
+                    self.container.conn, poolsize=threads)
+        else:
+            own_pool = None
+
+        lock = Lock()
+        progress = [0]
+        def report(count):
+            lock.acquire()
+            try:
+                progress[0] += count
+                if callable(callback):
+                    callback(progress[0], size)
+            finally:
+                lock.release()
+
+        def committed(index):
+            """
+            Return the journaled etag of a segment, (if it can be trusted).
+            """
+            etag = journal and journal.committed.get(index)
+            if not etag or not check_segments:
+                return etag
+            with pool.connection() as conn:
+                response = conn.make_request('HEAD',
+                        [self.container.name, '%s%08d' % (prefix, index)])
+                buff = response.read()
+            if (response.status >= 200) and (response.status < 300) and \
+                    response.getheader('etag') == etag:
+                return etag
+            return None
+
+        def upload(index):
+            length = min(segment_size, size - offsets[index])
+            etags[index] = committed(index)
+            if etags[index]:
+                report(length)
+                return
+            segment = _FileSegment(filename, offsets[index], length)
+            attempts = 0
+            try:
+                # With the checksum sent up front the server verifies it.
+                checksum = verify and self.compute_md5sum(segment) or None
+                while True:
+                    try:
+                        with pool.connection() as conn:
+                            container = copy(self.container)
+                            container.conn = conn
+                            obj = Object(container,
+                                         '%s%08d' % (prefix, index),
+                                         check=False)
+                            obj.content_type = 'application/octet-stream'
+                            if checksum:
+                                obj.etag = checksum
+                            segment.seek(0)
+                            obj.write(segment, verify=False)
+                        break
+                    except (socket_error, HTTPException, ResponseError):
+                        attempts += 1
+                        if attempts > retries:
+                            raise
+            finally:
+                segment.close()
+            etags[index] = obj.etag
+            if journal:
+                journal.record(index, obj.etag)
+            report(length)
+
+        try:
+            failures = parallel_map(upload, xrange(len(offsets)), threads)
+        finally:
+            if own_pool:
+                own_pool.close()
+            if journal:
+                journal.close()
+        if failures:
+            raise failures[0][1]
+
+        # A zero-length manifest makes the segments readable as one object.
+        self._metadata.pop(_compression_meta, None)
+        self._manifest = '%s/%s' % (quote(self.container.name), quote(prefix))
+        self._etag = None
+        self._etag_override = False
+        self._size = 0
+        if not self._content_type:
+            self._content_type = mimetypes.guess_type(filename)[0]
+        response = self.container.conn.make_request('PUT',
+                [self.container.name, self.name], hdrs=self._make_headers())
+        buff = response.read()
+        self.container.conn._invalidate(self.container.name, self.name)
+        if (response.status < 200) or (response.status > 299):
+            raise ResponseError(response.status, response.reason)
+        if journal:
+            os.unlink(journal.path)
+        self._size = size
+        self._etag = md5.new(''.join(etags)).hexdigest()
+        self._etag_override = False
+
     def _initialize(self):
         """
         Initialize the Object with values from the remote service (if any).
@@ -451,26 +1253,27 @@ class Object(object):
         if not self.name:
             return False
 
-        response = self.container.conn.make_request(
-                'HEAD', [self.container.name, self.name]
+        (status, reason, headers) = self.container.conn._head(
+                [self.container.name, self.name]
         )
-        buff = response.read()
-        if response.status == 404:
+        if status == 404:
             return False
-        if (response.status < 200) or (response.status > 299):
-            raise ResponseError(response.status, response.reason)
-        for hdr in response.getheaders():
+        if (status < 200) or (status > 299):
+            raise ResponseError(status, reason)
+        for hdr in headers:
             if hdr[0].lower() == 'content-type':
-                self.content_type = hdr[1]
+                self._content_type = hdr[1]
             if hdr[0].lower().startswith('x-object-meta-'):
-                self.metadata[hdr[0][14:]] = hdr[1]
+                self._metadata[hdr[0][14:]] = hdr[1]
             if hdr[0].lower() == 'etag':
                 self._etag = hdr[1]
                 self._etag_override = False
             if hdr[0].lower() == 'content-length':
-                self.size = int(hdr[1])
+                self._size = int(hdr[1])
             if hdr[0].lower() == 'last-modified':
-                self.last_modified = hdr[1]
+                self._last_modified = hdr[1]
+            if hdr[0].lower() == 'x-object-manifest':
+                self._manifest = hdr[1]
         return True
 
     def __str__(self):
@@ -486,30 +1289,40 @@ class Object(object):
         respective instance attributes.
         """
         headers = {}
-        headers['Content-Length'] = self.size and self.size or 0
+        headers['Content-Length'] = self._size and self._size or 0
         if self._etag: headers['ETag'] = self._etag
 
-        if self.content_type: headers['Content-Type'] = self.content_type
+        if self._content_type: headers['Content-Type'] = self._content_type
         else: headers['Content-Type'] = 'application/octet-stream'
 
-        for key in self.metadata:
+        if self._manifest: headers['X-Object-Manifest'] = self._manifest
+
+        for key in self._metadata:
             if len(key) > consts.meta_name_limit:
                 raise(InvalidMetaName(key))
-            if len(self.metadata[key]) > consts.meta_value_limit:
-                raise(InvalidMetaValue(self.metadata[key]))
-            headers['X-Object-Meta-'+key] = self.metadata[key]
+            if len(self._metadata[key]) > consts.meta_value_limit:
+                raise(InvalidMetaValue(self._metadata[key]))
+            headers['X-Object-Meta-'+key] = self._metadata[key]
         return headers
 
     @classmethod
-    def compute_md5sum(cls, fobj):
+    def compute_md5sum(cls, fobj, chunksize=consts.default_chunk_size,
+                       index=None):
         """
         Given an open file object, returns the md5 hexdigest of the data.
+
+        Given a L{ChecksumIndex} as well, and a regular file positioned at
+        its start, the checksum is taken from the index if the file is
+        unchanged since it was last read, (and recorded there otherwise).
         """
+        if index is not None and isinstance(fobj, file) and \
+                not fobj.tell() and stat.S_ISREG(os.fstat(fobj.fileno())[0]):
+            return index.checksum(fobj)
         checksum = md5.new()
-        buff = fobj.read(4096)
+        buff = fobj.read(chunksize)
         while buff:
             checksum.update(buff)
-            buff = fobj.read(4096)
+            buff = fobj.read(chunksize)
         fobj.seek(0)
         return checksum.hexdigest()
 
@@ -529,17 +1342,230 @@ class Object(object):
         return "%s/%s" % (self.container.public_uri().rstrip('/'),
                 quote(self.name))
 
+class _FileSegment(object):
+    """
+    A read-only, file-like view of length bytes of a file, starting at
+    offset.
+    """
+    def __init__(self, filename, offset, length):
+        self.name = filename
+        self.len = length
+        self._offset = offset
+        self._pos = 0
+        self._fobj = open(filename, 'rb')
+        self._fobj.seek(offset)
+
+    def read(self, size=-1):
+        remaining = self.len - self._pos
+        if size < 0 or size > remaining:
+            size = remaining
+        buff = self._fobj.read(size)
+        self._pos += len(buff)
+        return buff
+
+    def seek(self, pos):
+        self._pos = pos
+        self._fobj.seek(self._offset + pos)
+
+    def close(self):
+        self._fobj.close()
+
+# The metadata key recording an object's compression codec, and the zlib
+# window bits of each codec, (16 + MAX_WBITS selects the gzip format).
+_compression_meta = 'compression'
+_codecs = {'gzip': 16 + zlib.MAX_WBITS}
+
+def _wbits(codec):
+    """
+    Returns the zlib window bits for a compression codec.
+    """
+    if codec not in _codecs:
+        raise ValueError('Unsupported compression codec: %r' % codec)
+    return _codecs[codec]
+
+def _compressed(chunks, wbits):
+    """
+    Generator which compresses an iterable of chunks.
+    """
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED,
+                                  wbits)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def _checksummed(chunks, checksum):
+    """
+    Generator which updates an md5 checksum object with each chunk.
+    """
+    for chunk in chunks:
+        checksum.update(chunk)
+        yield chunk
+
+def _decoder(codec):
+    """
+    Returns a decompressor for a codec, (or None if codec is not set).
+    """
+    return codec and zlib.decompressobj(_wbits(codec)) or None
+
+def _decompressed(chunks, codec):
+    """
+    Generator which decompresses an iterable of chunks.
+    """
+    decoder = _decoder(codec)
+    for chunk in chunks:
+        data = decoder.decompress(chunk)
+        if data:
+            yield data
+    data = decoder.flush()
+    if data:
+        yield data
+
+def _timed_read(fobj, chunking):
+    """
+    Reads a chunk of the current chunk size from fobj, recording how long
+    the read took.
+    """
+    start = time()
+    data = fobj.read(chunking.size)
+    chunking.observe(len(data), time() - start)
+    return data
+
+def _read_into(response, target, start, end, chunking, report=None):
+    """
+    Reads the body of response into target[start:end], (in reads of up to
+    the current chunk size), returning the number of bytes read. The
+    response's own readinto() is used where httplib provides one.
+    """
+    readinto = getattr(response, 'readinto', None)
+    pos = start
+    while pos < end:
+        count = min(chunking.size, end - pos)
+        started = time()
+        if readinto is not None:
+            count = readinto(memoryview(target)[pos:pos + count])
+        else:
+            data = response.read(count)
+            count = len(data)
+            target[pos:pos + count] = data
+        chunking.observe(count, time() - started)
+        if not count:
+            break
+        pos += count
+        if report:
+            report(count)
+    return pos - start
+
+def _map_file(fobj):
+    """
+    Returns a read-only mmap of an open regular file, (or None if it is
+    empty, or is not a regular file).
+    """
+    try:
+        fstat = os.fstat(fobj.fileno())
+        if not stat.S_ISREG(fstat.st_mode) or not fstat.st_size:
+            return None
+        return mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError):
+        return None
+
+class _UploadJournal(object):
+    """
+    An append-only file recording the segments of an upload which have
+    been committed to the storage system, and their etags.
+
+    The first line identifies the upload, (object, file size and mtime,
+    and segment size); a journal for any other upload is started afresh.
+    """
+    def __init__(self, path, name, size, mtime, segment_size):
+        self.path = path
+        self.committed = {}
+        self._lock = Lock()
+        header = '\t'.join(('cloudfiles-upload', name, str(size),
+                            repr(mtime), str(segment_size))) + '\n'
+        try:
+            fobj = open(path, 'r')
+            try:
+                if fobj.readline() == header:
+                    for line in fobj:
+                        fields = line.split()
+                        if len(fields) == 2:
+                            self.committed[int(fields[0])] = fields[1]
+            finally:
+                fobj.close()
+        except IOError:
+            pass
+        if self.committed:
+            self._fobj = open(path, 'a')
+        else:
+            self._fobj = open(path, 'w')
+            self._fobj.write(header)
+            self._fobj.flush()
+
+    def record(self, index, etag):
+        """
+        Durably record that a segment has been committed.
+        """
+        self._lock.acquire()
+        try:
+            self._fobj.write('%d\t%s\n' % (index, etag))
+            self._fobj.flush()
+            os.fsync(self._fobj.fileno())
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._fobj.close()
+
+# Content-types repeat heavily across listings, so share one copy of each.
+_content_types = {}
+
+class ObjectRecord(object):
+    """
+    A compact record of a storage object's listing information.
+
+    Records can also be read like the dictionaries returned by
+    L{list_objects_info<Container.list_objects_info>}.
+    """
+    __slots__ = ('name', 'bytes', 'hash', 'last_modified', 'content_type')
+
+    def __init__(self, info):
+        self.name = info['name']
+        self.bytes = info['bytes']
+        self.hash = info['hash']
+        self.last_modified = info['last_modified']
+        self.content_type = _content_types.setdefault(info['content_type'],
+                                                      info['content_type'])
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __repr__(self):
+        return 'ObjectRecord(%r)' % self.name
+
 class ObjectResults(object):
     """
     An iterable results set object for Objects.
 
+    Listing information is held in compact L{ObjectRecord}s, L{Object}
+    instances are only created as items are accessed. Lookups by name are
+    served from an index built on first use.
+
     This class implements dictionary- and list-like interfaces.
     """
     def __init__(self, container, objects=None):
-        self._objects = objects and objects or list()
-        self._names = [obj['name'] for obj in self._objects]
+        self._objects = [ObjectRecord(obj) for obj in objects or ()]
+        self._index = None
         self.container = container
 
+    def _name_index(self):
+        if self._index is None:
+            self._index = NameIndex([obj.name for obj in self._objects])
+        return self._index
+
     def __getitem__(self, key):
         return Object(self.container, object_record=self._objects[key])
 
@@ -547,7 +1573,9 @@ class ObjectResults(object):
         return [Object(self.container, object_record=k) for k in self._objects[i:j]]
 
     def __contains__(self, item):
-        return item in self._objects
+        if isinstance(item, Object):
+            item = item.name
+        return item in self._name_index()
 
     def __len__(self):
         return len(self._objects)
@@ -560,12 +1588,27 @@ class ObjectResults(object):
         """
         returns an integer for the first index of value
         """
-        return self._names.index(value, *args)
+        if args:
+            return [obj.name for obj in self._objects].index(value, *args)
+        return self._name_index().index(value)
 
     def count(self, value):
         """
         returns the number of occurrences of value
         """
-        return self._names.count(value)
+        return self._name_index().count(value)
+
+    def names_with_prefix(self, prefix):
+        """
+        returns a sorted list of the object names beginning with prefix
+        """
+        return self._name_index().with_prefix(prefix)
+
+    def names_between(self, start, end=None):
+        """
+        returns a sorted list of the object names from start up to, (but
+        not including), end
+        """
+        return self._name_index().between(start, end)
 
 # vim:set ai sw=4 ts=4 tw=0 expandtab:
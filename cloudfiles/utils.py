@@ -1,9 +1,14 @@
 """ See COPYING for license information. """
 
 import re
+from bisect    import bisect_left
 from urlparse  import urlparse
+from threading import Thread, Lock
+from time      import time
+from Queue     import Queue
 from errors    import InvalidUrl
 from consts    import object_name_limit
+import consts
 
 def parse_url(url):
     """
@@ -45,3 +50,348 @@ def requires_name(exc_class):
         decorator.parent_func = f
         return decorator
     return wrapper
+
+def parallel_map(func, items, threads):
+    """
+    Calls func once for each of the items, (which may be any iterable,
+    including a generator), using up to threads worker threads.
+
+    Returns a list of (item, exception) two-tuples for each call that
+    raised an exception.
+    """
+    failures = []
+    queue = Queue(threads * 2)
+    done = object()
+    def worker():
+        while True:
+            item = queue.get()
+            if item is done:
+                return
+            try:
+                func(item)
+            except Exception, err:
+                failures.append((item, err))
+    workers = [Thread(target=worker) for i in range(max(1, threads))]
+    for thread in workers:
+        thread.setDaemon(True)
+        thread.start()
+    try:
+        for item in items:
+            queue.put(item)
+    finally:
+        for thread in workers:
+            queue.put(done)
+        for thread in workers:
+            thread.join()
+    return failures
+
+class _Prefetch(Thread):
+    """
+    Calls func(*args) on a background thread, holding on to the result.
+    """
+    def __init__(self, func, *args):
+        Thread.__init__(self)
+        self.setDaemon(True)
+        self.func = func
+        self.args = args
+        self.error = None
+        self.start()
+
+    def run(self):
+        try:
+            self.value = self.func(*self.args)
+        except Exception, err:
+            self.error = err
+
+    def result(self):
+        self.join()
+        if self.error:
+            raise self.error
+        return self.value
+
+def iter_pages(fetch, page_size, marker=None, prefetch=False):
+    """
+    Generator which yields each record of a paginated listing, following
+    the marker across pages. Given a marker, fetch must return an iterable
+    of at most page_size records (dicts with a "name" key) sorted by name.
+
+    When prefetch is set, each page is read in full on a background thread
+    while the records of the previous page are being consumed, (and should
+    the generator be closed early, it waits for a page still being read).
+    Otherwise records are yielded as fetch produces them.
+    """
+    if not prefetch:
+        while True:
+            count = 0
+            for record in fetch(marker):
+                count += 1
+                marker = record['name']
+                yield record
+            if count < page_size:
+                return
+
+    fetch_page = lambda marker: list(fetch(marker))
+    page = fetch_page(marker)
+    pending = None
+    try:
+        while page:
+            full = len(page) >= page_size
+            if full:
+                pending = _Prefetch(fetch_page, page[-1]['name'])
+            for record in page:
+                yield record
+            if not full:
+                return
+            page = pending.result()
+    finally:
+        # The fetch must be done with its connection before it is closed.
+        if pending is not None:
+            pending.join()
+
+class NameIndex(object):
+    """
+    An index over a list of names, supporting constant time exact lookups
+    and logarithmic time prefix and range queries.
+    """
+    def __init__(self, names):
+        self._first = {}
+        self._counts = {}
+        for (position, name) in enumerate(names):
+            self._first.setdefault(name, position)
+            self._counts[name] = self._counts.get(name, 0) + 1
+        self._sorted = sorted(self._first)
+
+    def __contains__(self, name):
+        try:
+            return name in self._first
+        except TypeError:
+            return False
+
+    def index(self, name):
+        """
+        Returns the position of the first occurrence of name.
+        """
+        try:
+            return self._first[name]
+        except (KeyError, TypeError):
+            raise ValueError('%r is not in list' % (name,))
+
+    def count(self, name):
+        """
+        Returns the number of occurrences of name.
+        """
+        try:
+            return self._counts.get(name, 0)
+        except TypeError:
+            return 0
+
+    def between(self, start, end=None):
+        """
+        Returns the sorted, distinct names greater than or equal to start
+        and less than end, (or without an upper bound if end is None).
+        """
+        left = bisect_left(self._sorted, start)
+        if end is None:
+            return self._sorted[left:]
+        return self._sorted[left:bisect_left(self._sorted, end, left)]
+
+    def with_prefix(self, prefix):
+        """
+        Returns the sorted, distinct names beginning with prefix.
+        """
+        names = []
+        for position in xrange(bisect_left(self._sorted, prefix),
+                               len(self._sorted)):
+            if not self._sorted[position].startswith(prefix):
+                break
+            names.append(self._sorted[position])
+        return names
+
+class LRUCache(object):
+    """
+    A thread-safe, bounded cache which evicts the least recently used entry
+    once it holds maxsize entries, and expires entries ttl seconds after
+    they were stored, (None meaning never).
+
+    The number of lookups which were and were not answered from the cache
+    are kept in the hits and misses attributes.
+    """
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = self.misses = 0
+        self._lock = Lock()
+        self._entries = {}
+        # Entries are [key, value, expires, prev, next] links in a circular
+        # list, ordered from least to most recently used.
+        self._root = root = [None, None, None, None, None]
+        root[3] = root[4] = root
+
+    def _unlink(self, link):
+        link[3][4] = link[4]
+        link[4][3] = link[3]
+
+    def _append(self, link):
+        root = self._root
+        link[3] = root[3]
+        link[4] = root
+        root[3][4] = root[3] = link
+
+    def get(self, key, default=None):
+        """
+        Returns the value stored for key, (or default if there is none or
+        it has expired).
+        """
+        self._lock.acquire()
+        try:
+            link = self._entries.get(key)
+            if link is not None and link[2] is not None and link[2] <= time():
+                self._unlink(link)
+                del self._entries[key]
+                link = None
+            if link is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._unlink(link)
+            self._append(link)
+            return link[1]
+        finally:
+            self._lock.release()
+
+    def put(self, key, value):
+        """
+        Stores value for key, evicting the least recently used entry if the
+        cache is full.
+        """
+        expires = self.ttl is not None and time() + self.ttl or None
+        self._lock.acquire()
+        try:
+            link = self._entries.get(key)
+            if link is not None:
+                self._unlink(link)
+            elif len(self._entries) >= self.maxsize:
+                oldest = self._root[4]
+                self._unlink(oldest)
+                del self._entries[oldest[0]]
+            link = [key, value, expires, None, None]
+            self._entries[key] = link
+            self._append(link)
+        finally:
+            self._lock.release()
+
+    def invalidate(self, key):
+        """
+        Discards the value stored for key, (if any).
+        """
+        self._lock.acquire()
+        try:
+            link = self._entries.pop(key, None)
+            if link is not None:
+                self._unlink(link)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """
+        Discards all stored values.
+        """
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            root = self._root
+            root[3] = root[4] = root
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def items(self):
+        """
+        Returns a list of the (key, value) two-tuples stored, from the least
+        to the most recently used, (expired or not).
+        """
+        self._lock.acquire()
+        try:
+            items = []
+            link = self._root[4]
+            while link is not self._root:
+                items.append((link[0], link[1]))
+                link = link[4]
+            return items
+        finally:
+            self._lock.release()
+
+class ChunkSize(object):
+    """
+    A fixed chunk size for reading and writing transfers.
+
+    @ivar size: the number of bytes to read or write at once
+    @type size: int
+    """
+    def __init__(self, size=consts.default_chunk_size):
+        self.size = int(size)
+
+    def observe(self, count, seconds):
+        """
+        Records that a single read or write of count bytes took seconds.
+        """
+        pass
+
+    def __repr__(self):
+        return '%s(%d)' % (self.__class__.__name__, self.size)
+
+class AdaptiveChunkSize(ChunkSize):
+    """
+    A chunk size which adapts to the observed throughput.
+
+    Transfers report how long each read or write takes, and the chunk size
+    is moved, (doubling or halving at most once per observation), toward
+    the power of two at which a transfer would make calls_per_second reads
+    or writes a second, within the minimum and maximum sizes. A policy is
+    shared by a connection's clones and pools, so observations are made
+    under a lock.
+    """
+    def __init__(self, minimum=consts.min_chunk_size,
+                 maximum=consts.max_chunk_size,
+                 calls_per_second=consts.adaptive_calls_per_second,
+                 smoothing=0.25):
+        ChunkSize.__init__(self, minimum)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.calls_per_second = calls_per_second
+        self.smoothing = smoothing
+        self.throughput = None
+        self._lock = Lock()
+
+    def observe(self, count, seconds):
+        if count <= 0:
+            return
+        rate = count / max(seconds, 1e-6)
+        self._lock.acquire()
+        try:
+            if self.throughput is None:
+                self.throughput = rate
+            else:
+                self.throughput += self.smoothing * (rate - self.throughput)
+            target = self.throughput / self.calls_per_second
+            size = self.size
+            if size < target and size < self.maximum:
+                size = min(size * 2, self.maximum)
+            elif size / 2 >= target and size > self.minimum:
+                size = max(size / 2, self.minimum)
+            self.size = size
+        finally:
+            self._lock.release()
+
+def chunk_policy(chunk_size=None):
+    """
+    Returns the chunk size policy for a connection's chunk_size argument,
+    (a size in bytes, "adaptive", or a L{ChunkSize} instance).
+    """
+    if isinstance(chunk_size, ChunkSize):
+        return chunk_size
+    if chunk_size == 'adaptive':
+        return AdaptiveChunkSize()
+    return ChunkSize(chunk_size or consts.default_chunk_size)
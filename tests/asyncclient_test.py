@@ -0,0 +1,278 @@
+#!/usr/bin/python
+
+import unittest, md5, socket, ssl, time
+from StringIO       import StringIO
+from threading      import Thread
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer   import ThreadingMixIn
+from misc           import printdoc
+from cloudfiles     import AsyncConnection
+from cloudfiles.asyncclient import _match_hostname
+from cloudfiles.utils import LRUCache
+from cloudfiles.errors import NoSuchObject, ResponseError
+
+class StorageHandler(BaseHTTPRequestHandler):
+    """
+    A minimal, in-memory, keep-alive storage service.
+    """
+    protocol_version = 'HTTP/1.1'
+    objects = {}
+    connections = 0
+    # tokens refused with a 401, and the seconds authentication takes
+    rejected = set()
+    auth_delay = 0
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        StorageHandler.connections += 1
+
+    def respond(self, status, body='', headers={}):
+        self.send_response(status)
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        if self.command != 'HEAD' or 'Content-Length' not in headers:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def key(self):
+        return self.path.split('?')[0].split('/', 3)[-1]
+
+    def do_GET(self):
+        if self.path.endswith('/auth'):
+            time.sleep(self.auth_delay)
+            return self.respond(204, headers={
+                'X-Storage-Url': 'http://127.0.0.1:%d/v1/account' % \
+                                 self.server.server_port,
+                'X-Auth-Token': 'token'})
+        if self.headers.get('x-auth-token') in self.rejected:
+            return self.respond(401)
+        key = self.key()
+        if '/' not in key:
+            names = sorted([k.split('/', 1)[1] for k in self.objects
+                            if k.startswith(key + '/')])
+            return self.respond(200, '[%s]' % ','.join(
+                ['{"name":"%s","bytes":%d}' % (n, len(self.objects[
+                 '%s/%s' % (key, n)])) for n in names]))
+        if key.endswith('/slow'):
+            time.sleep(1)
+        if key not in self.objects:
+            return self.respond(404)
+        body = self.objects[key]
+        if 'range' in self.headers:
+            (first, last) = self.headers['range'].split('=')[1].split('-')
+            return self.respond(206, body[int(first):int(last) + 1])
+        self.respond(200, body)
+
+    def do_HEAD(self):
+        key = self.key()
+        if '/' not in key:
+            count = len([k for k in self.objects if k.startswith(key + '/')])
+            return self.respond(204, headers={
+                'X-Container-Object-Count': count})
+        if key not in self.objects:
+            return self.respond(404)
+        body = self.objects[key]
+        self.respond(200, headers={'Content-Length': len(body),
+                                   'ETag': md5.new(body).hexdigest()})
+
+    def do_PUT(self):
+        if self.headers.get('transfer-encoding') == 'chunked':
+            body = []
+            size = int(self.rfile.readline().split(';')[0], 16)
+            while size:
+                body.append(self.rfile.read(size))
+                self.rfile.readline()
+                size = int(self.rfile.readline().split(';')[0], 16)
+            self.rfile.readline()
+            body = ''.join(body)
+        else:
+            body = self.rfile.read(int(self.headers['content-length']))
+        etag = md5.new(body).hexdigest()
+        if self.headers.get('etag', etag) != etag:
+            return self.respond(422)
+        self.objects[self.key()] = body
+        self.respond(201, headers={'ETag': etag})
+
+    def do_DELETE(self):
+        if self.objects.pop(self.key(), None) is None:
+            return self.respond(404)
+        self.respond(204)
+
+class StorageServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class AsyncClientTest(unittest.TestCase):
+    """
+    AsyncConnection tests, (against a local server).
+    """
+    @printdoc
+    def test_write_read(self):
+        """
+        Verify that objects written concurrently can be read and streamed
+        back, over no more connections than the per-host limit.
+        """
+        container = self.client.get_container('container1').result()
+        StorageHandler.connections = 0
+        requests = [container.create_object('object%d' % i).write('x' * i)
+                    for i in range(20)]
+        self.client.run()
+        for request in requests:
+            self.assert_(request.result() is None)
+        self.assert_(StorageHandler.connections <= 4)
+        reads = [container.create_object('object%d' % i).read()
+                 for i in range(20)]
+        self.client.run()
+        self.assert_([len(r.result()) for r in reads] == range(20))
+        pieces = []
+        obj = container.create_object('object19')
+        obj.stream(pieces.append).result()
+        self.assert_(''.join(pieces) == 'x' * 19)
+        container.create_object('object3').write('abc').result()
+        self.assert_(container.create_object('object3').read(size=2,
+                     offset=1).result() == 'bc')
+        hdrs = {'Range': 'bytes=1-2'}
+        self.assert_(container.create_object('object3').read(
+                     hdrs=hdrs).result() == 'bc')
+        pieces = []
+        container.create_object('object3').stream(pieces.append,
+                                                  hdrs=hdrs).result()
+        self.assert_(''.join(pieces) == 'bc')
+
+    @printdoc
+    def test_send_list_delete(self):
+        """
+        Verify chunked sends, listings, lookups and deletes.
+        """
+        container = self.client.get_container('container2').result()
+        obj = container.create_object('sent')
+        obj.send(iter(['the ', 'rain ', 'in ', 'spain'])).result()
+        self.assert_(obj.etag == md5.new('the rain in spain').hexdigest())
+        info = container.list_objects_info().result()
+        self.assert_([i['name'] for i in info] == ['sent'])
+        obj = container.get_object('sent').result()
+        self.assert_(obj.size == 17)
+        container.delete_object('sent').result()
+        self.assertRaises(NoSuchObject,
+                          container.get_object('sent').result)
+        self.assertRaises(ResponseError,
+                          container.create_object('sent').read().result)
+
+    @printdoc
+    def test_write_file(self):
+        """
+        Verify that files are checksummed, (off the loop's thread), and
+        written.
+        """
+        container = self.client.get_container('container1').result()
+        objects = [container.create_object('file%d' % i) for i in range(3)]
+        requests = [obj.write(StringIO('x' * i)) for (i, obj) in
+                    enumerate(objects)]
+        self.client.run()
+        for (i, request) in enumerate(requests):
+            self.assert_(request.result() is None)
+            self.assert_(objects[i].size == i)
+            self.assert_(StorageHandler.objects['container1/file%d' % i] ==
+                         'x' * i)
+
+    @printdoc
+    def test_timeout(self):
+        """
+        Verify that a request which sees no progress before its deadline
+        fails with socket.timeout.
+        """
+        client = AsyncConnection(connection=self.client.conn, timeout=0.2)
+        request = client.get_container('container1').result() \
+                .create_object('slow').read()
+        started = time.time()
+        self.assertRaises(socket.timeout, request.result)
+        self.assert_(time.time() - started < 1)
+
+    @printdoc
+    def test_reauthenticate(self):
+        """
+        Verify that a request refused for an expired token is sent again
+        once the token is renewed, off the loop's thread, while other
+        requests carry on.
+        """
+        container = self.client.get_container('container1').result()
+        container.create_object('object1').write('abc').result()
+        container.create_object('slow').write('xyz').result()
+        StorageHandler.rejected.add('expired')
+        StorageHandler.auth_delay = 1.5
+        try:
+            self.client.conn.token = 'expired'
+            refused = container.create_object('object1').read()
+            self.client.conn.token = 'token'
+            started = time.time()
+            slow = container.create_object('slow').read()
+            slow.add_callback(lambda request:
+                              setattr(request, 'finished', time.time()))
+            self.assert_(refused.result() == 'abc')
+            self.assert_(slow.result() == 'xyz')
+            self.assert_(slow.finished - started < 1.4)
+            self.assert_(self.client.conn.token == 'token')
+        finally:
+            StorageHandler.rejected.clear()
+            StorageHandler.auth_delay = 0
+
+    @printdoc
+    def test_close_busy(self):
+        """
+        Verify that closing a pool while its channels are busy closes them
+        once their requests complete, (leaving the pool empty), and that
+        deleting an object invalidates its cached metadata once deleted.
+        """
+        container = self.client.get_container('container1').result()
+        container.create_object('object1').write('abc').result()
+        request = container.create_object('object1').read()
+        self.client.close()
+        self.assert_(request.result() == 'abc')
+        pool = self.client._pool()
+        self.assert_((pool.size, pool.idle) == (0, []))
+
+        cache = self.client.conn.metadata_cache = LRUCache(16)
+        key = self.client.conn._cache_key(['container1', 'object1'])
+        request = container.delete_object('object1')
+        cache.put(key, (200, 'OK', []))
+        request.result()
+        self.assert_(cache.get(key) is None)
+
+    @printdoc
+    def test_match_hostname(self):
+        """
+        Verify that certificates are matched against the hostname by their
+        DNS names, (or common name), including wildcards.
+        """
+        cert = {'subject': ((('commonName', 'storage.example.com'),),)}
+        _match_hostname(cert, 'Storage.Example.com')
+        self.assertRaises(ssl.SSLError, _match_hostname, cert, 'example.com')
+        cert['subjectAltName'] = (('DNS', '*.example.com'),)
+        _match_hostname(cert, 'cdn.example.com')
+        self.assertRaises(ssl.SSLError, _match_hostname, cert,
+                          'storage.example.com.evil')
+        self.assertRaises(ssl.SSLError, _match_hostname, cert,
+                          'a.b.example.com')
+
+    def setUp(self):
+        StorageHandler.objects.clear()
+        StorageHandler.connections = 0
+        self.server = StorageServer(('127.0.0.1', 0), StorageHandler)
+        thread = Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.client = AsyncConnection('jsmith', 'qwerty', max_per_host=4,
+            authurl='http://127.0.0.1:%d/auth' % self.server.server_port)
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim:set ai sw=4 ts=4 tw=0 expandtab:
@@ -1,6 +1,10 @@
 
-import unittest
-from cloudfiles.authentication import BaseAuthentication as Auth
+import unittest, os
+from tempfile import mktemp
+from threading import Thread
+from cloudfiles import Connection
+from cloudfiles.authentication import BaseAuthentication as Auth, \
+                                      MockAuthentication, TokenCache
 from misc import printdoc
 
 class AuthenticationTest(unittest.TestCase):
@@ -37,4 +41,95 @@ class AuthenticationTest(unittest.TestCase):
     def tearDown(self):
         del self.auth
 
+class CountingAuth(MockAuthentication):
+    """
+    Mock authentication which hands out a new token for every round-trip.
+    """
+    calls = 0
+    def authenticate(self):
+        self.calls += 1
+        return ('http://localhost/v1/account', None, 'token%d' % self.calls)
+
+class TokenCacheTest(unittest.TestCase):
+    """
+    TokenCache class tests.
+    """
+    @printdoc
+    def test_shared_between_connections(self):
+        """
+        Verify that connections using the same cache authenticate once.
+        """
+        conn1 = Connection(auth=self.auth, token_cache=self.cache)
+        conn2 = Connection(auth=self.auth, token_cache=self.cache)
+        self.assert_(self.auth.calls == 1)
+        self.assert_(conn1.token == conn2.token == 'token1')
+
+    @printdoc
+    def test_invalidate(self):
+        """
+        Verify that only the rejected token is discarded.
+        """
+        self.cache.get(self.auth)
+        self.cache.invalidate(self.auth, 'stale')
+        self.assert_(self.cache.get(self.auth)[2] == 'token1')
+        self.cache.invalidate(self.auth, 'token1')
+        self.assert_(self.cache.get(self.auth)[2] == 'token2')
+
+    @printdoc
+    def test_refresh(self):
+        """
+        Verify that tokens close to expiry are refreshed ahead of time.
+        """
+        self.cache.refresh_margin = self.cache.ttl + 1
+        self.cache.get(self.auth)
+        self.cache.refresh()
+        self.assert_(self.auth.calls == 2)
+        self.assert_(self.cache.get(self.auth)[2] == 'token2')
+
+    @printdoc
+    def test_persistence(self):
+        """
+        Verify that tokens saved by one cache are loaded by another.
+        """
+        self.cache.filename = self.filename
+        self.cache.get(self.auth)
+        other = TokenCache(self.filename)
+        self.assert_(other.get(self.auth)[2] == 'token1')
+        self.assert_(self.auth.calls == 1)
+        self.assert_(os.stat(self.filename).st_mode & 0077 == 0)
+
+    @printdoc
+    def test_concurrent_saves(self):
+        """
+        Verify that tokens saved from many threads at once, while others
+        change the cache, leave a complete file and no temporary files.
+        """
+        self.cache.filename = self.filename
+        auths = [CountingAuth('user%d' % i, 'qwerty') for i in range(8)]
+        def churn(auth):
+            for i in range(20):
+                self.cache.invalidate(auth, self.cache.get(auth)[2])
+            self.cache.get(auth)
+        threads = [Thread(target=churn, args=(auth,)) for auth in auths]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        other = TokenCache(self.filename)
+        self.assert_(len(other._entries) == len(auths))
+        directory = os.path.dirname(self.filename)
+        prefix = os.path.basename(self.filename)
+        self.assert_([name for name in os.listdir(directory)
+                      if name.startswith(prefix)] == [prefix])
+
+    def setUp(self):
+        self.auth = CountingAuth('jsmith', 'qwerty')
+        self.cache = TokenCache()
+        self.filename = mktemp()
+    def tearDown(self):
+        if os.path.exists(self.filename):
+            os.unlink(self.filename)
+        del self.cache
+        del self.auth
+
 # vim:set ai ts=4 tw=0 sw=4 expandtab:
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+"""
+Measures upload and download throughput across chunk sizes against a
+local, in-process storage server.
+
+    $ PYTHONPATH=.. python chunk_benchmark.py [megabytes]
+
+The server discards uploads and serves downloads from memory, so the
+numbers reflect the client's per-chunk overhead rather than a network.
+"""
+
+import sys, StringIO
+from time           import time
+from threading      import Thread
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer   import ThreadingMixIn
+from cloudfiles     import Connection, Container, Object
+
+class BenchmarkHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    payload = ''
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.endswith('/auth'):
+            self.send_response(204)
+            self.send_header('X-Storage-Url', 'http://127.0.0.1:%d/v1/bench'
+                             % self.server.server_port)
+            self.send_header('X-Auth-Token', 'benchmark')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(self.payload)))
+        self.end_headers()
+        self.wfile.write(self.payload)
+
+    def do_PUT(self):
+        remaining = int(self.headers['content-length'])
+        while remaining > 0:
+            remaining -= len(self.rfile.read(min(remaining, 1048576)))
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+class BenchmarkServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def throughput(func, size):
+    start = time()
+    func()
+    return size / (time() - start) / 1048576
+
+def main(megabytes=64):
+    size = megabytes * 1048576
+    BenchmarkHandler.payload = payload = 'x' * size
+    server = BenchmarkServer(('127.0.0.1', 0), BenchmarkHandler)
+    thread = Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    authurl = 'http://127.0.0.1:%d/auth' % server.server_port
+
+    class Discard(object):
+        def write(self, data):
+            pass
+
+    print '%-10s %12s %12s %8s' % ('chunk', 'upload MB/s', 'download MB/s',
+                                   'final')
+    for chunk_size in (4096, 16384, 65536, 262144, 1048576, 'adaptive'):
+        conn = Connection('bench', 'bench', authurl=authurl,
+                          chunk_size=chunk_size)
+        obj = Object(Container(conn, 'bench'), 'payload', check=False)
+        up = throughput(lambda: obj.write(StringIO.StringIO(payload),
+                                          verify=False), size)
+        down = throughput(lambda: obj.read(buffer=Discard()), size)
+        print '%-10s %12.1f %12.1f %8d' % (chunk_size, up, down,
+                                           conn.chunking.size)
+        conn.close()
+    server.shutdown()
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
+
+# vim:set ai sw=4 ts=4 tw=0 expandtab:
@@ -1,12 +1,16 @@
 #!/usr/bin/python
 
-import unittest
+import unittest, socket
+from time       import sleep
 from misc       import printdoc
-from fakehttp   import CustomHTTPConnection
-from cloudfiles import Connection, Container
+from fakehttp   import CustomHTTPConnection, CustomCDNHTTPConnection, \
+                       CDNTrackerSocket, TrackerSocket, KeepAliveHTTPConnection
+from cloudfiles import Connection, ConnectionPool, Container, \
+                       RequestHook, HistogramCollector
 from cloudfiles.authentication import MockAuthentication as Auth
-from cloudfiles.errors import InvalidContainerName
+from cloudfiles.errors import InvalidContainerName, PoolExhausted
 from cloudfiles.consts import container_name_limit
+from cloudfiles.utils  import LRUCache
 
 class ConnectionTest(unittest.TestCase):
     """
@@ -38,6 +42,10 @@ class ConnectionTest(unittest.TestCase):
             self.assert_(isinstance(instance, Container))
         self.assert_(containers.count('container1') == 1)
         self.assert_(containers.index('container3') == 2)
+        self.assert_([c.size_used for c in containers[1:3]] == [39, 117])
+        self.assert_('container2' in containers)
+        self.assert_(containers.names_with_prefix('container') == \
+                     ['container1', 'container2', 'container3'])
 
     @printdoc
     def test_get_container(self):
@@ -47,6 +55,127 @@ class ConnectionTest(unittest.TestCase):
         container = self.conn.get_container('container1')
         self.assert_(isinstance(container, Container))
 
+    @printdoc
+    def test_metadata_cache(self):
+        """
+        Verify that container HEADs are answered from the metadata cache
+        until a change to the container invalidates them.
+        """
+        self.conn.metadata_cache = cache = LRUCache(16)
+        del TrackerSocket.log[:]
+        heads = lambda: [i for i in TrackerSocket.log if i[0] == 'HEAD']
+        self.conn.get_container('container1')
+        container = self.conn.get_container('container1')
+        self.assert_(len(heads()) == 1)
+        self.assert_((cache.hits, cache.misses) == (1, 1))
+        other = Connection(auth=Auth('jsmith', 'qwerty'),
+                           metadata_cache=cache)
+        other.connection_args = ('other.example.com',) + \
+                                tuple(other.connection_args[1:])
+        other.conn_class = CustomHTTPConnection
+        other.http_connect()
+        other.get_container('container1')
+        self.assert_(len(heads()) == 2)
+        container.delete_object('object1')
+        self.conn.get_container('container1')
+        self.assert_(len(heads()) == 3)
+
+    @printdoc
+    def test_keep_alive(self):
+        """
+        Verify that requests reuse a kept-alive socket once the previous
+        response has been read.
+        """
+        KeepAliveHTTPConnection.connects = 0
+        self.conn.conn_class = KeepAliveHTTPConnection
+        self.conn.http_connect()
+        self.conn.get_info()
+        self.conn.make_request('GET', ['container1', 'object1']).read()
+        self.conn.make_request('DELETE', ['container1', 'object1'])
+        self.assert_(self.conn.get_info()[0] == 3)
+        self.assert_(KeepAliveHTTPConnection.connects == 1)
+        self.assert_((self.conn.connect_count, self.conn.reuse_count) == \
+                     (1, 3))
+
+    @printdoc
+    def test_unread_response(self):
+        """
+        Verify that a request made while a response is still being read
+        is sent on a new socket, leaving the response readable.
+        """
+        for conn_class in (CustomHTTPConnection, KeepAliveHTTPConnection):
+            KeepAliveHTTPConnection.connects = 0
+            self.conn.conn_class = conn_class
+            self.conn.http_connect()
+            obj = self.conn.get_container('container1').get_object('object1')
+            stream = obj.stream(10)
+            self.assert_(stream.next() == TrackerSocket.object_content[:10])
+            self.assert_(self.conn.get_info()[0] == 3)
+            self.assert_(''.join(stream) == \
+                         TrackerSocket.object_content[10:])
+        self.assert_(KeepAliveHTTPConnection.connects == 2)
+
+    @printdoc
+    def test_batch_request(self):
+        """
+        Verify that Connection.batch_request() pipelines requests over one
+        socket and returns their responses in order, invalidating the
+        cached metadata of whatever it deletes.
+        """
+        self.conn.metadata_cache = cache = LRUCache(16)
+        key = lambda name: self.conn._cache_key(['container1', name])
+        cache.put(key('object1'), (200, 'OK', []))
+        cache.put(key('bogus'), (200, 'OK', []))
+        KeepAliveHTTPConnection.connects = 0
+        self.conn.conn_class = KeepAliveHTTPConnection
+        self.conn.http_connect()
+        del TrackerSocket.log[:]
+        requests = [('HEAD', ['container1', 'object1']),
+                    ('GET', ['container1', 'object1']),
+                    ('GET', ['container1', 'bogus']),
+                    ('DELETE', ['container1', 'object1'])]
+        results = self.conn.batch_request(requests, depth=2)
+        self.assert_([r[0] for r in results] == [200, 200, 404, 200])
+        self.assert_(results[1][3] == TrackerSocket.object_content)
+        self.assert_([i[0] for i in TrackerSocket.log] == \
+                     ['HEAD', 'GET', 'GET', 'DELETE'])
+        self.assert_(KeepAliveHTTPConnection.connects == 1)
+        self.assert_(self.conn.reuse_count == 3)
+        self.assert_(cache.get(key('object1')) is None)
+        self.assert_(cache.get(key('bogus')) is not None)
+        self.assertRaises(ValueError, self.conn.batch_request,
+                          [('PUT', ['container1', 'object1'])])
+
+    @printdoc
+    def test_batch_request_reauthenticate(self):
+        """
+        Verify that Connection.batch_request() resends the requests refused
+        once its session token expires part way, on a new socket, (so that
+        the refusals of the requests pipelined behind it are not taken for
+        the answers to the resent ones).
+        """
+        TrackerSocket.expiring_tokens['expired'] = 1
+        KeepAliveHTTPConnection.connects = 0
+        self.conn.conn_class = KeepAliveHTTPConnection
+        self.conn.http_connect()
+        self.conn.token = 'expired'
+        def authenticate():
+            # Renew the token without replacing the http connection.
+            self.conn.token = 'renewed'
+        self.conn._authenticate = authenticate
+        requests = [('HEAD', ['container1', 'object1']),
+                    ('GET', ['container1', 'object1']),
+                    ('GET', ['container1', 'bogus']),
+                    ('HEAD', ['container1', 'object1'])]
+        try:
+            results = self.conn.batch_request(requests, depth=2)
+        finally:
+            del TrackerSocket.expiring_tokens['expired']
+        self.assert_([r[0] for r in results] == [200, 200, 404, 200])
+        self.assert_(results[1][3] == TrackerSocket.object_content)
+        self.assert_(self.conn.token == 'renewed')
+        self.assert_(KeepAliveHTTPConnection.connects == 2)
+
     @printdoc
     def test_list_containers(self):
         """
@@ -61,6 +190,51 @@ class ConnectionTest(unittest.TestCase):
         """
         self.assert_(isinstance(self.conn.list_containers_info(), list))
 
+    @printdoc
+    def test_iter_containers_info(self):
+        """
+        Verify that Connection.iter_containers_info() follows the listing
+        across pages.
+        """
+        records = self.conn.iter_containers_info(page_size=2)
+        self.assert_([r['name'] for r in records] == \
+                     ['container1', 'container2', 'container3'])
+
+    @printdoc
+    def test_lazy_cdn_data(self):
+        """
+        Verify that Containers only request their CDN data when it is
+        first accessed.
+        """
+        self._enable_cdn()
+        containers = self.conn.get_all_containers()
+        for container in containers:
+            pass
+        self.assert_(CDNTrackerSocket.heads == 0)
+        self.assert_(containers[0].cdn_uri == 'http://cdn.fake/container1')
+        self.assert_(not containers[2].is_public())
+        self.assert_(CDNTrackerSocket.heads == 2)
+
+    @printdoc
+    def test_preload_cdn_data(self):
+        """
+        Verify that get_all_containers(preload_cdn=True) fills in the CDN
+        data of every Container from a single CDN listing.
+        """
+        self._enable_cdn()
+        containers = self.conn.get_all_containers(preload_cdn=True)
+        self.assert_([c.is_public() for c in containers] == \
+                     [True, False, False])
+        self.assert_(containers[0].cdn_ttl == 86400)
+        self.assert_(CDNTrackerSocket.heads == 0)
+        self.assert_(len(self.conn.list_cdn_containers_info(page_size=1)) == 2)
+
+    def _enable_cdn(self):
+        CDNTrackerSocket.heads = 0
+        self.conn.cdn_url = 'http://cdn.fake/v1/account'
+        self.conn.cdn_connection = CustomCDNHTTPConnection('cdn.fake')
+        self.conn.cdn_enabled = True
+
     @printdoc
     def test_bad_names(self):
         """
@@ -80,6 +254,77 @@ class ConnectionTest(unittest.TestCase):
         """
         self.assert_(self.conn.get_info()[0] == 3)
 
+    @printdoc
+    def test_hooks(self):
+        """
+        Verify that request hooks are called before and after each request
+        with a description of it, (including writes, batched and failed
+        requests), that a HistogramCollector tallies them, and that hooks
+        which raise do not affect the requests.
+        """
+        class Recorder(RequestHook):
+            def __init__(self):
+                self.events = []
+            def before_request(self, event):
+                self.events.append(('before', event.status))
+            def after_request(self, event):
+                self.events.append(('after', event))
+        recorder = Recorder()
+        collector = HistogramCollector()
+        self.conn.hooks[:] = [recorder, collector]
+        self.conn.make_request('GET', ['container1', 'object1']).read()
+        self.conn.get_container('container1')
+        self.assert_(recorder.events[0] == ('before', None))
+        event = recorder.events[1][1]
+        self.assert_((event.service, event.method, event.template) == \
+                     ('storage', 'GET', '/{container}/{object}'))
+        self.assert_(event.status == 200 and event.error is None)
+        self.assert_(event.bytes_received == len(TrackerSocket.object_content))
+        self.assert_(event.retries == 0 and not event.reauthenticated)
+        self.assert_(0 <= event.ttfb <= event.latency)
+        self.assert_(collector.keys() == \
+                     [('storage', 'GET', '/{container}/{object}'),
+                      ('storage', 'HEAD', '/{container}')])
+        stats = collector.stats('GET', '/{container}/{object}')
+        self.assert_(stats.count == 1 and stats.errors == 0)
+        self.assert_(stats.latency.percentile(99) <= stats.latency.max)
+
+        class BrokenHook(RequestHook):
+            def before_request(self, event):
+                raise ValueError('broken hook')
+            after_request = before_request
+        self.conn.hooks.insert(0, BrokenHook())
+        collector.reset()
+        container = self.conn.get_container('container1')
+        container.create_object('object2').write('data')
+        obj = container.create_object('object3')
+        obj.size = None
+        obj.send(iter(['da', 'ta']))
+        stats = collector.stats('PUT', '/{container}/{object}')
+        self.assert_(stats.count == 2 and stats.bytes_sent == 8)
+        self.assert_(stats.ttfb.count == 2)
+        collector.reset()
+        self.conn.conn_class = KeepAliveHTTPConnection
+        self.conn.http_connect()
+        self.conn.batch_request([('HEAD', ['container1', 'object1']),
+                                 ('DELETE', ['container1', 'object2'])])
+        self.assert_(collector.stats('HEAD', '/{container}/{object}').count
+                     == 1)
+        self.assert_(collector.stats('DELETE', '/{container}/{object}').count
+                     == 1)
+
+        class RefusingConnection(CustomHTTPConnection):
+            def connect(self):
+                raise socket.error('Connection refused')
+        self.conn.conn_class = RefusingConnection
+        self.conn.http_connect()
+        self.assertRaises(socket.error, self.conn.make_request, 'HEAD')
+        event = recorder.events[-1][1]
+        self.assert_(event.status is None and
+                     isinstance(event.error, socket.error))
+        self.assert_(collector.stats('HEAD', '/').errors == 1)
+        self.assert_('/{container}/{object}' in collector.report())
+
     def setUp(self):
         self.auth = Auth('jsmith', 'qwerty')
         self.conn = Connection(auth=self.auth)
@@ -89,4 +334,98 @@ class ConnectionTest(unittest.TestCase):
         del self.conn
         del self.auth
 
+class CountingAuth(Auth):
+    """
+    Mock authentication which records the number of round-trips made.
+    """
+    calls = 0
+    def authenticate(self):
+        self.calls += 1
+        return Auth.authenticate(self)
+
+class FakeConnectionPool(ConnectionPool):
+    def _create_connection(self):
+        conn = ConnectionPool._create_connection(self)
+        conn.conn_class = CustomHTTPConnection
+        conn.http_connect()
+        return conn
+
+class ConnectionPoolTest(unittest.TestCase):
+    """
+    ConnectionPool class tests.
+    """
+    @printdoc
+    def test_shared_auth(self):
+        """
+        Verify that pooled connections share a single session token.
+        """
+        conns = [self.pool.get(), self.pool.get()]
+        self.assert_(self.auth.calls == 1)
+        self.assert_(conns[0].token == conns[1].token)
+        self.assert_(conns[0].get_info()[0] == 3)
+
+    @printdoc
+    def test_bounded(self):
+        """
+        Verify that the pool never hands out more than poolsize connections
+        and that returned connections are reused.
+        """
+        conns = [self.pool.get(), self.pool.get()]
+        self.assertRaises(PoolExhausted, self.pool.get, timeout=0.01)
+        self.assertRaises(PoolExhausted, self.pool.get, block=False)
+        self.pool.put(conns[0])
+        self.assert_(self.pool.get(timeout=0.01) is conns[0])
+
+    @printdoc
+    def test_idle_eviction(self):
+        """
+        Verify that connections idle for longer than max_idle are discarded.
+        """
+        self.pool.max_idle = 0.01
+        conn = self.pool.get()
+        self.pool.put(conn)
+        sleep(0.02)
+        self.assert_(self.pool.get() is not conn)
+        self.pool.evict_idle()
+
+    @printdoc
+    def test_health_check(self):
+        """
+        Verify that health checks run without the pool lock held and that
+        connections failing them are replaced.
+        """
+        checked = []
+        def health_check(connobj):
+            self.assert_(self.pool._cond.acquire(False))
+            self.pool._cond.release()
+            checked.append(connobj)
+            return len(checked) > 1
+        self.pool.health_check = health_check
+        conn = self.pool.get()
+        self.pool.put(conn)
+        other = self.pool.get()
+        self.assert_(other is not conn and checked == [conn])
+        self.pool.put(other)
+        self.pool.evict_idle()
+        self.assert_(checked == [conn, other])
+        self.assert_(self.pool.get(block=False) is other)
+
+    @printdoc
+    def test_context_manager(self):
+        """
+        Verify that ConnectionPool.connection() returns its connection to
+        the pool on exit.
+        """
+        with self.pool.connection() as conn:
+            self.assert_(isinstance(conn, Connection))
+        self.assert_(self.pool.get(block=False) is conn)
+
+    def setUp(self):
+        self.auth = CountingAuth('jsmith', 'qwerty')
+        self.pool = FakeConnectionPool(auth=self.auth, poolsize=2)
+    def tearDown(self):
+        self.pool.close()
+        del self.pool
+        del self.auth
+
 # vim:set ai sw=4 ts=4 tw=0 expandtab:
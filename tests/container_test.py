@@ -1,11 +1,16 @@
 #!/usr/bin/python
 
-import unittest
-from cloudfiles  import Connection, Container, Object
+import unittest, os, shutil
+from StringIO  import StringIO
+from tempfile  import mkdtemp
+from threading import current_thread
+from urllib    import quote
+from cloudfiles  import Connection, Container, Object, ChecksumIndex
 from cloudfiles.authentication import MockAuthentication as Auth
 from cloudfiles.errors import InvalidContainerName, InvalidObjectName
 from cloudfiles.consts import container_name_limit
-from fakehttp   import CustomHTTPConnection
+from fakehttp   import CustomHTTPConnection, KeepAliveHTTPConnection, \
+                        TrackerSocket
 from misc       import printdoc
 
 class ContainerTest(unittest.TestCase):
@@ -20,6 +25,43 @@ class ContainerTest(unittest.TestCase):
         storage_object = self.container.create_object('object1')
         self.assert_(isinstance(storage_object, Object))
 
+    @printdoc
+    def test_create_object_lazy(self):
+        """
+        Verify that Container.create_object() defers its HEAD request until
+        an attribute is read, (not assigned, written or downloaded), and
+        that check=False never makes one.
+        """
+        del TrackerSocket.log[:]
+        storage_object = self.container.create_object('object1')
+        self.assert_(TrackerSocket.log == [])
+        self.assert_(storage_object.size == 31)
+        self.assert_([m for (m, u) in TrackerSocket.log] == ['HEAD'])
+
+        del TrackerSocket.log[:]
+        storage_object = self.container.create_object('object1', check=False)
+        self.assert_(storage_object.size is None)
+        storage_object.write('data')
+        self.assert_([m for (m, u) in TrackerSocket.log] == ['PUT'])
+
+        del TrackerSocket.log[:]
+        storage_object = self.container.create_object('object1')
+        storage_object.content_type = 'text/html'
+        storage_object.write('data')
+        self.assert_([m for (m, u) in TrackerSocket.log] == ['PUT'])
+        self.assert_(TrackerSocket.stored['container1/object1'][0] \
+                     ['content-type'] == 'text/html')
+        self.assert_(storage_object.last_modified is None)
+        self.assert_(storage_object.content_type == 'text/html')
+
+        del TrackerSocket.log[:]
+        (buff, progress) = (StringIO(), [])
+        self.container.create_object('object1').read(buffer=buff,
+                callback=lambda *args: progress.append(args))
+        self.assert_(buff.getvalue() == TrackerSocket.object_content)
+        self.assert_(progress[-1] == (31, 31))
+        self.assert_([m for (m, u) in TrackerSocket.log] == ['GET'])
+
     @printdoc
     def test_delete_object(self):
         """
@@ -47,6 +89,38 @@ class ContainerTest(unittest.TestCase):
         self.assert_(objects.count('object1') == 1)
         self.assert_(objects.index('object3') == 2)
 
+    @printdoc
+    def test_get_objects_records(self):
+        """
+        Verify that ObjectResults holds compact records, sharing
+        content-type strings, and builds Objects from them on demand.
+        """
+        objects = self.container.get_objects()
+        records = objects._objects
+        self.assert_(not hasattr(records[0], '__dict__'))
+        self.assert_(records[0].content_type is records[1].content_type)
+        self.assert_(records[1]['bytes'] == 64)
+        self.assert_([obj.size for obj in objects[1:3]] == [64, 14])
+
+    @printdoc
+    def test_get_objects_lookup(self):
+        """
+        Verify name membership, index, prefix and range queries on an
+        ObjectResults.
+        """
+        objects = self.container.get_objects()
+        self.assert_('object3' in objects)
+        self.assert_(objects[4] in objects)
+        self.assert_('object9' not in objects)
+        self.assert_(objects.index('object5') == 4)
+        self.assertRaises(ValueError, objects.index, 'object9')
+        self.assert_(len(objects.names_with_prefix('object')) == 8)
+        self.assert_(objects.names_with_prefix('objectx') == [])
+        self.assert_(objects.names_between('object2', 'object4') == \
+                     ['object2', 'object3'])
+        self.assert_(objects.names_between('object7') == \
+                     ['object7', 'object8'])
+
     @printdoc
     def test_get_objects_parametrized(self):
         """
@@ -67,6 +141,39 @@ class ContainerTest(unittest.TestCase):
         """
         self.assert_(isinstance(self.container.list_objects(), list))
         
+    @printdoc
+    def test_iter_objects_info(self):
+        """
+        Verify that Container.iter_objects_info() follows the listing
+        across pages, with and without prefetching.
+        """
+        names = ['object%d' % i for i in range(1, 9)]
+        for prefetch in (True, False):
+            records = self.container.iter_objects_info(page_size=3,
+                                                       prefetch=prefetch)
+            self.assert_([r['name'] for r in records] == names)
+        objects = list(self.container.iter_objects(marker='object6'))
+        self.assert_([obj.name for obj in objects] == names[6:])
+
+    @printdoc
+    def test_iter_objects_info_unicode(self):
+        """
+        Verify that Container.iter_objects_info() follows the listing past
+        a page ending with a non-ASCII name.
+        """
+        names = ['object1', 'object2', 'object\xc3\xa9', 'object\xc3\xa9s',
+                 'object\xe2\x82\xac']
+        (saved, TrackerSocket.object_names) = (TrackerSocket.object_names,
+                                               names)
+        try:
+            for prefetch in (True, False):
+                records = self.container.iter_objects_info(page_size=3,
+                                                           prefetch=prefetch)
+                self.assert_([r['name'].encode('utf-8') for r in records] \
+                             == names)
+        finally:
+            TrackerSocket.object_names = saved
+
     @printdoc
     def test_list_objects(self):
         """
@@ -123,6 +230,159 @@ class ContainerTest(unittest.TestCase):
         """
         self.assertRaises(InvalidObjectName, self.container.delete_object, '')
             
+    @printdoc
+    def test_delete_objects(self):
+        """
+        Verify that Container.delete_objects() deletes every listed object,
+        retries failed deletes, and reports the objects it could not delete.
+        """
+        self.conn.conn_class = KeepAliveHTTPConnection
+        del TrackerSocket.log[:]
+        failures = self.container.delete_objects(threads=3)
+        self.assert_(failures == [])
+        deleted = sorted([u.split('/')[-1] for (m, u) in TrackerSocket.log
+                          if m == 'DELETE'])
+        self.assert_(deleted == ['object%d' % i for i in range(1, 9)])
+
+        del TrackerSocket.log[:]
+        failures = self.container.delete_objects(['object1', 'busy'],
+                                                 retries=2,
+                                                 delete_container=True)
+        self.assert_([name for (name, err) in failures] == ['busy'])
+        self.assert_(failures[0][1].status == 503)
+        self.assert_([u for (m, u) in TrackerSocket.log].count(
+                     '/v1/account/container1/busy') == 3)
+        self.assert_(('DELETE', '/v1/account/container1') not in
+                     TrackerSocket.log)
+
+    @printdoc
+    def test_upload_directory(self):
+        """
+        Verify that Container.upload_directory() uploads a directory tree
+        under a prefix, with typed objects and directory markers, and
+        reports the files it could not upload.
+        """
+        directory = mkdtemp()
+        try:
+            os.makedirs(os.path.join(directory, 'img', 'icons'))
+            for (path, data) in (('index.html', '<html/>'),
+                                 ('img/logo.png', 'png'),
+                                 ('img/icons/x.css', 'css!')):
+                fobj = open(os.path.join(directory, *path.split('/')), 'w')
+                fobj.write(data)
+                fobj.close()
+            os.symlink('missing', os.path.join(directory, 'broken'))
+            TrackerSocket.stored.clear()
+            results = self.container.upload_directory(directory,
+                    prefix='site/', markers=True, threads=2, retries=1)
+        finally:
+            shutil.rmtree(directory)
+        stored = TrackerSocket.stored
+        self.assert_(sorted(stored.keys()) == ['container1/site/img',
+            'container1/site/img/icons', 'container1/site/img/icons/x.css',
+            'container1/site/img/logo.png', 'container1/site/index.html'])
+        self.assert_(stored['container1/site/index.html'][1] == '<html/>')
+        self.assert_(stored['container1/site/img/logo.png'][0]
+                     ['content-type'] == 'image/png')
+        self.assert_(stored['container1/site/img'][0]['content-type'] == \
+                     'application/directory')
+        self.assert_((results.count, results.bytes) == (5, 14))
+        self.assert_(results.throughput > 0)
+        self.assert_([os.path.basename(path) for (path, err) in
+                      results.failures] == ['broken'])
+
+    @printdoc
+    def test_sync_directory(self):
+        """
+        Verify that Container.sync_directory() skips unchanged files, uploads
+        changed and new ones, deletes stale objects, and keeps the checksums
+        in its index, (hashing files on its upload threads).
+        """
+        self.conn.conn_class = KeepAliveHTTPConnection
+        directory = mkdtemp()
+        try:
+            for (name, size) in (('object1', 14), ('object2', 64),
+                                 ('object9', 3)):
+                fobj = open(os.path.join(directory, name), 'w')
+                fobj.write('x' * size)
+                fobj.close()
+            path = os.path.join(directory, 'object1')
+            index = ChecksumIndex(directory + '.index')
+            index.put(os.stat(path), '4281c348eaf83e70ddce0e07221c3d28')
+            threads = []
+            checksum = index.checksum
+            def hashed(fobj):
+                threads.append(current_thread())
+                return checksum(fobj)
+            index.checksum = hashed
+            del TrackerSocket.log[:]
+            TrackerSocket.stored.clear()
+            results = self.container.sync_directory(directory, delete=True,
+                                                    index=index)
+            saved = ChecksumIndex(index.filename)
+        finally:
+            shutil.rmtree(directory)
+            if os.path.exists(directory + '.index'):
+                os.unlink(directory + '.index')
+        self.assert_(sorted(TrackerSocket.stored.keys()) == \
+                     ['container1/object2', 'container1/object9'])
+        deleted = sorted([u.split('/')[-1] for (m, u) in TrackerSocket.log
+                          if m == 'DELETE'])
+        self.assert_(deleted == ['object%d' % i for i in range(3, 9)])
+        self.assert_((results.count, results.skipped, results.deleted) == \
+                     (2, 1, 6))
+        self.assert_(results.failures == [])
+        self.assert_(len(saved) == 3)
+        self.assert_(threads and current_thread() not in threads)
+
+    @printdoc
+    def test_sync_directory_unicode(self):
+        """
+        Verify that Container.sync_directory() merges non-ASCII file names
+        with a listing of more than one page, and that delete_objects()
+        deletes listed objects with non-ASCII names.
+        """
+        self.conn.conn_class = KeepAliveHTTPConnection
+        (saved, TrackerSocket.object_names) = (TrackerSocket.object_names,
+                ['caf\xc3\xa9', 'na\xc3\xafve', 'old\xc3\xa9'])
+        iter_objects_info = self.container.iter_objects_info
+        self.container.iter_objects_info = \
+                lambda **parms: iter_objects_info(page_size=2, **parms)
+        directory = mkdtemp()
+        try:
+            for (name, size) in (('caf\xc3\xa9', 14), ('na\xc3\xafve', 3),
+                                 ('z\xc3\xa9', 3)):
+                fobj = open(os.path.join(directory, name), 'w')
+                fobj.write('x' * size)
+                fobj.close()
+            index = ChecksumIndex()
+            index.put(os.stat(os.path.join(directory, 'caf\xc3\xa9')),
+                      '4281c348eaf83e70ddce0e07221c3d28')
+            del TrackerSocket.log[:]
+            TrackerSocket.stored.clear()
+            results = self.container.sync_directory(directory, delete=True,
+                                                    index=index)
+            self.assert_(results.failures == [])
+            self.assert_((results.count, results.skipped, results.deleted) \
+                         == (2, 1, 1))
+            self.assert_(sorted(TrackerSocket.stored.keys()) == \
+                         ['container1/' + quote(name)
+                          for name in ('na\xc3\xafve', 'z\xc3\xa9')])
+            del TrackerSocket.log[:]
+            self.assert_(self.container.delete_objects() == [])
+            deleted = [u.split('/')[-1] for (m, u) in TrackerSocket.log
+                       if m == 'DELETE']
+            self.assert_(sorted(deleted) == sorted([quote(name) for name in
+                         TrackerSocket.object_names]))
+            del TrackerSocket.log[:]
+            self.assert_(self.container.delete_objects([u'caf\xe9',
+                         u'na\xefve'], prefix='caf\xc3\xa9') == [])
+            self.assert_([u for (m, u) in TrackerSocket.log] == \
+                         ['/v1/account/container1/caf%C3%A9'])
+        finally:
+            TrackerSocket.object_names = saved
+            shutil.rmtree(directory)
+
     def setUp(self):
         self.auth = Auth('jsmith', 'qwerty')
         self.conn = Connection(auth=self.auth)
@@ -14,7 +14,8 @@ intances of CustomHTTPConnection.
 """
 
 from httplib import HTTPConnection as connbase
-import StringIO
+from urllib  import unquote
+import StringIO, md5
 
 class FakeSocket(object):
     def __init__(self):
@@ -38,35 +39,48 @@ class FakeSocket(object):
         return self._wbuffer
 
 class TrackerSocket(FakeSocket):
+    object_content = 'I am a teapot, short and stout\n'
+    # extra headers sent with object GET and HEAD responses
+    object_headers = {}
+    # whether object GETs ignore Range headers
+    ignore_range = False
+    # (headers, body) of every object PUT, keyed by path
+    stored = {}
+    # (method, uri) of every request made
+    log = []
+    # the names of the objects in every container, (UTF-8 encoded)
+    object_names = ['object%d' % i for i in range(1, 9)]
+    # session tokens which are rejected once they have been used for the
+    # given number of requests
+    expiring_tokens = {}
+
     def write(self, data):
         self._wbuffer.write(data)
     def read(self, length=-1):
         return self._rbuffer.read(length)
 
     def _create_GET_account_content(self, path, args):
+        sizes = [('container1', 2, 78), ('container2', 1, 39),
+                 ('container3', 3, 117)]
+        sizes = [i for i in sizes if i[0] > args.get('marker', '')]
+        if args.has_key('limit'):
+            sizes = sizes[:int(args['limit'])]
+
         if args.has_key('format') and args['format'] == 'json':
-            containers = []
-            containers.append('[\n');
-            containers.append('{"name":"container1","count":2,"bytes":78},\n')
-            containers.append('{"name":"container2","count":1,"bytes":39},\n')
-            containers.append('{"name":"container3","count":3,"bytes":117}\n')
-            containers.append(']\n')
+            containers = ['{"name":"%s","count":%d,"bytes":%d}' % i
+                          for i in sizes]
+            containers = ['[\n', ',\n'.join(containers), '\n]\n']
         elif args.has_key('format') and args['format'] == 'xml':
             containers = []
             containers.append('<?xml version="1.0" encoding="UTF-8"?>\n')
             containers.append('<account name="FakeAccount">\n')
-            containers.append('<container><name>container1</name>'
-                              '<count>2</count>'
-                              '<bytes>78</bytes></container>\n')
-            containers.append('<container><name>container2</name>'
-                              '<count>1</count>'
-                              '<bytes>39</bytes></container>\n')
-            containers.append('<container><name>container3</name>'
-                              '<count>3</count>'
-                              '<bytes>117</bytes></container>\n')
+            for i in sizes:
+                containers.append('<container><name>%s</name>'
+                                  '<count>%d</count>'
+                                  '<bytes>%d</bytes></container>\n' % i)
             containers.append('</account>\n')
         else:
-            containers = ['container%s\n' % i for i in range(1,4)]
+            containers = ['%s\n' % i[0] for i in sizes]
         return ''.join(containers)
 
     def _create_GET_container_content(self, path, args):
@@ -77,108 +91,35 @@ class TrackerSocket(FakeSocket):
         if args.has_key('limit'):
             right = left + int(args['limit'])
 
+        hashes = ['4281c348eaf83e70ddce0e07221c3d28',
+                  'b039efe731ad111bc1b0ef221c3849d0']
+        sizes = [14, 64]
+        records = [(name, hashes[i % 2], sizes[i % 2])
+                   for (i, name) in enumerate(self.object_names)]
+        marker = unquote(args.get('marker', ''))
+        records = [i for i in records if i[0] > marker]
+        records = records[left:right]
+
         if args.has_key('format') and args['format'] == 'json':
-            objects = []
-            objects.append('{"name":"object1",'
-                           '"hash":"4281c348eaf83e70ddce0e07221c3d28",'
-                           '"bytes":14,'
-                           '"content_type":"application\/octet-stream",'
-                           '"last_modified":"2007-03-04 20:32:17"},\n')
-            objects.append('{"name":"object2",'
-                           '"hash":"b039efe731ad111bc1b0ef221c3849d0",'
-                           '"bytes":64,'
-                           '"content_type":"application\/octet-stream",'
-                           '"last_modified":"2007-03-04 20:32:17"},\n')
-            objects.append('{"name":"object3",'
-                           '"hash":"4281c348eaf83e70ddce0e07221c3d28",'
-                           '"bytes":14,'
-                           '"content_type":"application\/octet-stream",'
-                           '"last_modified":"2007-03-04 20:32:17"},\n')
-            objects.append('{"name":"object4",'
-                           '"hash":"b039efe731ad111bc1b0ef221c3849d0",'
-                           '"bytes":64,'
-                           '"content_type":"application\/octet-stream",'
-                           '"last_modified":"2007-03-04 20:32:17"},\n')
-            objects.append('{"name":"object5",'
-                           '"hash":"4281c348eaf83e70ddce0e07221c3d28",'
-                           '"bytes":14,'
-                           '"content_type":"application\/octet-stream",'
-                           '"last_modified":"2007-03-04 20:32:17"},\n')
-            objects.append('{"name":"object6",'
-                           '"hash":"b039efe731ad111bc1b0ef221c3849d0",'
-                           '"bytes":64,'
-                           '"content_type":"application\/octet-stream",'
-                           '"last_modified":"2007-03-04 20:32:17"},\n')
-            objects.append('{"name":"object7",'
-                           '"hash":"4281c348eaf83e70ddce0e07221c3d28",'
-                           '"bytes":14,'
-                           '"content_type":"application\/octet-stream",'
-                           '"last_modified":"2007-03-04 20:32:17"},\n')
-            objects.append('{"name":"object8",'
-                           '"hash":"b039efe731ad111bc1b0ef221c3849d0",'
-                           '"bytes":64,'
-                           '"content_type":"application\/octet-stream",'
-                           '"last_modified":"2007-03-04 20:32:17"},\n')
-            objects = objects[left:right]
-            objects.insert(0, '[\n')
-            objects.append(']\n')
+            objects = ['{"name":"%s",'
+                       '"hash":"%s",'
+                       '"bytes":%d,'
+                       '"content_type":"application\/octet-stream",'
+                       '"last_modified":"2007-03-04 20:32:17"}' % i
+                       for i in records]
+            objects = ['[\n', ',\n'.join(objects), '\n]\n']
         elif args.has_key('format') and args['format'] == 'xml':
-            objects = []
-            objects.append('<object><name>object1</name>'
-                           '<hash>4281c348eaf83e70ddce0e07221c3d28</hash>'
-                           '<bytes>14</bytes>'
-                           '<content_type>application/octet-stream</content_type>'
-                           '<last_modified>2007-03-04 20:32:17</last_modified>'
-                           '</object>\n')
-            objects.append('<object><name>object2</name>'
-                           '<hash>b039efe731ad111bc1b0ef221c3849d0</hash>'
-                           '<bytes>64</bytes>'
-                           '<content_type>application/octet-stream</content_type>'
-                           '<last_modified>2007-03-04 20:32:17</last_modified>'
-                           '</object>\n')
-            objects.append('<object><name>object3</name>'
-                           '<hash>4281c348eaf83e70ddce0e07221c3d28</hash>'
-                           '<bytes>14</bytes>'
-                           '<content_type>application/octet-stream</content_type>'
-                           '<last_modified>2007-03-04 20:32:17</last_modified>'
-                           '</object>\n')
-            objects.append('<object><name>object4</name>'
-                           '<hash>b039efe731ad111bc1b0ef221c3849d0</hash>'
-                           '<bytes>64</bytes>'
-                           '<content_type>application/octet-stream</content_type>'
-                           '<last_modified>2007-03-04 20:32:17</last_modified>'
-                           '</object>\n')
-            objects.append('<object><name>object5</name>'
-                           '<hash>4281c348eaf83e70ddce0e07221c3d28</hash>'
-                           '<bytes>14</bytes>'
-                           '<content_type>application/octet-stream</content_type>'
-                           '<last_modified>2007-03-04 20:32:17</last_modified>'
-                           '</object>\n')
-            objects.append('<object><name>object6</name>'
-                           '<hash>b039efe731ad111bc1b0ef221c3849d0</hash>'
-                           '<bytes>64</bytes>'
-                           '<content_type>application/octet-stream</content_type>'
-                           '<last_modified>2007-03-04 20:32:17</last_modified>'
-                           '</object>\n')
-            objects.append('<object><name>object7</name>'
-                           '<hash>4281c348eaf83e70ddce0e07221c3d28</hash>'
-                           '<bytes>14</bytes>'
-                           '<content_type>application/octet-stream</content_type>'
-                           '<last_modified>2007-03-04 20:32:17</last_modified>'
-                           '</object>\n')
-            objects.append('<object><name>object8</name>'
-                           '<hash>b039efe731ad111bc1b0ef221c3849d0</hash>'
-                           '<bytes>64</bytes>'
-                           '<content_type>application/octet-stream</content_type>'
-                           '<last_modified>2007-03-04 20:32:17</last_modified>'
-                           '</object>\n')
-            objects = objects[left:right]
+            objects = ['<object><name>%s</name>'
+                       '<hash>%s</hash>'
+                       '<bytes>%d</bytes>'
+                       '<content_type>application/octet-stream</content_type>'
+                       '<last_modified>2007-03-04 20:32:17</last_modified>'
+                       '</object>\n' % i for i in records]
             objects.insert(0, '<?xml version="1.0" encoding="UTF-8"?>\n')
             objects.insert(1, '<container name="test_container_1"\n')
             objects.append('</container>\n')
         else:
-            objects = ['object%s\n' % i for i in range(1,9)]
-            objects = objects[left:right]
+            objects = ['%s\n' % i[0] for i in records]
 
         # prefix/path don't make much sense given our test data
         if args.has_key('prefix') or args.has_key('path'):
@@ -194,15 +135,38 @@ class TrackerSocket(FakeSocket):
             self.write('Connection: close\n\n')
             return
 
-        self.write('HTTP/1.1 200 Ok\n')
-        self.write('Content-Type: text/plain\n')
         if len(path) == 2:
             content = self._create_GET_account_content(path, args)
         elif len(path) == 3:
             content = self._create_GET_container_content(path, args)
         # Object
         elif len(path) == 4:
-            content = 'I am a teapot, short and stout\n'
+            content = self.object_content
+            etag = md5.new(content).hexdigest()
+            if self.headers.get('if-none-match') == etag:
+                self.write('HTTP/1.1 304 Not Modified\n')
+                self.write('ETag: %s\n' % etag)
+                self.write('Connection: close\n\n')
+                return
+            if self.headers.get('if-match', etag) != etag:
+                self.write('HTTP/1.1 412 Precondition Failed\n')
+                self.write('Content-Length: 0\n')
+                self.write('Connection: close\n\n')
+                return
+            if self.headers.has_key('range') and not self.ignore_range:
+                (first, last) = self.headers['range'][6:].split('-')
+                (first, last) = (int(first), min(int(last), len(content) - 1))
+                self.write('HTTP/1.1 206 Partial Content\n')
+                self.write('Content-Range: bytes %d-%d/%d\n' % \
+                           (first, last, len(content)))
+                content = content[first:last + 1]
+        if not self.headers.has_key('range') or self.ignore_range:
+            self.write('HTTP/1.1 200 Ok\n')
+        if len(path) == 4:
+            self.write('ETag: %s\n' % etag)
+            for header in self.object_headers.items():
+                self.write('%s: %s\n' % header)
+        self.write('Content-Type: text/plain\n')
         self.write('Content-Length: %d\n' % len(content))
         self.write('Connection: close\n\n')
         self.write(content)
@@ -218,8 +182,10 @@ class TrackerSocket(FakeSocket):
         else:
             self.write('HTTP/1.1 200 Ok\n')
             self.write('Content-Type: text/plain\n')
-            self.write('ETag: d5c7f3babf6c602a8da902fb301a9f27\n')
-            self.write('Content-Length: 21\n')
+            self.write('ETag: %s\n' % md5.new(self.object_content).hexdigest())
+            for header in self.object_headers.items():
+                self.write('%s: %s\n' % header)
+            self.write('Content-Length: %d\n' % len(self.object_content))
             self.write('Connection: close\n\n')
 
     def render_POST(self, path, args):
@@ -227,12 +193,31 @@ class TrackerSocket(FakeSocket):
         self.write('Connection: close\n\n')
 
     def render_PUT(self, path, args):
+        if len(path) >= 4:
+            etag = md5.new(self.body).hexdigest()
+            if self.headers.get('etag', etag) != etag:
+                self.write('HTTP/1.1 422 Unprocessable Entity\n')
+                self.write('Connection: close\n\n')
+                return
+            TrackerSocket.stored['/'.join(path[2:])] = \
+                    (self.headers, self.body)
+        self.write('HTTP/1.1 200 Ok\n')
+        self.write('Content-Type: text/plain\n')
+        if len(path) >= 4:
+            self.write('ETag: %s\n' % etag)
+        self.write('Connection: close\n\n')
+
+    def render_DELETE(self, path, args):
+        if path[-1] == 'busy':
+            self.write('HTTP/1.1 503 Service Unavailable\n')
+            self.write('Connection: close\n\n')
+            return
         self.write('HTTP/1.1 200 Ok\n')
         self.write('Content-Type: text/plain\n')
         self.write('Connection: close\n\n')
-    render_DELETE = render_PUT
 
     def render(self, method, uri):
+        TrackerSocket.log.append((method, uri))
         if '?' in uri:
             parts = uri.split('?')
             query = parts[1].strip('&').split('&')
@@ -242,6 +227,15 @@ class TrackerSocket(FakeSocket):
             args = {}
             path = uri.strip('/').split('/')
 
+        token = self.headers.get('x-auth-token')
+        if token in self.expiring_tokens:
+            if self.expiring_tokens[token] <= 0:
+                self.write('HTTP/1.1 401 Unauthorized\n')
+                self.write('Content-Length: 0\n')
+                self.write('Connection: close\n\n')
+                return
+            self.expiring_tokens[token] -= 1
+
         if hasattr(self, 'render_%s' % method):
             getattr(self, 'render_%s' % method)(path, args)
         else:
@@ -251,18 +245,151 @@ class TrackerSocket(FakeSocket):
 
     def makefile(self, mode, flags):
         self._rbuffer.seek(0)
-        lines = self.read().splitlines()
+        request = self.read()
+        self.body = request.split('\r\n\r\n', 1)[-1]
+        lines = request.splitlines()
         (method, uri, version) = lines[0].split()
+        self.headers = {}
+        for line in lines[1:]:
+            if not line:
+                break
+            (name, value) = line.split(':', 1)
+            self.headers[name.strip().lower()] = value.strip()
+        if self.headers.get('transfer-encoding') == 'chunked':
+            (chunks, rest) = ([], self.body)
+            while True:
+                (size, rest) = rest.split('\r\n', 1)
+                if not int(size, 16):
+                    break
+                chunks.append(rest[:int(size, 16)])
+                rest = rest[int(size, 16) + 2:]
+            self.body = ''.join(chunks)
 
         self.render(method, uri)
 
         self._wbuffer.seek(0)
         return self._wbuffer
 
+class CDNTrackerSocket(TrackerSocket):
+    """
+    Responds like the CDN management service, in which container1 and
+    container3 have been published, (and container3 since unpublished).
+    """
+    # The number of container HEAD requests made
+    heads = 0
+
+    def _create_GET_account_content(self, path, args):
+        published = [('container1', 'true'), ('container3', 'false')]
+        published = [i for i in published if i[0] > args.get('marker', '')]
+        if args.has_key('limit'):
+            published = published[:int(args['limit'])]
+        containers = ['{"name":"%s","cdn_enabled":%s,"ttl":86400,'
+                      '"cdn_uri":"http://cdn.fake/%s"}' % (i + i[:1])
+                      for i in published]
+        return '[\n%s\n]\n' % ',\n'.join(containers)
+
+    def render_HEAD(self, path, args):
+        CDNTrackerSocket.heads += 1
+        if path[-1] not in ('container1', 'container3'):
+            self.write('HTTP/1.1 404 Not Found\n')
+            self.write('Content-Length: 0\n')
+            self.write('Connection: close\n\n')
+            return
+        self.write('HTTP/1.1 204 No Content\n')
+        self.write('X-CDN-Enabled: %s\n' % (path[-1] == 'container1'))
+        self.write('X-CDN-URI: http://cdn.fake/%s\n' % path[-1])
+        self.write('X-TTL: 86400\n')
+        self.write('Connection: close\n\n')
+
+class KeepAliveTrackerSocket(TrackerSocket):
+    """
+    A TrackerSocket which keeps the connection open between requests, (and
+    so accepts pipelined requests), rendering each request as its response
+    is read.
+    """
+    def __init__(self):
+        TrackerSocket.__init__(self)
+        self._requests = ''
+        self._responses = ''
+
+    def send(self, data, flags=0):
+        self._requests += str(data)
+    sendall = send
+
+    def render_next(self):
+        (head, sep, rest) = self._requests.partition('\r\n\r\n')
+        if not sep:
+            return False
+        length = 0
+        for line in head.split('\r\n')[1:]:
+            (name, value) = line.split(':', 1)
+            if name.strip().lower() == 'content-length':
+                length = int(value)
+        if len(rest) < length:
+            return False
+        self._requests = rest[length:]
+        self._rbuffer = StringIO.StringIO(head + sep + rest[:length])
+        self._wbuffer = StringIO.StringIO()
+        TrackerSocket.makefile(self, 'rb', 0)
+        (head, sep, body) = self._wbuffer.getvalue().partition('\n\n')
+        lines = [i for i in head.split('\n')
+                 if not i.lower().startswith('connection:')]
+        if not [i for i in lines if i.lower().startswith('content-length:')]:
+            lines.append('Content-Length: %d' % len(body))
+        self._responses += '\r\n'.join(lines) + '\r\n\r\n' + body
+        return True
+
+    def makefile(self, mode, flags=-1):
+        return KeepAliveFile(self)
+
+class KeepAliveFile(object):
+    """
+    The read side of a KeepAliveTrackerSocket.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+
+    def read(self, size=-1):
+        sock = self.sock
+        while (size < 0 or len(sock._responses) < size) and \
+                sock.render_next():
+            pass
+        if size < 0:
+            size = len(sock._responses)
+        (data, sock._responses) = \
+                (sock._responses[:size], sock._responses[size:])
+        return data
+
+    def readline(self, size=-1):
+        sock = self.sock
+        while '\n' not in sock._responses and sock.render_next():
+            pass
+        end = sock._responses.find('\n') + 1 or len(sock._responses)
+        if size >= 0:
+            end = min(end, size)
+        (line, sock._responses) = \
+                (sock._responses[:end], sock._responses[end:])
+        return line
+
+    def close(self):
+        pass
+
 class CustomHTTPConnection(connbase):
     def connect(self):
         self.sock = TrackerSocket()
 
+class KeepAliveHTTPConnection(connbase):
+    # The number of sockets opened
+    connects = 0
+
+    def connect(self):
+        KeepAliveHTTPConnection.connects += 1
+        self.sock = KeepAliveTrackerSocket()
+
+class CustomCDNHTTPConnection(connbase):
+    def connect(self):
+        self.sock = CDNTrackerSocket()
+
 
 if __name__ == '__main__':
     conn = CustomHTTPConnection('localhost', 8000)
@@ -0,0 +1,42 @@
+
+import unittest
+from StringIO         import StringIO
+from misc             import printdoc
+from cloudfiles.fjson import json_loads, json_iter_loads
+
+class JSONTest(unittest.TestCase):
+    """
+    Incremental JSON parser tests.
+    """
+    @printdoc
+    def test_iter_loads(self):
+        """
+        Verify that json_iter_loads() yields the same elements as
+        json_loads(), however the document is split into chunks, including
+        strings containing brackets and escaped quotes.
+        """
+        records = ['{"name":"a\\\\b\\"c}%d{[","l":[1,{"x":"]"}]}' % i
+                   for i in range(20)]
+        doc = '[\n' + ',\n'.join(records) + '\n]\n'
+        for chunksize in (1, 2, 3, 7, 8192):
+            self.assert_(list(json_iter_loads(StringIO(doc), chunksize)) == \
+                         json_loads(doc))
+
+    @printdoc
+    def test_iter_loads_empty(self):
+        """
+        Verify that empty documents and arrays yield nothing.
+        """
+        self.assert_(list(json_iter_loads(StringIO(''))) == [])
+        self.assert_(list(json_iter_loads(StringIO('[\n]\n'))) == [])
+
+    @printdoc
+    def test_iter_loads_incomplete(self):
+        """
+        Verify that truncated documents, and ones without an array, raise
+        ValueError.
+        """
+        for doc in ('[{"name":"a"},{"na', '[{"name":"a"}', '["a', 'null'):
+            self.assertRaises(ValueError, list, json_iter_loads(StringIO(doc)))
+
+# vim:set ai sw=4 ts=4 tw=0 expandtab:
@@ -1,16 +1,24 @@
 #!/usr/bin/python
 
-import unittest, md5
+import unittest, md5, zlib
 from cloudfiles        import Object, Connection
+from cloudfiles.storage_object import _UploadJournal
+from cloudfiles import storage_object
+from cloudfiles.utils  import LRUCache, ChunkSize
+from cloudfiles.cache  import DiskCache, ChecksumIndex
 from cloudfiles.errors import ResponseError, InvalidObjectName,\
                               InvalidMetaName, InvalidMetaValue
 from cloudfiles.authentication import MockAuthentication as Auth
+from cloudfiles        import consts
 from cloudfiles.consts import meta_name_limit, meta_value_limit,\
                               object_name_limit
-from fakehttp          import CustomHTTPConnection
+from fakehttp          import CustomHTTPConnection, TrackerSocket, \
+                              KeepAliveHTTPConnection
 from misc              import printdoc
-from tempfile          import mktemp
-import os
+from tempfile          import mktemp, mkdtemp
+from StringIO          import StringIO
+from threading         import Thread
+import os, shutil
 
 class ObjectTest(unittest.TestCase):
     """
@@ -23,6 +31,74 @@ class ObjectTest(unittest.TestCase):
         """
         self.assert_("teapot" in self.storage_object.read())
 
+    @printdoc
+    def test_object_cache(self):
+        """
+        Verify that reads are answered from the object cache once the
+        content has been downloaded, and that the cache survives a restart.
+        """
+        cachedir = mkdtemp()
+        filename = mktemp()
+        try:
+            cache = self.conn.object_cache = DiskCache(cachedir)
+            content = TrackerSocket.object_content
+            self.assert_(self.storage_object.read() == content)
+            self.assert_(''.join(self.storage_object.stream(5)) == content)
+            self.storage_object.save_to_filename(filename)
+            self.assert_(open(filename).read() == content)
+            self.assert_((cache.hits, cache.misses) == (2, 1))
+            etag = md5.new(content).hexdigest()
+            self.assert_(DiskCache(cachedir).etag('container1', 'object1') \
+                             == etag)
+            self.storage_object.write('teapot')
+            self.assert_(cache.etag('container1', 'object1') is None)
+        finally:
+            shutil.rmtree(cachedir)
+            os.path.exists(filename) and os.unlink(filename)
+
+    @printdoc
+    def test_readinto(self):
+        """
+        Verify that Object.readinto() fills a caller's buffer, from an
+        offset, and reports how much was read, hanging up on a server which
+        ignores the Range rather than reading the rest of the object.
+        """
+        content = TrackerSocket.object_content
+        data = bytearray(len(content) + 5)
+        self.assert_(self.storage_object.readinto(data, chunksize=8) == \
+                     len(content))
+        self.assert_(str(data[:len(content)]) == content)
+        data = bytearray(6)
+        self.assert_(self.storage_object.readinto(data, offset=7) == 6)
+        self.assert_(str(data) == content[7:13])
+
+        self.conn.conn_class = KeepAliveHTTPConnection
+        self.conn.http_connect()
+        TrackerSocket.ignore_range = True
+        try:
+            self.assert_(self.storage_object.readinto(data) == 6)
+            self.assert_(str(data) == content[:6])
+            self.assert_(self.conn.connection.sock is None)
+            self.storage_object.readinto(data)
+            self.assertRaises(ResponseError, self.storage_object.readinto,
+                              data, offset=7)
+            self.assert_(self.conn.connection.sock is None)
+        finally:
+            TrackerSocket.ignore_range = False
+
+    @printdoc
+    def test_chunk_size(self):
+        """
+        Verify that transfers use the connection's chunk size unless one is
+        given explicitly.
+        """
+        content = TrackerSocket.object_content
+        self.conn.chunking = ChunkSize(10)
+        self.assert_([len(c) for c in self.storage_object.stream()] == \
+                     [10, 10, 10, 1])
+        self.assert_([len(c) for c in self.storage_object.stream(16)] == \
+                     [16, 15])
+
     @printdoc
     def test_read_pass_headers(self):
         """
@@ -43,6 +119,22 @@ class ObjectTest(unittest.TestCase):
         storage_object = self.container.create_object('bogus')
         self.assertRaises(ResponseError, storage_object.read)
 
+    @printdoc
+    def test_metadata_cache(self):
+        """
+        Verify that object HEADs are answered from the metadata cache, and
+        that writing the object invalidates its cached metadata.
+        """
+        self.conn.metadata_cache = LRUCache(16)
+        del TrackerSocket.log[:]
+        heads = lambda: [i for i in TrackerSocket.log if i[0] == 'HEAD']
+        self.assert_(self.container.get_object('object1').size == 31)
+        self.assert_(self.container.get_object('object1').size == 31)
+        self.assert_(len(heads()) == 1)
+        self.container.get_object('object1').write('teapot')
+        self.container.get_object('object1').etag
+        self.assert_(len(heads()) == 2)
+
     @printdoc
     def test_write(self):
         """
@@ -74,6 +166,212 @@ class ObjectTest(unittest.TestCase):
         path = os.path.join(os.path.dirname(__file__), 'samplefile.txt')
         self.storage_object.load_from_filename(path)
         
+    @printdoc
+    def test_write_mapped(self):
+        """
+        Verify that writing a file sends the mapped file from its current
+        position, (in slices), with its checksum sent up front for the
+        server to verify.
+        """
+        path = os.path.join(os.path.dirname(__file__), 'samplefile.txt')
+        content = open(path, 'rb').read()
+        progress = []
+        self.conn.chunking = ChunkSize(16)
+        self.storage_object.write(open(path, 'rb'),
+                callback=lambda sent, size: progress.append(sent))
+        (headers, body) = TrackerSocket.stored['container1/object1']
+        self.assert_(body == content)
+        self.assert_(headers['etag'] == md5.new(content).hexdigest())
+        self.assert_(self.storage_object.etag == headers['etag'])
+        self.assert_(progress[-1] == len(content) and len(progress) == 5)
+
+        fobj = open(path, 'rb')
+        fobj.seek(10)
+        self.storage_object.write(fobj)
+        (headers, body) = TrackerSocket.stored['container1/object1']
+        self.assert_(body == content[10:])
+        self.assert_(headers['etag'] == md5.new(content[10:]).hexdigest())
+        self.assert_(self.storage_object.size == len(content) - 10)
+
+    @printdoc
+    def test_write_pipelined(self):
+        """
+        Verify that writing a large stream reads and checksums it on their
+        own threads while sending it, and that read errors stop the send
+        at once, closing the connection, and are raised.
+        """
+        content = ''.join([chr(i % 256) for i in range(1000)])
+        progress = []
+        saved = (consts.pipelined_write_size, consts.write_pipeline_depth)
+        (consts.pipelined_write_size, consts.write_pipeline_depth) = (16, 2)
+        self.conn.chunking = ChunkSize(64)
+        try:
+            self.storage_object.write(StringIO(content),
+                    callback=lambda sent, size: progress.append(sent))
+            (headers, body) = TrackerSocket.stored['container1/object1']
+            self.assert_(body == content)
+            self.assert_(self.storage_object.etag ==
+                         md5.new(content).hexdigest())
+            self.assert_(progress == range(64, 1000, 64) + [1000])
+
+            class Failing(StringIO):
+                def read(self, size=-1):
+                    if self.tell() >= 256:
+                        raise IOError('read failed')
+                    return StringIO.read(self, size)
+            del progress[:]
+            self.assertRaises(IOError, self.storage_object.write,
+                    Failing(content),
+                    callback=lambda sent, size: progress.append(sent))
+            self.assert_(progress == range(64, 257, 64))
+            self.assert_(self.conn.connection.sock is None)
+        finally:
+            (consts.pipelined_write_size, consts.write_pipeline_depth) = saved
+
+    @printdoc
+    def test_compression(self):
+        """
+        Verify that Object.write() and Object.send() can compress what they
+        upload, recording the codec in the object's metadata and verifying
+        the compressed data, and that Object.read() and Object.stream()
+        decompress it again, (but not byte ranges), including from the
+        object cache, as does Object.save_to_filename() whether or not the
+        object cache is used.
+        """
+        content = 'the rain in spain falls mainly on the plain\n' * 100
+        self.storage_object.write(StringIO(content), compress='gzip')
+        (headers, body) = TrackerSocket.stored['container1/object1']
+        self.assert_(headers['x-object-meta-compression'] == 'gzip')
+        self.assert_(headers['transfer-encoding'] == 'chunked')
+        self.assert_(len(body) < len(content) / 10)
+        self.assert_(zlib.decompress(body, 16 + zlib.MAX_WBITS) == content)
+        self.assert_(self.storage_object.size == len(body))
+        self.assert_(self.storage_object.etag == md5.new(body).hexdigest())
+
+        self.storage_object.send(iter([content[:1000], content[1000:]]),
+                                 compress='gzip')
+        self.assert_(TrackerSocket.stored['container1/object1'][1] == body)
+        self.storage_object.write(content)
+        self.assert_('x-object-meta-compression' not in
+                     TrackerSocket.stored['container1/object1'][0])
+        self.assertRaises(ValueError, self.storage_object.write, content,
+                          compress='zstd')
+        checksummed = storage_object._checksummed
+        storage_object._checksummed = lambda chunks, checksum: \
+                checksummed(chunks, checksum.update('x') or checksum)
+        try:
+            self.assertRaises(ResponseError, self.storage_object.write,
+                              content, compress='gzip')
+            self.storage_object.write(content, verify=False, compress='gzip')
+        finally:
+            storage_object._checksummed = checksummed
+
+        saved = TrackerSocket.object_content
+        TrackerSocket.object_content = body
+        TrackerSocket.object_headers['X-Object-Meta-Compression'] = 'gzip'
+        try:
+            self.assert_(self.storage_object.read() == content)
+            buff = StringIO()
+            self.storage_object.read(buffer=buff, chunksize=16)
+            self.assert_(buff.getvalue() == content)
+            self.assert_(''.join(self.storage_object.stream(16)) == content)
+            self.assert_(self.storage_object.read(size=10) == body[:10])
+            self.assert_(self.storage_object.read(
+                         hdrs={'Range': 'bytes=0-9'}) == body[:10])
+            cachedir = mkdtemp()
+            try:
+                cache = self.conn.object_cache = DiskCache(cachedir)
+                self.assert_(self.storage_object.read() == content)
+                # A 304 carries no metadata; the codec is cached instead.
+                TrackerSocket.object_headers.clear()
+                self.assert_(self.storage_object.read() == content)
+                self.assert_(''.join(self.storage_object.stream(16)) ==
+                             content)
+                self.assert_((cache.hits, cache.misses) == (2, 1))
+                self.assert_(DiskCache(cachedir).encoding('container1',
+                                                          'object1') == 'gzip')
+                TrackerSocket.object_headers['X-Object-Meta-Compression'] = \
+                        'gzip'
+                self.storage_object.save_to_filename(os.path.join(cachedir,
+                                                                  'saved'))
+                self.assert_(open(os.path.join(cachedir, 'saved'),
+                                  'rb').read() == content)
+            finally:
+                self.conn.object_cache = None
+                shutil.rmtree(cachedir)
+            directory = mkdtemp()
+            try:
+                filename = os.path.join(directory, 'saved')
+                for threads in (1, 3):
+                    obj = self.storage_object.container.get_object('object1')
+                    obj.save_to_filename(filename, threads=threads,
+                                         chunksize=16)
+                    self.assert_(open(filename, 'rb').read() == content)
+            finally:
+                shutil.rmtree(directory)
+        finally:
+            TrackerSocket.object_content = saved
+            TrackerSocket.object_headers.clear()
+
+    @printdoc
+    def test_load_from_filename_segmented(self):
+        """
+        Verify that a segmented Object.load_from_filename() uploads
+        verified segments which reassemble into the file, followed by a
+        manifest object.
+        """
+        path = os.path.join(os.path.dirname(__file__), 'samplefile.txt')
+        content = open(path, 'rb').read()
+        prefix = 'container1/object1/%r/%d/20/' % (os.stat(path).st_mtime,
+                                                   len(content))
+        TrackerSocket.stored.clear()
+        TrackerSocket.stored['container1/object1/00000009'] = ({}, 'stale')
+        self.storage_object.load_from_filename(path, segment_size=20,
+                                               threads=3)
+        segments = sorted([k for k in TrackerSocket.stored
+                           if k.startswith(prefix)])
+        self.assert_(len(segments) == (len(content) + 19) / 20)
+        for key in segments:
+            self.assert_(TrackerSocket.stored[key][0]['etag'] == \
+                         md5.new(TrackerSocket.stored[key][1]).hexdigest())
+        self.assert_(''.join([TrackerSocket.stored[k][1] for k in segments])
+                     == content)
+        manifest = TrackerSocket.stored['container1/object1'][0]
+        self.assert_(manifest['x-object-manifest'] == prefix)
+        self.assert_(self.storage_object.size == len(content))
+        self.storage_object.write('plain')
+        self.assert_('x-object-manifest' not in
+                     TrackerSocket.stored['container1/object1'][0])
+        self.assert_(self.storage_object.manifest is None)
+
+    @printdoc
+    def test_load_from_filename_resumed(self):
+        """
+        Verify that a segmented upload skips segments recorded in its
+        journal, (unless the server disagrees about their etags), and
+        removes the journal once complete.
+        """
+        path = os.path.join(os.path.dirname(__file__), 'samplefile.txt')
+        journal = mktemp()
+        prefix = 'container1/object1/%r/%d/20/' % (os.stat(path).st_mtime,
+                                                   os.path.getsize(path))
+        etag = md5.new(TrackerSocket.object_content).hexdigest()
+        for (check, etag, skipped) in \
+                ((False, 'xxx', True),
+                 (True, 'xxx', False),
+                 (True, etag, True)):
+            TrackerSocket.stored.clear()
+            record = _UploadJournal(journal, 'container1/object1',
+                    os.path.getsize(path), os.stat(path).st_mtime, 20)
+            record.record(0, etag)
+            record.close()
+            self.storage_object.load_from_filename(path, segment_size=20,
+                    journal=journal, check_segments=check)
+            self.assert_((prefix + '00000000' not in
+                          TrackerSocket.stored) == skipped)
+            self.assert_(prefix + '00000001' in TrackerSocket.stored)
+            self.assert_(not os.path.exists(journal))
+
     @printdoc
     def test_save_to_filename(self):
         """Sanity test of Object.save_to_filename()."""
@@ -87,6 +385,39 @@ class ObjectTest(unittest.TestCase):
             rdr.close()
             os.unlink(tmpnam)
 
+    @printdoc
+    def test_save_to_filename_parallel(self):
+        """
+        Verify that a ranged, multi-threaded Object.save_to_filename()
+        reassembles the object and reports progress for every byte, and
+        fails should the object change part way.
+        """
+        tmpnam = mktemp()
+        progress = []
+        self.storage_object.save_to_filename(tmpnam, threads=3, range_size=4,
+                callback=lambda done, total: progress.append(done))
+        rdr = open(tmpnam, 'rb')
+        try:
+            content = self.storage_object.read()
+            self.assert_(rdr.read() == content,
+                   "save_to_filename() stored invalid content!")
+            self.assert_(max(progress) == len(content))
+            saved = TrackerSocket.object_content
+            TrackerSocket.object_content = 'replaced'
+            try:
+                try:
+                    self.storage_object.save_to_filename(tmpnam, threads=3,
+                                                         range_size=4)
+                except ResponseError, err:
+                    self.assert_(err.status == 412)
+                else:
+                    self.fail('A changed object was saved')
+            finally:
+                TrackerSocket.object_content = saved
+        finally:
+            rdr.close()
+            os.unlink(tmpnam)
+
     @printdoc
     def test_compute_md5sum(self):
         """
@@ -104,6 +435,81 @@ class ObjectTest(unittest.TestCase):
         finally:
             f.close()
             
+    @printdoc
+    def test_checksum_index(self):
+        """
+        Verify that written files and Object.compute_md5sum() record their
+        checksums in a ChecksumIndex, take them from it while the file is
+        unchanged, and that the index is bounded and can be saved.
+        """
+        directory = mkdtemp()
+        try:
+            path = os.path.join(directory, 'data')
+            open(path, 'w').write('the rain in spain')
+            index = ChecksumIndex(os.path.join(directory, 'index'),
+                                  max_entries=1)
+            self.conn.checksum_index = index
+            self.storage_object.write(open(path, 'rb'))
+            stat = os.stat(path)
+            self.assert_(index.get(stat) ==
+                         md5.new('the rain in spain').hexdigest())
+            index.put(stat, 'cached')
+            self.assert_(Object.compute_md5sum(open(path, 'rb'),
+                                               index=index) == 'cached')
+            open(path, 'a').write('!')
+            os.utime(path, (0, 0))
+            self.assert_(Object.compute_md5sum(open(path, 'rb'),
+                         index=index) == md5.new('the rain in spain!'
+                                                 ).hexdigest())
+            other = os.path.join(directory, 'other')
+            open(other, 'w').write('other')
+            index.checksum(other)
+            self.assert_(len(index) == 1)
+            index.save()
+            saved = ChecksumIndex(index.filename)
+            self.assert_(saved.get(os.stat(other)) ==
+                         md5.new('other').hexdigest())
+        finally:
+            self.conn.checksum_index = None
+            shutil.rmtree(directory)
+
+    @printdoc
+    def test_checksum_index_save(self):
+        """
+        Verify that a ChecksumIndex saved from many threads at once leaves
+        a complete file and no temporary files, and that loading it skips
+        malformed lines.
+        """
+        directory = mkdtemp()
+        try:
+            filename = os.path.join(directory, 'index')
+            index = ChecksumIndex(filename)
+            paths = []
+            for i in range(8):
+                paths.append(os.path.join(directory, 'data%d' % i))
+                open(paths[-1], 'w').write('data %d' % i)
+            def churn(path):
+                for i in range(20):
+                    index.checksum(path)
+                    index.save()
+            threads = [Thread(target=churn, args=(path,)) for path in paths]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assert_(sorted(os.listdir(directory)) == \
+                         sorted(['index'] + [os.path.basename(path)
+                                             for path in paths]))
+            fobj = open(filename, 'a')
+            fobj.write('bogus\tsize\t0.0\t1\t2\nbogus\n')
+            fobj.close()
+            saved = ChecksumIndex(filename)
+            self.assert_(len(saved) == len(paths))
+            self.assert_(saved.get(os.stat(paths[0])) ==
+                         md5.new('data 0').hexdigest())
+        finally:
+            shutil.rmtree(directory)
+
     @printdoc
     def test_bad_name(self):
         """
@@ -1,7 +1,10 @@
 
 import unittest
 from misc             import printdoc
-from cloudfiles.utils  import parse_url
+from threading        import Thread
+from time             import sleep
+from cloudfiles.utils  import parse_url, LRUCache, AdaptiveChunkSize, \
+                              iter_pages
 
 @printdoc
 def test_parse_url():
@@ -57,4 +60,82 @@ def check_url(test, urlspec):
     assert path == urlspec['path'], "%s failed on path assertion" % test
     assert ssl == urlspec['ssl'], "%s failed on ssl assertion" % test
 
+@printdoc
+def test_lru_cache():
+    """
+    Validate that LRUCache evicts the least recently used entry once full,
+    expires entries after their ttl, and counts hits and misses.
+    """
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None, "least recently used entry kept"
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert (cache.hits, cache.misses) == (3, 1)
+    cache.invalidate('a')
+    assert cache.get('a') is None and len(cache) == 1
+
+    cache = LRUCache(2, ttl=0.05)
+    cache.put('a', 1)
+    sleep(0.1)
+    assert cache.get('a') is None, "expired entry returned"
+
+@printdoc
+def test_adaptive_chunk_size():
+    """
+    Validate that AdaptiveChunkSize doubles toward the chunk size matching
+    its target call rate, (but no further than its maximum), and halves
+    back when throughput drops.
+    """
+    chunking = AdaptiveChunkSize(minimum=4096, maximum=65536,
+                                 calls_per_second=100, smoothing=1.0)
+    sizes = []
+    for i in range(6):
+        # 100MB/s wants ~1MB chunks, which is capped at the maximum.
+        chunking.observe(chunking.size, chunking.size / 100e6)
+        sizes.append(chunking.size)
+    assert sizes == [8192, 16384, 32768, 65536, 65536, 65536], sizes
+    # 1MB/s wants ~10KB chunks.
+    chunking.observe(chunking.size, chunking.size / 1e6)
+    chunking.observe(chunking.size, chunking.size / 1e6)
+    assert chunking.size == 16384, chunking.size
+
+@printdoc
+def test_adaptive_chunk_size_shared():
+    """
+    Validate that an AdaptiveChunkSize observed from many threads at once,
+    (as when shared by a pool), stays a power of two within its bounds.
+    """
+    chunking = AdaptiveChunkSize(minimum=4096, maximum=65536,
+                                 calls_per_second=100)
+    def observe(rate):
+        for i in range(2000):
+            chunking.observe(chunking.size, chunking.size / rate)
+    threads = [Thread(target=observe, args=(rate,))
+               for rate in (1e5, 1e6, 1e7, 1e8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert chunking.size in [2 ** i for i in range(12, 17)], chunking.size
+
+@printdoc
+def test_iter_pages_close():
+    """
+    Validate that closing an iter_pages() generator early waits for the
+    page being prefetched, (whose connection is closed next).
+    """
+    fetched = []
+    def fetch(marker):
+        if marker:
+            sleep(0.05)
+        fetched.append(marker)
+        return [{'name': '%s%d' % (marker or '', i)} for i in range(2)]
+    pages = iter_pages(fetch, 2, prefetch=True)
+    assert pages.next() == {'name': '0'}
+    pages.close()
+    assert fetched == [None, '1'], fetched
+
 # vim:set ai sw=4 ts=4 tw=0 expandtab: